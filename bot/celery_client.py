@@ -24,9 +24,14 @@ def _make_celery() -> Celery:
             "tasks.render.render_pdf_to_jpeg_300dpi": {"queue": pdf_queue},
             "tasks.render.process_and_publish_pdf": {"queue": pdf_queue},
             "tasks.render.process_and_publish_png": {"queue": publish_queue},
+            "tasks.render.publish_stored_pages": {"queue": publish_queue},
+            "tasks.render.publish_page": {"queue": publish_queue},
+            "tasks.render.publish_album": {"queue": publish_queue},
+            "tasks.render.record_publications": {"queue": publish_queue},
             "tasks.render.process_and_publish_doc": {"queue": office_queue},
             "tasks.render.process_and_publish_excel": {"queue": office_queue},
             "tasks.preview.generate_preview_task": {"queue": preview_queue},
+            "tasks.preview.generate_preview_pages_task": {"queue": preview_queue},
             "tasks.publish.send_document": {"queue": publish_queue},
         },
     )
@@ -8,9 +8,9 @@ import subprocess
 import shutil
 import tempfile
 import shutil
-from threading import Lock
+import uuid
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
 
 from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
@@ -59,20 +59,23 @@ except Exception:
     _FITZ_OK = False
 
 try:
-    from PIL import Image, ImageDraw, ImageFont
+    from PIL import Image
 
     _PIL_OK = True
 except Exception:
     _PIL_OK = False
 
-from common.watermark import WATERMARK_SETTINGS, WatermarkSettings
-from bot.storage import store_blob, load_blob, delete_blob, delete_many
+from common.watermark import WATERMARK_SETTINGS
+from common.watermark_engine import watermark_png_bytes
+from bot.storage import FULLRES_BLOB_PREFIX, store_blob, load_blob, delete_blob, delete_many, read_events, touch_blobs
 
 router = Router()
 
 MAX_FILE_SIZE = 20 * 1024 * 1024
 PREVIEW_QUEUE_NAME = os.getenv("CELERY_PREVIEW_QUEUE", "preview")
 PREVIEW_TASK_TIMEOUT = int(os.getenv("PREVIEW_TASK_TIMEOUT", "120"))
+PREVIEW_PREFETCH_PAGES = int(os.getenv("PREVIEW_PREFETCH_PAGES", "2"))
+PREVIEW_STREAM_PREFIX = os.getenv("PREVIEW_STREAM_PREFIX", "previewjob")
 SOURCE_PREFIXES = {
     "pdf": "pdf",
     "docx": "doc",
@@ -89,25 +92,29 @@ def _format_error(prefix: str, exc: Exception, *, limit: int = 3500) -> str:
     return f"{prefix}: {message}"
 
 
+def _item_storage_keys(item: Dict[str, Any]) -> Set[str]:
+    keys: Set[str] = set()
+    for field in ("source_key", "manifest_key", "render_key"):
+        key = item.get(field)
+        if key:
+            keys.add(key)
+    for page in item.get("pages") or []:
+        for field in ("fullres_key", "source_key"):
+            key = page.get(field)
+            if key:
+                keys.add(key)
+    return keys
+
+
 async def _release_storage_for_items(items: List[Dict[str, Any]]) -> None:
     unique_keys: Set[str] = set()
     for item in items:
-        source_key = item.get("source_key")
-        if source_key:
-            unique_keys.add(source_key)
-        for page in item.get("pages") or []:
-            for field in ("fullres_key", "source_key"):
-                key = page.get(field)
-                if key:
-                    unique_keys.add(key)
+        unique_keys |= _item_storage_keys(item)
     if unique_keys:
         await delete_many(unique_keys)
 
 _RENDER_LOCKS: Dict[int, asyncio.Lock] = {}
 _USE_CELERY_PUBLISH = os.getenv("ENABLE_CELERY_PUBLISH", "1").lower() not in {"0", "false", "no"}
-_WM_TILE_CACHE_SIZE = 32
-_WM_TILE_CACHE: Dict[Tuple[str, Tuple[str, str], int, int, int, Tuple[int, int, int], int, int, int], Image.Image] = {}
-_WM_TILE_LOCK = Lock()
 
 
 def _get_render_lock(user_id: int) -> asyncio.Lock:
@@ -134,18 +141,21 @@ async def _ensure_page_original_bytes(page: Dict[str, Any]) -> Optional[bytes]:
     return payload
 
 
-async def _fetch_preview_from_worker(
+async def _stream_preview_from_worker(
     render_format: str,
     filename: str,
     *,
     storage_key: str | None,
     blob: bytes | None,
-) -> Dict[str, Any]:
+) -> AsyncIterator[Dict[str, Any]]:
+    """Run the preview task and yield its ``page`` events, then the ``done`` event."""
     celery_app = get_celery()
     queue_name = PREVIEW_QUEUE_NAME
+    stream_key = f"{PREVIEW_STREAM_PREFIX}:{uuid.uuid4().hex}"
     kwargs = {
         "filename": filename,
         "render_format": render_format,
+        "stream_key": stream_key,
     }
     if storage_key:
         kwargs["file_key"] = storage_key
@@ -159,21 +169,123 @@ async def _fetch_preview_from_worker(
         kwargs=kwargs,
         queue=queue_name,
     )
+    try:
+        async for event in read_events(stream_key, timeout=PREVIEW_TASK_TIMEOUT):
+            kind = event.get("event")
+            if kind == "error":
+                raise RuntimeError(event.get("message") or "Ошибка превью-задачи.")
+            yield event
+            if kind == "done":
+                return
+    except asyncio.TimeoutError as exc:
+        raise RuntimeError("Превью готовится дольше обычного. Попробуйте повторить позже.") from exc
+    finally:
+        try:
+            async_result.forget()
+        except Exception:
+            pass
+        try:
+            await delete_blob(stream_key)
+        except Exception:
+            pass
+
+_PAGE_META_KEYS = (
+    "sheet_name",
+    "table_range",
+    "sheet_index",
+    "sheets_total",
+    "table_index",
+    "tables_in_sheet",
+    "base_name",
+    "display_name",
+    "page_index",
+    "pages_total",
+    "page_id",
+)
+
+
+def _page_id(page: Dict[str, Any], default: int = 0) -> int:
+    """Unique page id within an item: ``page_id`` (spreadsheet tables) or the page number."""
+    return int(page.get("page_id") or page.get("page_index") or default)
+
+
+async def _page_from_worker_entry(entry: Dict[str, Any], filename: str) -> Optional[Dict[str, Any]]:
+    preview_key = entry.get("preview_key")
+    if not preview_key:
+        logger.warning("render: preview key missing for %s", filename)
+        return None
+    try:
+        preview_bytes = await load_blob(preview_key, delete=True)
+    except Exception:
+        logger.warning("render: failed to load preview page for %s (key=%s)", filename, preview_key)
+        return None
+
+    page_info: Dict[str, Any] = {
+        "filename": entry.get("filename") or filename,
+        "original_bytes": None,
+        "watermarked_bytes": None,
+        "preview_original_bytes": preview_bytes,
+        "preview_watermarked_bytes": None,
+        "selected": True,
+    }
+    fullres_key = entry.get("fullres_key")
+    if fullres_key:
+        page_info["fullres_key"] = fullres_key
+    for key in _PAGE_META_KEYS:
+        if key in entry:
+            page_info[key] = entry[key]
+    return page_info
+
+
+async def _fetch_pages_from_worker(manifest_key: str, page_indices: List[int]) -> Dict[str, Any]:
+    celery_app = get_celery()
+    async_result = celery_app.send_task(
+        "tasks.preview.generate_preview_pages_task",
+        kwargs={
+            "manifest_key": manifest_key,
+            "page_indices": page_indices,
+            "prefetch": PREVIEW_PREFETCH_PAGES,
+        },
+        queue=PREVIEW_QUEUE_NAME,
+    )
     try:
         result = await asyncio.to_thread(async_result.get, timeout=PREVIEW_TASK_TIMEOUT)
         if not isinstance(result, dict):
             raise RuntimeError("Неверный ответ превью-задачи.")
         return result
     except CeleryTimeout as exc:
-        raise RuntimeError("Превью готовится дольше обычного. Попробуйте повторить позже.") from exc
-    except Exception as exc:
-        raise RuntimeError(str(exc)) from exc
+        raise RuntimeError("Страница готовится дольше обычного. Попробуйте повторить позже.") from exc
     finally:
         try:
             async_result.forget()
         except Exception:
             pass
 
+
+async def _ensure_page_rendered(item: Dict[str, Any], page: Dict[str, Any]) -> bool:
+    """Render a lazily previewed page on demand. Returns True if the item changed."""
+    if not page.get("pending"):
+        return False
+    manifest_key = item.get("manifest_key")
+    page_index = page.get("page_index")
+    if not manifest_key or not page_index:
+        return False
+    result = await _fetch_pages_from_worker(manifest_key, [int(page_index)])
+    by_id = {_page_id(entry): entry for entry in result.get("pages") or []}
+    changed = False
+    for idx, existing in enumerate(item["pages"]):
+        entry = by_id.get(_page_id(existing))
+        if entry is None or not existing.get("pending"):
+            continue
+        page_info = await _page_from_worker_entry(entry, item.get("source") or "document")
+        if page_info is None:
+            continue
+        page_info["selected"] = existing.get("selected", True)
+        existing.clear()
+        existing.update(page_info)
+        changed = True
+    return changed
+
 ROW_GAP_TOLERANCE = 3
 
 
@@ -691,105 +803,10 @@ def _extract_excel_tables(excel_bytes: bytes, filename: str) -> dict[str, Any]:
         wb.close()
 
 
-def _load_font(size: int, settings: WatermarkSettings = WATERMARK_SETTINGS) -> ImageFont.FreeTypeFont:
-    candidates = [
-        settings.font_preferred,
-        "Roboto-Bold.ttf",
-        "Roboto-Regular.ttf",
-        "/usr/share/fonts/truetype/roboto/Roboto-Bold.ttf",
-        "/usr/share/fonts/truetype/roboto/Roboto-Regular.ttf",
-        settings.font_fallback,
-        "DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-    ]
-    for path in candidates:
-        try:
-            return ImageFont.truetype(path, size=size)
-        except Exception:
-            continue
-    return ImageFont.load_default()
-
-
-def _wm_cache_key(
-    text: str,
-    font: ImageFont.FreeTypeFont,
-    cfg: WatermarkSettings,
-    tile_w: int,
-    tile_h: int,
-) -> Tuple[str, Tuple[str, str], int, int, int, Tuple[int, int, int], int, int, int]:
-    font_name = font.getname()
-    font_size = getattr(font, "size", 0)
-    return (
-        text,
-        font_name,
-        font_size,
-        tile_w,
-        tile_h,
-        cfg.color,
-        cfg.opacity,
-        cfg.angle,
-        cfg.text_offset,
-    )
-
-
-def _wm_get_tile(
-    text: str,
-    font: ImageFont.FreeTypeFont,
-    cfg: WatermarkSettings,
-    tile_w: int,
-    tile_h: int,
-) -> Image.Image:
-    key = _wm_cache_key(text, font, cfg, tile_w, tile_h)
-    with _WM_TILE_LOCK:
-        cached = _WM_TILE_CACHE.get(key)
-        if cached is not None:
-            return cached
-
-    tile = Image.new("RGBA", (tile_w, tile_h), (0, 0, 0, 0))
-    drawer = ImageDraw.Draw(tile)
-    bbox = drawer.textbbox((0, 0), text, font=font)
-    tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
-    color = (*cfg.color, max(16, min(255, cfg.opacity)))
-    if cfg.text_offset < 0:
-        pos_x = (tile_w - tw) // 2
-        pos_y = (tile_h - th) // 2
-    else:
-        pos_x = cfg.text_offset
-        pos_y = cfg.text_offset
-    drawer.text((pos_x, pos_y), text, font=font, fill=color)
-    rotated = tile.rotate(cfg.angle, expand=True)
-
-    with _WM_TILE_LOCK:
-        if len(_WM_TILE_CACHE) >= _WM_TILE_CACHE_SIZE:
-            _WM_TILE_CACHE.pop(next(iter(_WM_TILE_CACHE)))
-        _WM_TILE_CACHE[key] = rotated
-    return rotated
-
-
 def _watermark_bytes(png_bytes: bytes, text: str) -> bytes:
     if not _PIL_OK:
         raise RuntimeError("Pillow недоступен для нанесения водяного знака.")
-    cfg = WATERMARK_SETTINGS
-    with Image.open(io.BytesIO(png_bytes)).convert("RGBA") as img:
-        width, height = img.size
-        overlay = Image.new("RGBA", (width, height), (0, 0, 0, 0))
-        font_size = max(cfg.min_font_size, int(max(width, height) * cfg.font_scale))
-        font = _load_font(font_size, cfg)
-
-        tile_w = max(64, int(width * cfg.tile_scale_x))
-        tile_h = max(64, int(height * cfg.tile_scale_y))
-        rotated = _wm_get_tile(text, font, cfg, tile_w, tile_h)
-
-        base_step = max(1, cfg.step)
-        step_x = max(base_step, rotated.width // 2)
-        step_y = max(base_step, rotated.height // 2)
-        for x in range(-rotated.width, width + rotated.width, step_x):
-            for y in range(-rotated.height, height + rotated.height, step_y):
-                overlay.alpha_composite(rotated, dest=(x, y))
-        stamped = Image.alpha_composite(img, overlay).convert("RGB")
-    out = io.BytesIO()
-    stamped.save(out, format="PNG")
-    return out.getvalue()
+    return watermark_png_bytes(png_bytes, text, settings=WATERMARK_SETTINGS)
 
 
 async def _apply_watermark_to_items(items: List[Dict[str, Any]], text: str) -> None:
@@ -817,9 +834,13 @@ async def _apply_watermark_to_items(items: List[Dict[str, Any]], text: str) -> N
 async def _ensure_watermark_for_all(items: List[Dict[str, Any]], text: str) -> None:
     pending: List[Dict[str, Any]] = []
     for item in items:
-        need = any(page.get("watermarked_bytes") is None for page in item["pages"])
-        if need:
-            pending.append(item)
+        pages = [
+            page
+            for page in item["pages"]
+            if page.get("watermarked_bytes") is None and not page.get("pending")
+        ]
+        if pages:
+            pending.append({"pages": pages})
     if pending:
         await _apply_watermark_to_items(pending, text)
 
@@ -1018,6 +1039,17 @@ async def _update_render_card(bot, chat_id: int, state: FSMContext, *, focus: st
 
     item_idx, page_idx = flat[index]
     page = items[item_idx]["pages"][page_idx]
+    try:
+        # Keep rendered pages alive while the user is browsing the preview.
+        await touch_blobs(_item_storage_keys(items[item_idx]))
+    except Exception:
+        logger.debug("render: failed to extend storage TTL", exc_info=True)
+    if page.get("pending"):
+        try:
+            if await _ensure_page_rendered(items[item_idx], page):
+                await state.update_data(render_items=items)
+        except Exception:
+            logger.exception("render: on-demand page render failed (page=%s)", page.get("page_index"))
     wm_text: str | None = data.get("render_wm_text")
     if wm_text:
         await _ensure_watermark_for_all([items[item_idx]], wm_text)
@@ -1221,6 +1253,109 @@ async def render_xlsx_start(m: Message, state: FSMContext):
     )
 
 
+def _find_item(items: List[Dict[str, Any]], item_id: str) -> Optional[Dict[str, Any]]:
+    for item in items:
+        if item.get("item_id") == item_id:
+            return item
+    return None
+
+
+async def _attach_streamed_item(m: Message, state: FSMContext, status_msg: Message, new_item: Dict[str, Any]) -> None:
+    lock = _get_render_lock(m.from_user.id)
+    async with lock:
+        latest = await state.get_data()
+        items: List[Dict[str, Any]] = list(latest.get("render_items") or [])
+        items.append(new_item)
+
+        wm_text = latest.get("render_wm_text")
+        if wm_text:
+            try:
+                await _apply_watermark_to_items([new_item], wm_text)
+            except Exception as e:
+                logger.exception("render: watermark failed name=%s", new_item.get("source"))
+                await m.answer(_format_error("Не удалось применить водяной знак", e))
+
+        await state.set_state(RenderSession.idle)
+        await state.update_data(render_items=items)
+
+        try:
+            await status_msg.delete()
+        except Exception:
+            pass
+
+        try:
+            await _update_render_card(m.bot, m.chat.id, state, focus="last")
+        except Exception as e:
+            logger.exception("render: failed to update preview name=%s", new_item.get("source"))
+            await m.answer(f"Не удалось сформировать превью: {e}")
+
+
+async def _append_streamed_page(state: FSMContext, user_id: int, item_id: str, page_info: Dict[str, Any]) -> None:
+    lock = _get_render_lock(user_id)
+    async with lock:
+        data = await state.get_data()
+        items: List[Dict[str, Any]] = list(data.get("render_items") or [])
+        item = _find_item(items, item_id)
+        if item is None:
+            # The session was cancelled while the document was still rendering.
+            await delete_blob(page_info.get("fullres_key"))
+            return
+        wm_text = data.get("render_wm_text")
+        if wm_text:
+            try:
+                await _apply_watermark_to_items([{"pages": [page_info]}], wm_text)
+            except Exception:
+                logger.exception("render: watermark failed for streamed page %s", page_info.get("filename"))
+        item["pages"].append(page_info)
+        await state.update_data(render_items=items)
+
+
+async def _finish_streamed_item(
+    bot,
+    chat_id: int,
+    state: FSMContext,
+    user_id: int,
+    item_id: str,
+    summary: Dict[str, Any],
+    *,
+    refresh: bool,
+) -> None:
+    lock = _get_render_lock(user_id)
+    async with lock:
+        data = await state.get_data()
+        items: List[Dict[str, Any]] = list(data.get("render_items") or [])
+        item = _find_item(items, item_id)
+        if item is None:
+            await delete_many([summary.get("manifest_key"), summary.get("render_key")])
+            return
+        item["manifest_key"] = summary.get("manifest_key")
+        item["render_key"] = summary.get("render_key")
+        if item.get("format") == "xlsx":
+            item["sheets_total"] = (summary.get("analysis") or {}).get("sheets_total")
+
+        # Lazy preview: the remaining pages are rendered when the user reaches them.
+        for entry in summary.get("pending_pages") or []:
+            item["pages"].append(
+                {
+                    "filename": entry.get("filename") or item.get("source"),
+                    "original_bytes": None,
+                    "watermarked_bytes": None,
+                    "preview_original_bytes": None,
+                    "preview_watermarked_bytes": None,
+                    "selected": True,
+                    "pending": True,
+                    "page_index": entry.get("page_index"),
+                    "pages_total": entry.get("pages_total"),
+                }
+            )
+        await state.update_data(render_items=items)
+        if refresh:
+            try:
+                await _update_render_card(bot, chat_id, state)
+            except Exception:
+                logger.exception("render: failed to refresh preview card name=%s", item.get("source"))
+
+
 @router.message(RenderSession.waiting_file, F.document)
 async def render_file_receive(m: Message, state: FSMContext):
     data = await state.get_data()
@@ -1292,101 +1427,72 @@ async def render_file_receive(m: Message, state: FSMContext):
 
         storage_key: str | None = None
         prefix = SOURCE_PREFIXES.get(render_format, "file")
+        user_id = m.from_user.id
+        item_id = uuid.uuid4().hex
+        shown = False
+        streamed_after_card = 0
         try:
             storage_key = await store_blob(prefix, blob)
-            preview_result = await _fetch_preview_from_worker(
+            async for event in _stream_preview_from_worker(
                 render_format,
                 filename,
                 storage_key=storage_key,
                 blob=blob,
-            )
+            ):
+                if event.get("event") == "done":
+                    if not shown:
+                        raise RuntimeError("Не удалось подготовить страницы для предпросмотра.")
+                    logger.info(
+                        "render: preview ready format=%s name=%s bytes=%s -> pages=%s",
+                        render_format,
+                        filename,
+                        len(blob),
+                        event.get("pages_total"),
+                    )
+                    await _finish_streamed_item(
+                        m.bot,
+                        m.chat.id,
+                        state,
+                        user_id,
+                        item_id,
+                        event,
+                        refresh=bool(streamed_after_card or event.get("pending_pages")),
+                    )
+                    break
+
+                page_info = await _page_from_worker_entry(event, filename)
+                if page_info is None:
+                    continue
+                if render_format == "png":
+                    page_info["source_key"] = storage_key
+                    if page_info.get("fullres_key") is None and storage_key:
+                        page_info["fullres_key"] = storage_key
+                if shown:
+                    await _append_streamed_page(state, user_id, item_id, page_info)
+                    streamed_after_card += 1
+                    continue
+
+                # First page: show the card right away, the rest streams in behind it.
+                new_item: Dict[str, Any] = {
+                    "item_id": item_id,
+                    "source": filename,
+                    "format": render_format,
+                    "source_key": storage_key,
+                    "pages": [page_info],
+                }
+                storage_key = None
+                shown = True
+                await _attach_streamed_item(m, state, status_msg, new_item)
         except Exception as exc:
             if storage_key:
                 await delete_blob(storage_key)
             logger.exception("render: preview failed format=%s name=%s", render_format, filename)
-            await status_msg.edit_text(_format_error("Не удалось подготовить страницы", exc))
+            message = _format_error("Не удалось подготовить страницы", exc)
+            if shown:
+                await m.answer(message)
+            else:
+                await status_msg.edit_text(message)
             return
-
-        pages_raw = list(preview_result.get("pages") or [])
-        analysis = preview_result.get("analysis") or {}
-        if not pages_raw:
-            if storage_key:
-                await delete_blob(storage_key)
-            raise RuntimeError("Не удалось подготовить страницы для предпросмотра.")
-
-        logger.info("render: preview ready format=%s name=%s bytes=%s -> pages=%s", render_format, filename, len(blob), len(pages_raw))
-
-        new_pages: List[Dict[str, Any]] = []
-        for entry in pages_raw:
-            preview_key = entry.get("preview_key")
-            if not preview_key:
-                logger.warning("render: preview key missing for %s", filename)
-                continue
-            try:
-                preview_bytes = await load_blob(preview_key, delete=True)
-            except Exception:
-                logger.warning("render: failed to load preview page for %s (key=%s)", filename, preview_key)
-                continue
-
-            page_info: Dict[str, Any] = {
-                "filename": entry.get("filename") or filename,
-                "original_bytes": None,
-                "watermarked_bytes": None,
-                "preview_original_bytes": preview_bytes,
-                "preview_watermarked_bytes": None,
-                "selected": True,
-            }
-            fullres_key = entry.get("fullres_key")
-            if fullres_key:
-                page_info["fullres_key"] = fullres_key
-
-            for key in ("sheet_name", "table_range", "sheet_index", "sheets_total", "table_index", "tables_in_sheet", "base_name", "display_name", "page_index", "pages_total"):
-                if key in entry:
-                    page_info[key] = entry[key]
-
-            if render_format == "png":
-                page_info["source_key"] = storage_key
-                if fullres_key is None and storage_key:
-                    page_info["fullres_key"] = storage_key
-            new_pages.append(page_info)
-
-        new_item: Dict[str, Any] = {
-            "source": filename,
-            "format": render_format,
-            "source_key": storage_key,
-            "pages": new_pages,
-        }
-        if render_format == "xlsx":
-            new_item["sheets_total"] = analysis.get("sheets_total")
-
-        lock = _get_render_lock(m.from_user.id)
-        async with lock:
-            latest = await state.get_data()
-            items: List[Dict[str, Any]] = list(latest.get("render_items") or [])
-            items.append(new_item)
-            storage_key = None
-
-            wm_text = latest.get("render_wm_text")
-            if wm_text:
-                try:
-                    await _apply_watermark_to_items([new_item], wm_text)
-                except Exception as e:
-                    logger.exception("render: watermark failed format=%s name=%s", render_format, filename)
-                    await m.answer(_format_error("Не удалось применить водяной знак", e))
-
-            await state.set_state(RenderSession.idle)
-            await state.update_data(render_items=items)
-
-            try:
-                await status_msg.delete()
-            except Exception:
-                pass
-
-            try:
-                await _update_render_card(m.bot, m.chat.id, state, focus="last")
-            except Exception as e:
-                logger.exception("render: failed to update preview format=%s name=%s", render_format, filename)
-                await m.answer(f"Не удалось сформировать превью: {e}")
     except Exception as e:
         try:
             if locals().get("storage_key"):
@@ -1657,13 +1763,21 @@ async def render_pdf_upload_to_channel(cq: CallbackQuery, state: FSMContext):
         for idx, page in enumerate(pages, start=1):
             if item_format in {"xlsx", "docx", "pdf", "png"} and not page.get("selected", True):
                 continue
-            selected_pages.append((int(page.get("page_index") or idx), page))
+            selected_pages.append((_page_id(page, idx), page))
         if not selected_pages:
             continue
 
         if not use_worker:
             fullres_cleanup: Set[str] = set()
             for _, page in selected_pages:
+                if page.get("pending"):
+                    try:
+                        await _ensure_page_rendered(item, page)
+                    except Exception:
+                        logger.exception("render: failed to render page %s before upload", page.get("page_index"))
+                        continue
+                    if wm_text:
+                        await _ensure_watermark_for_all([item], wm_text)
                 await _ensure_page_original_bytes(page)
                 payload = None
                 if wm_text:
@@ -1691,101 +1805,72 @@ async def render_pdf_upload_to_channel(cq: CallbackQuery, state: FSMContext):
         if celery_app is None:
             continue
 
-        png_pages: List[Tuple[int, Dict[str, Any], str]] = []
-        missing_pages: List[Tuple[int, Dict[str, Any]]] = []
+        manifest_key = item.get("manifest_key")
+        try:
+            alive_keys = await touch_blobs(_item_storage_keys(item))
+        except Exception:
+            logger.warning("render: failed to refresh storage TTL before upload", exc_info=True)
+            alive_keys = _item_storage_keys(item)
+
+        # One publish job per item: pages go out as a single ordered chain
+        # (albums when PUBLISH_ALBUM is on), never as independent tasks.
+        stored_pages: List[Dict[str, Any]] = []
+        missing_pages: List[int] = []
         for page_index, page in selected_pages:
+            filename = page.get("filename") or "smeta.png"
             fullres_key = page.get("fullres_key")
-            if fullres_key:
-                png_pages.append((page_index, page, fullres_key))
-            else:
-                missing_pages.append((page_index, page))
-
-        for _, page, fullres_key in png_pages:
-            celery_app.send_task(
-                "tasks.render.process_and_publish_png",
-                kwargs={
-                    "chat_id": channel_id,
-                    "png_key": fullres_key,
-                    "watermark_text": wm_text,
-                    "filename": page.get("filename") or "smeta.png",
-                    "apply_watermark": bool(wm_text),
-                },
-                queue=publish_queue,
-            )
-
-        if not missing_pages:
-            continue
-
-        if item_format == "png":
-            for _, page in missing_pages:
-                fallback_key = page.get("source_key") or item.get("source_key")
-                if fallback_key:
-                    celery_app.send_task(
-                        "tasks.render.process_and_publish_png",
-                        kwargs={
-                            "chat_id": channel_id,
-                            "png_key": fallback_key,
-                            "watermark_text": wm_text,
-                            "filename": page.get("filename") or "smeta.png",
-                            "apply_watermark": bool(wm_text),
-                        },
-                        queue=publish_queue,
-                    )
-                    continue
+            if fullres_key and fullres_key in alive_keys:
+                stored_pages.append(
+                    {"page_id": page_index, "page_key": fullres_key, "filename": filename, "keep": bool(manifest_key)}
+                )
+                continue
+            if item_format != "png":
+                missing_pages.append(page_index)
+                continue
+            fallback_key = page.get("source_key") or item.get("source_key")
+            if not fallback_key:
                 await _ensure_page_original_bytes(page)
                 page_bytes = page.get("original_bytes") or page.get("preview_original_bytes")
                 if not page_bytes:
                     continue
-                encoded = base64.b64encode(page_bytes).decode("ascii")
-                celery_app.send_task(
-                    "tasks.render.process_and_publish_png",
-                    kwargs={
-                        "chat_id": channel_id,
-                        "png_b64": encoded,
-                        "watermark_text": wm_text,
-                        "filename": page.get("filename") or "smeta.png",
-                        "apply_watermark": bool(wm_text),
-                    },
-                    queue=publish_queue,
-                )
-            continue
+                fallback_key = await store_blob(FULLRES_BLOB_PREFIX, page_bytes)
+            stored_pages.append({"page_id": page_index, "page_key": fallback_key, "filename": filename})
 
         source_key = item.get("source_key")
-        if not source_key:
-            await cq.message.answer(f"�� ������ �������� ���� ��� {item.get('source') or '���������'}.")
-            continue
-
-        page_numbers = [idx for idx, _ in missing_pages]
-        task_kwargs = {
-            "chat_id": channel_id,
-            "watermark_text": wm_text,
-            "filename": item.get("source") or "document",
-            "page_indices": page_numbers,
-        }
-
-        if item_format == "pdf":
-            task_kwargs["pdf_key"] = source_key
+        rerender = {
+            "pdf": ("tasks.render.process_and_publish_pdf", pdf_queue, "pdf_key"),
+            "docx": ("tasks.render.process_and_publish_doc", office_queue, "doc_key"),
+            "xlsx": ("tasks.render.process_and_publish_excel", office_queue, "excel_key"),
+        }.get(item_format)
+        if missing_pages and rerender and source_key:
+            # The render task reuses the pages still in storage, renders only the
+            # missing ones and publishes the whole selection as one chain.
+            task_name, task_queue, source_arg = rerender
             celery_app.send_task(
-                "tasks.render.process_and_publish_pdf",
-                kwargs=task_kwargs,
-                queue=pdf_queue,
-            )
-        elif item_format == "docx":
-            task_kwargs["doc_key"] = source_key
-            celery_app.send_task(
-                "tasks.render.process_and_publish_doc",
-                kwargs=task_kwargs,
-                queue=office_queue,
+                task_name,
+                kwargs={
+                    "chat_id": channel_id,
+                    "watermark_text": wm_text,
+                    "filename": item.get("source") or "document",
+                    "page_indices": [idx for idx, _ in selected_pages],
+                    "manifest_key": manifest_key,
+                    "stored_pages": stored_pages,
+                    source_arg: source_key,
+                },
+                queue=task_queue,
             )
-        elif item_format == "xlsx":
-            task_kwargs["excel_key"] = source_key
+            continue
+        if missing_pages:
+            if not source_key:
+                await cq.message.answer(f"�� ������ �������� ���� ��� {item.get('source') or '���������'}.")
+            else:
+                await cq.message.answer(f"������ {item_format} ���� �� ��������� ��� ������� ����������.")
+        if stored_pages:
             celery_app.send_task(
-                "tasks.render.process_and_publish_excel",
-                kwargs=task_kwargs,
-                queue=office_queue,
+                "tasks.render.publish_stored_pages",
+                kwargs={"chat_id": channel_id, "pages": stored_pages, "watermark_text": wm_text},
+                queue=publish_queue,
             )
-        else:
-            await cq.message.answer(f"������ {item_format} ���� �� ��������� ��� ������� ����������.")
     choose_mid = data.get("render_choose_mid")
     if choose_mid:
         try:
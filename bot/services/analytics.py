@@ -1,11 +1,39 @@
+import os
+from datetime import date
 from typing import Optional
-from .db import fetchrow, fetch
+from .db import execute, fetchrow, fetch, transaction
 
-# analytics.profile_overview (VIEW) — агрегат для "Мой профиль"
+# Снимок старше этого (сек) не отдаём — считаем по живому представлению.
+PROFILE_OVERVIEW_MAX_STALENESS = int(os.getenv("PROFILE_OVERVIEW_MAX_STALENESS", "300"))
+
+
+# analytics.profile_overview (MATERIALIZED VIEW) — агрегат для "Мой профиль".
+# Один индексный поиск; если снимок устарел или подрядчик появился после
+# последнего REFRESH — запасной путь через analytics.profile_overview_live.
 async def profile_overview(contractor_id: int) -> Optional[dict]:
-    row = await fetchrow("SELECT * FROM analytics.profile_overview WHERE contractor_id = $1;", contractor_id)
+    row = await fetchrow(
+        """
+        SELECT * FROM analytics.profile_overview
+        WHERE contractor_id = $1
+          AND refreshed_at > now() - make_interval(secs => $2);
+        """,
+        contractor_id, PROFILE_OVERVIEW_MAX_STALENESS,
+    )
+    if row is None:
+        row = await fetchrow("SELECT * FROM analytics.profile_overview_live WHERE contractor_id = $1;", contractor_id)
     return dict(row) if row else None
 
+
+# REFRESH CONCURRENTLY не блокирует читателей; advisory lock не даёт двум
+# воркерам обновлять снимок одновременно.  False — обновление уже идёт.
+async def refresh_profile_overview() -> bool:
+    async with transaction() as conn:
+        locked = await conn.fetchval("SELECT pg_try_advisory_xact_lock(hashtext('analytics.profile_overview'));")
+        if not locked:
+            return False
+        await conn.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY analytics.profile_overview;")
+    return True
+
 # Пример: последние события (если используете analytics.events)
 async def recent_events(channel_id: int, limit: int = 50) -> list[dict]:
     rows = await fetch(
@@ -13,3 +41,154 @@ async def recent_events(channel_id: int, limit: int = 50) -> list[dict]:
         channel_id, limit
     )
     return [dict(r) for r in rows]
+
+
+def _affected(status: str) -> int:
+    """Число строк из статуса команды asyncpg ("INSERT 0 42" -> 42)."""
+    try:
+        return int(status.rsplit(" ", 1)[-1])
+    except (ValueError, AttributeError):
+        return 0
+
+
+# analytics.views_daily — снимок просмотров всех публикаций за день одним запросом
+async def snapshot_views_daily(day: date) -> int:
+    status = await execute(
+        """
+        INSERT INTO analytics.views_daily (publication_id, collected_at, views)
+        SELECT p.id, $1::date, p.views
+        FROM core.publications p
+        WHERE p.views > 0 AND p.deleted = FALSE
+        ON CONFLICT (publication_id, collected_at) DO UPDATE
+            SET views = EXCLUDED.views
+            WHERE analytics.views_daily.views IS DISTINCT FROM EXCLUDED.views;
+        """,
+        day,
+    )
+    return _affected(status)
+
+
+_CHANNEL_STATS_RECOMPUTE = """
+        SELECT c.id AS channel_id,
+               COALESCE(p.files_count, 0) AS files_count,
+               COALESCE(p.views_total, 0) AS views_total,
+               COALESCE(cl.clients_total, 0) AS clients_total,
+               COALESCE(cl.blocked_total, 0) AS blocked_total
+        FROM core.channels c
+        LEFT JOIN (
+            SELECT channel_id, COUNT(*) AS files_count, SUM(views) AS views_total
+            FROM core.publications
+            WHERE deleted = FALSE {channel_filter}
+            GROUP BY channel_id
+        ) p ON p.channel_id = c.id
+        LEFT JOIN (
+            SELECT channel_id,
+                   COUNT(*) AS clients_total,
+                   COUNT(*) FILTER (WHERE blocked) AS blocked_total
+            FROM core.clients
+            WHERE TRUE {channel_filter}
+            GROUP BY channel_id
+        ) cl ON cl.channel_id = c.id
+"""
+
+
+# analytics.channel_stats — сверка только каналов, помеченных триггерами как dirty.
+# Строки сначала блокируются, затем пересчитываются отдельным запросом: к этому
+# моменту параллельные транзакции с дельтами уже зафиксированы и видны.
+async def reconcile_channel_stats(limit: int) -> int:
+    async with transaction() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT channel_id FROM analytics.channel_stats
+            WHERE dirty
+            ORDER BY channel_id
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED;
+            """,
+            limit,
+        )
+        ids = [int(r["channel_id"]) for r in rows]
+        if not ids:
+            return 0
+        query = _CHANNEL_STATS_RECOMPUTE.format(channel_filter="AND channel_id = ANY($1::bigint[])")
+        await conn.execute(
+            f"""
+            UPDATE analytics.channel_stats s
+            SET files_count = r.files_count,
+                views_total = r.views_total,
+                clients_total = r.clients_total,
+                blocked_total = r.blocked_total,
+                dirty = FALSE,
+                last_updated = now()
+            FROM ({query} WHERE c.id = ANY($1::bigint[])) r
+            WHERE s.channel_id = r.channel_id;
+            """,
+            ids,
+        )
+        return len(ids)
+
+
+# analytics.channel_stats — полный пересчёт по всем каналам одним сгруппированным upsert
+async def rebuild_channel_stats() -> int:
+    status = await execute(
+        f"""
+        INSERT INTO analytics.channel_stats
+            (channel_id, files_count, views_total, clients_total, blocked_total, dirty, last_updated)
+        SELECT r.*, FALSE, now()
+        FROM ({_CHANNEL_STATS_RECOMPUTE.format(channel_filter="")}) r
+        ON CONFLICT (channel_id) DO UPDATE
+            SET files_count = EXCLUDED.files_count,
+                views_total = EXCLUDED.views_total,
+                clients_total = EXCLUDED.clients_total,
+                blocked_total = EXCLUDED.blocked_total,
+                dirty = FALSE,
+                last_updated = EXCLUDED.last_updated;
+        """
+    )
+    return _affected(status)
+
+
+# Каналы с последними сообщениями для обновления просмотров, одним запросом.
+# contractor_id — Telegram user ID подрядчика (ключ сессии в userbot).
+async def views_refresh_targets(per_channel: int, channel_id: Optional[int] = None) -> list[dict]:
+    rows = await fetch(
+        """
+        SELECT ct.tg_user_id AS contractor_id, c.id AS channel_id, c.tg_chat_id, m.message_ids
+        FROM core.channels c
+        JOIN core.contractors ct ON ct.id = c.contractor_id
+        CROSS JOIN LATERAL (
+            SELECT array_agg(p.message_id ORDER BY p.posted_at DESC) AS message_ids
+            FROM (
+                SELECT message_id, posted_at FROM core.publications
+                WHERE channel_id = c.id AND deleted = FALSE
+                ORDER BY posted_at DESC
+                LIMIT $1
+            ) p
+        ) m
+        WHERE m.message_ids IS NOT NULL
+          AND ct.tg_user_id IS NOT NULL
+          AND ($2::bigint IS NULL OR c.id = $2)
+        ORDER BY ct.tg_user_id, c.id;
+        """,
+        per_channel, channel_id,
+    )
+    return [dict(r) for r in rows]
+
+
+# Запись просмотров пачкой: один UPDATE ... FROM unnest вместо запроса на сообщение.
+# Строки без изменений не трогаем — триггеры channel_stats получают только реальные дельты.
+async def apply_publication_views(channel_ids: list[int], message_ids: list[int], views: list[int]) -> int:
+    if not channel_ids:
+        return 0
+    status = await execute(
+        """
+        UPDATE core.publications p
+        SET views = u.views
+        FROM unnest($1::bigint[], $2::bigint[], $3::int[]) AS u(channel_id, message_id, views)
+        WHERE p.channel_id = u.channel_id
+          AND p.message_id = u.message_id
+          AND p.views IS DISTINCT FROM u.views;
+        """,
+        channel_ids, message_ids, views,
+    )
+    return _affected(status)
@@ -1,5 +1,7 @@
-from typing import Any, Dict, Optional
-from bot.services.db import db, fetchrow, execute, fetch, fetchval, q
+import json
+from typing import Any, Dict, Optional, Sequence
+from bot.services.db import db, fetchrow, execute, fetch, fetchval, q, transaction
+from bot.services.analytics import profile_overview
 
 # core.channels: id, contractor_id, tg_chat_id UNIQUE, title, username, created_at
 # core.publications: id, channel_id, message_id, file_name, file_type, views, posted_at, deleted
@@ -48,6 +50,51 @@ async def record_channel_file(
     
     return int(row["id"])
 
+async def record_channel_files(
+    channel_db_id: int,
+    files: Sequence[tuple[int, str, Optional[str], int]],
+) -> int:
+    """
+    Пакетная запись публикаций одного канала: ``files`` — кортежи
+    (message_id, file_name, file_type, views).  Публикации и события
+    file_posted пишутся двумя многострочными INSERT в одной транзакции.
+    channel_db_id — id канала в БД (не tg_chat_id).
+    """
+    if not files:
+        return 0
+    message_ids = [int(f[0]) for f in files]
+    names = [f[1] for f in files]
+    types = [f[2] for f in files]
+    views = [int(f[3] or 0) for f in files]
+    details = [
+        json.dumps({"message_id": mid, "file_name": name, "file_type": ftype or "unknown"}, ensure_ascii=False)
+        for mid, name, ftype in zip(message_ids, names, types)
+    ]
+    async with transaction() as conn:
+        await conn.execute(
+            """
+            INSERT INTO core.publications (channel_id, message_id, file_name, file_type, views)
+            SELECT $1, t.message_id, t.file_name, t.file_type, t.views
+            FROM unnest($2::bigint[], $3::text[], $4::text[], $5::int[])
+                AS t(message_id, file_name, file_type, views)
+            ON CONFLICT (channel_id, message_id) DO UPDATE
+                SET file_name = EXCLUDED.file_name,
+                    file_type = COALESCE(EXCLUDED.file_type, core.publications.file_type),
+                    views = GREATEST(EXCLUDED.views, core.publications.views)
+            """,
+            channel_db_id, message_ids, names, types, views,
+        )
+        await conn.execute(
+            """
+            INSERT INTO analytics.events (event_type, channel_id, details)
+            SELECT 'file_posted', $1, d::jsonb
+            FROM unnest($2::text[]) AS d
+            """,
+            channel_db_id, details,
+        )
+    return len(files)
+
+
 async def create_channel(contractor_id: int, tg_channel_id: int, title: str, username: Optional[str] = None) -> int:
     row = await fetchrow(
         f"""
@@ -100,7 +147,7 @@ async def recent_stats(contractor_id: int) -> dict:
 async def aggregate_contractor_stats(contractor_id: int) -> Dict[str, Any]:
     """
     Возвращает агрегаты для раздела «Мои каналы».
-    Сначала читаем из analytics.profile_overview, при отсутствии — считаем по core.*
+    Читаем из analytics.profile_overview (материализованный снимок с ограничением устаревания).
     """
     # Сначала получаем внутренний ID подрядчика из БД
     contractor_db_id = await fetchval(
@@ -118,75 +165,16 @@ async def aggregate_contractor_stats(contractor_id: int) -> Dict[str, Any]:
             "blocked_clients": 0,
         }
     
-    # 1) пробуем из вьюхи (быстро)
-    row = await db.fetchrow(
-        "SELECT * FROM analytics.profile_overview WHERE contractor_id = $1",
-        (contractor_db_id,),
-    )
-    if row:
-        return {
-            "channels_count":  row.get("channels_count", 0),
-            "files_count":     row.get("files_count", 0),
-            "views_total":     row.get("views_total", 0),
-            "active_invites":  row.get("active_invites", 0),
-            "clients_total":   row.get("clients_total", 0),
-            "blocked_clients": row.get("blocked_clients", 0),
-        }
-
-    # 2) запасной путь — считаем напрямую по core.*
-    channels_count = await db.fetchval(
-        "SELECT COUNT(*) FROM core.channels WHERE contractor_id = $1", (contractor_db_id,)
-    ) or 0
-
-    files_count = await db.fetchval(
-        """SELECT COUNT(*)
-           FROM core.publications p
-           JOIN core.channels ch ON ch.id = p.channel_id
-          WHERE ch.contractor_id = $1""",
-        (contractor_db_id,),
-    ) or 0
-
-    views_total = await db.fetchval(
-        """SELECT COALESCE(SUM(p.views), 0)
-           FROM core.publications p
-           JOIN core.channels ch ON ch.id = p.channel_id
-          WHERE ch.contractor_id = $1""",
-        (contractor_db_id,),
-    ) or 0
-
-    active_invites = await db.fetchval(
-        """SELECT COUNT(*) 
-           FROM core.invites i
-           JOIN core.channels ch ON ch.id = i.channel_id
-          WHERE ch.contractor_id = $1 
-            AND (i.expires_at IS NULL OR i.expires_at > now())
-            AND (i.max_uses IS NULL OR i.used_count < i.max_uses)""",
-        (contractor_db_id,),
-    ) or 0
-
-    clients_total = await db.fetchval(
-        """SELECT COUNT(*) 
-           FROM core.clients cl
-           JOIN core.channels ch ON ch.id = cl.channel_id
-          WHERE ch.contractor_id = $1""",
-        (contractor_db_id,),
-    ) or 0
-
-    blocked_clients = await db.fetchval(
-        """SELECT COUNT(*) 
-           FROM core.clients cl
-           JOIN core.channels ch ON ch.id = cl.channel_id
-          WHERE ch.contractor_id = $1 AND cl.blocked = true""",
-        (contractor_db_id,),
-    ) or 0
-
+    # Снимок analytics.profile_overview (при устаревании — живой расчёт): один запрос
+    row = await profile_overview(contractor_db_id)
+    row = row or {}
     return {
-        "channels_count":  channels_count,
-        "files_count":     files_count,
-        "views_total":     views_total,
-        "active_invites":  active_invites,
-        "clients_total":   clients_total,
-        "blocked_clients": blocked_clients,
+        "channels_count":  row.get("channels_cnt") or 0,
+        "files_count":     row.get("files_cnt") or 0,
+        "views_total":     row.get("views_total") or 0,
+        "active_invites":  row.get("invites_active") or 0,
+        "clients_total":   row.get("clients_total") or 0,
+        "blocked_clients": row.get("blocked_total") or 0,
     }
 
 async def list_channels(contractor_id: int, limit: int = 100, search: Optional[str] = None) -> list[dict]:
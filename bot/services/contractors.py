@@ -1,6 +1,7 @@
 from typing import Optional
 import secrets
 from .db import fetchrow, fetch, execute, fetchval, q, transaction
+from .analytics import profile_overview as _profile_overview
 
 # core.contractors: id(bigserial PK), tg_user_id BIGINT UNIQUE, username TEXT, full_name TEXT, status TEXT, created_at
 
@@ -109,7 +110,6 @@ async def block(contractor_id: int, blocked: bool = True) -> None:
     status = 'blocked' if blocked else 'active'
     await execute(f"UPDATE {q('contractors')} SET status = $2 WHERE id = $1;", contractor_id, status)
 
-# Профиль / обзор — тянем из analytics.profile_overview (VIEW)
+# Профиль / обзор — снимок analytics.profile_overview с ограничением устаревания
 async def profile_overview(contractor_id: int) -> Optional[dict]:
-    row = await fetchrow(f"SELECT * FROM analytics.profile_overview WHERE contractor_id = $1;", contractor_id)
-    return dict(row) if row else None
+    return await _profile_overview(contractor_id)
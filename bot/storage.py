@@ -1,6 +1,8 @@
+import asyncio
+import json
 import os
 import uuid
-from typing import Iterable, Optional
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Set
 
 from redis.asyncio import Redis
 
@@ -47,6 +49,22 @@ async def load_blob(key: str, *, delete: bool = False) -> bytes:
     return value
 
 
+async def touch_blobs(keys: Iterable[Optional[str]], *, ttl: Optional[int] = None) -> Set[str]:
+    """Extend TTL of several payloads and return the keys that still exist."""
+    filtered = list(dict.fromkeys(key for key in keys if key))
+    if not filtered:
+        return set()
+    client = _get_redis()
+    pipe = client.pipeline()
+    for key in filtered:
+        # GT: only extend, never shorten an existing TTL.
+        pipe.expire(key, ttl or FULLRES_BLOB_TTL, gt=True)
+        pipe.exists(key)
+    results = await pipe.execute()
+    exists_flags = results[1::2]
+    return {key for key, alive in zip(filtered, exists_flags) if alive}
+
+
 async def delete_blob(key: Optional[str]) -> None:
     """Remove a payload from Redis."""
     if not key:
@@ -64,11 +82,42 @@ async def delete_many(keys: Iterable[Optional[str]]) -> None:
     await client.delete(*filtered)
 
 
+async def read_events(key: str, *, timeout: float, block_ms: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+    """Yield JSON events published by a worker to a Redis stream.
+
+    Every entry carries an ``event`` name and a JSON ``data`` payload; the
+    payload is returned with the name under the ``event`` key.  The caller
+    decides when the stream is finished.  Raises ``asyncio.TimeoutError`` once
+    ``timeout`` seconds have passed in total.
+    """
+    client = _get_redis()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    last_id = "0-0"
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise asyncio.TimeoutError(f"No events in {key} within {timeout}s")
+        response = await client.xread({key: last_id}, block=max(1, int(min(block_ms, remaining * 1000))), count=32)
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                last_id = entry_id
+                event = fields.get(b"event", b"").decode("utf-8")
+                try:
+                    payload = json.loads(fields.get(b"data") or b"{}")
+                except ValueError:
+                    payload = {}
+                payload["event"] = event
+                yield payload
+
+
 __all__ = [
     "store_blob",
     "load_blob",
     "delete_blob",
     "delete_many",
+    "touch_blobs",
+    "read_events",
     "SOURCE_BLOB_TTL",
     "FULLRES_BLOB_TTL",
     "FULLRES_BLOB_PREFIX",
@@ -0,0 +1,434 @@
+"""Persistent LibreOffice conversion pool shared by the preview and render workers.
+
+Cold-starting ``soffice --headless --convert-to`` costs several seconds per
+document before any conversion happens.  The pool keeps a few long-lived
+headless LibreOffice instances (driven through ``unoserver``'s XML-RPC API on
+localhost) and falls back to the one-shot CLI when the pool is disabled or
+unavailable.
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import queue
+import shlex
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import xmlrpc.client
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_LIBREOFFICE_CANDIDATES = ("libreoffice", "soffice")
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "").strip() or default)
+    except ValueError:
+        return default
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "").strip() or default)
+    except ValueError:
+        return default
+
+
+POOL_SIZE = max(0, _int_env("LIBREOFFICE_POOL_SIZE", 1))
+POOL_START_TIMEOUT = max(1.0, _float_env("LIBREOFFICE_POOL_START_TIMEOUT", 45.0))
+POOL_ACQUIRE_TIMEOUT = max(1.0, _float_env("LIBREOFFICE_POOL_ACQUIRE_TIMEOUT", 120.0))
+POOL_HEALTH_INTERVAL = max(1.0, _float_env("LIBREOFFICE_POOL_HEALTH_INTERVAL", 30.0))
+POOL_MAX_JOBS = max(0, _int_env("LIBREOFFICE_POOL_MAX_JOBS", 200))
+UNOSERVER_CMD = os.getenv("UNOSERVER_CMD", "/usr/bin/python3 -m unoserver.server")
+
+
+class LibreOfficeError(RuntimeError):
+    """Raised when LibreOffice fails to convert a document."""
+
+
+class LibreOfficePoolError(LibreOfficeError):
+    """Raised when the persistent pool cannot serve a conversion."""
+
+
+def find_libreoffice() -> str:
+    for candidate in _LIBREOFFICE_CANDIDATES:
+        path = shutil.which(candidate)
+        if path:
+            return path
+    raise LibreOfficeError("LibreOffice не найден в PATH. Установите пакет libreoffice.")
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def _port_open(port: int, timeout: float = 0.5) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _split_filter(filter_name: Optional[str]) -> Tuple[Optional[str], List[str]]:
+    """Split ``writer_pdf_Export:Key=Value;Key2=Value2`` into name and options."""
+    if not filter_name:
+        return None, []
+    name, _, raw_options = filter_name.partition(":")
+    options = [opt.strip() for opt in raw_options.split(";") if opt.strip()]
+    return name or None, options
+
+
+class _TimeoutTransport(xmlrpc.client.Transport):
+    def __init__(self, timeout: float) -> None:
+        super().__init__()
+        self._timeout = timeout
+
+    def make_connection(self, host):  # type: ignore[override]
+        conn = super().make_connection(host)
+        conn.timeout = self._timeout
+        return conn
+
+
+class LibreOfficeDaemon:
+    """A single supervised headless LibreOffice instance."""
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.port = 0
+        self.uno_port = 0
+        self.jobs = 0
+        self._proc: Optional[subprocess.Popen] = None
+        self._profile_dir: Optional[Path] = None
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self) -> None:
+        self.stop()
+        self.port = _free_port()
+        self.uno_port = _free_port()
+        self.jobs = 0
+        self._profile_dir = Path(tempfile.mkdtemp(prefix=f"lo_pool_{os.getpid()}_{self.index}_"))
+
+        env = os.environ.copy()
+        env["HOME"] = str(self._profile_dir)
+        env.setdefault("SAL_USE_VCLPLUGIN", "headless")
+
+        cmd = shlex.split(UNOSERVER_CMD) + [
+            "--interface", "127.0.0.1",
+            "--port", str(self.port),
+            "--uno-interface", "127.0.0.1",
+            "--uno-port", str(self.uno_port),
+            "--executable", find_libreoffice(),
+            "--user-installation", self._profile_dir.as_uri(),
+        ]
+        try:
+            self._proc = subprocess.Popen(
+                cmd,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except OSError as exc:
+            self._cleanup_profile()
+            raise LibreOfficePoolError(f"Не удалось запустить unoserver: {exc}") from exc
+
+        deadline = time.monotonic() + POOL_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if not self.alive:
+                self.stop()
+                raise LibreOfficePoolError("unoserver завершился сразу после запуска.")
+            if _port_open(self.port):
+                logger.info(
+                    "libreoffice pool: instance %d ready pid=%s port=%d",
+                    self.index,
+                    self._proc.pid if self._proc else None,
+                    self.port,
+                )
+                return
+            time.sleep(0.25)
+        self.stop()
+        raise LibreOfficePoolError(f"unoserver не поднялся за {POOL_START_TIMEOUT:.0f} с.")
+
+    def stop(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is not None and proc.poll() is None:
+            try:
+                os.killpg(proc.pid, 15)
+                proc.wait(timeout=5)
+            except Exception:
+                try:
+                    os.killpg(proc.pid, 9)
+                except Exception:
+                    pass
+        self._cleanup_profile()
+
+    def _cleanup_profile(self) -> None:
+        if self._profile_dir is not None:
+            shutil.rmtree(self._profile_dir, ignore_errors=True)
+            self._profile_dir = None
+
+    def healthy(self) -> bool:
+        return self.alive and _port_open(self.port)
+
+    def convert(
+        self,
+        source_path: Path,
+        output_path: Path,
+        *,
+        convert_to: str,
+        filter_name: Optional[str],
+        timeout: float,
+    ) -> Path:
+        filtername, filter_options = _split_filter(filter_name)
+        proxy = xmlrpc.client.ServerProxy(
+            f"http://127.0.0.1:{self.port}",
+            allow_none=True,
+            transport=_TimeoutTransport(timeout),
+        )
+        self.jobs += 1
+        proxy.convert(
+            str(source_path.resolve()),
+            None,
+            str(output_path.resolve()),
+            convert_to,
+            filtername,
+            filter_options,
+            True,
+            None,
+        )
+        if not output_path.exists():
+            raise LibreOfficeError(f"LibreOffice не создал файл {output_path.name}.")
+        return output_path
+
+
+class LibreOfficePool:
+    """Bounded pool of persistent LibreOffice instances with health checks."""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._daemons = [LibreOfficeDaemon(i) for i in range(size)]
+        self._idle: "queue.Queue[LibreOfficeDaemon]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+        self._monitor: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started or self._closed:
+                return
+            for daemon in self._daemons:
+                try:
+                    daemon.start()
+                except LibreOfficePoolError as exc:
+                    logger.warning("libreoffice pool: instance %d failed to start: %s", daemon.index, exc)
+                self._idle.put(daemon)
+            self._started = True
+            self._monitor = threading.Thread(target=self._watch, name="libreoffice-pool", daemon=True)
+            self._monitor.start()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            for daemon in self._daemons:
+                daemon.stop()
+
+    def _ensure_ready(self, daemon: LibreOfficeDaemon) -> None:
+        needs_restart = not daemon.healthy() or (POOL_MAX_JOBS and daemon.jobs >= POOL_MAX_JOBS)
+        if needs_restart:
+            logger.info("libreoffice pool: restarting instance %d (jobs=%d)", daemon.index, daemon.jobs)
+            daemon.start()
+
+    def _watch(self) -> None:
+        while not self._closed:
+            time.sleep(POOL_HEALTH_INTERVAL)
+            for _ in range(self.size):
+                try:
+                    daemon = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if not self._closed:
+                        self._ensure_ready(daemon)
+                except LibreOfficePoolError as exc:
+                    logger.warning("libreoffice pool: health check restart failed: %s", exc)
+                finally:
+                    self._idle.put(daemon)
+
+    def convert(
+        self,
+        source_path: Path,
+        output_path: Path,
+        *,
+        convert_to: str = "pdf",
+        filter_name: Optional[str] = None,
+        timeout: float = 240,
+    ) -> Path:
+        self.start()
+        try:
+            daemon = self._idle.get(timeout=POOL_ACQUIRE_TIMEOUT)
+        except queue.Empty as exc:
+            raise LibreOfficePoolError("Все экземпляры LibreOffice заняты.") from exc
+        try:
+            self._ensure_ready(daemon)
+            try:
+                return daemon.convert(
+                    source_path,
+                    output_path,
+                    convert_to=convert_to,
+                    filter_name=filter_name,
+                    timeout=timeout,
+                )
+            except (OSError, xmlrpc.client.Error) as exc:
+                # A timeout or a crashed instance leaves it in an unknown state.
+                daemon.stop()
+                raise LibreOfficePoolError(f"Экземпляр LibreOffice не ответил: {exc}") from exc
+        finally:
+            self._idle.put(daemon)
+
+
+_pool: Optional[LibreOfficePool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Optional[LibreOfficePool]:
+    """Return the per-process pool, or None when pooling is disabled."""
+    global _pool, _pool_pid
+    if POOL_SIZE <= 0:
+        return None
+    with _pool_lock:
+        # Prefork children must not share the parent's instances.
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = LibreOfficePool(POOL_SIZE)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+
+atexit.register(shutdown_pool)
+
+
+def _convert_cold(
+    source_path: Path,
+    working_dir: Path,
+    *,
+    convert_to: str,
+    filter_name: Optional[str],
+    timeout: float,
+) -> Path:
+    binary = find_libreoffice()
+    profile_dir = working_dir / "lo_profile"
+    profile_dir.mkdir(exist_ok=True)
+
+    env = os.environ.copy()
+    env.setdefault("HOME", str(profile_dir))
+    env.setdefault("TMPDIR", str(working_dir))
+    env.setdefault("SAL_USE_VCLPLUGIN", "headless")
+
+    convert_arg = convert_to if not filter_name else f"{convert_to}:{filter_name}"
+    cmd = [
+        binary,
+        "--headless",
+        "--nologo",
+        "--nodefault",
+        "--nofirststartwizard",
+        "--norestore",
+        "--nolockcheck",
+        "--convert-to",
+        convert_arg,
+        str(source_path),
+        "--outdir",
+        str(working_dir),
+    ]
+    try:
+        proc = subprocess.run(
+            cmd,
+            cwd=working_dir,
+            env=env,
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired as exc:
+        raise LibreOfficeError("Конвертация LibreOffice заняла слишком много времени и была остановлена.") from exc
+    if proc.returncode != 0:
+        raise LibreOfficeError(
+            "LibreOffice завершился с ошибкой при конвертации.\n"
+            f"Команда: {' '.join(cmd)}\n"
+            f"STDOUT:\n{proc.stdout}\n"
+            f"STDERR:\n{proc.stderr}"
+        )
+
+    expected = source_path.with_suffix(f".{convert_to}")
+    if expected.exists():
+        return expected
+    candidates = sorted(working_dir.glob(f"*.{convert_to}"))
+    if not candidates:
+        raise LibreOfficeError(f"LibreOffice не создал {convert_to.upper()}-файл.")
+    return candidates[0]
+
+
+def convert_file(
+    source_path: Path,
+    working_dir: Path,
+    *,
+    convert_to: str = "pdf",
+    filter_name: Optional[str] = None,
+    timeout: float = 240,
+) -> Path:
+    """Convert ``source_path`` into ``working_dir`` using the pool when possible."""
+    working_dir.mkdir(parents=True, exist_ok=True)
+    pool = get_pool()
+    if pool is not None:
+        output_path = working_dir / f"{source_path.stem}.{convert_to}"
+        try:
+            return pool.convert(
+                source_path,
+                output_path,
+                convert_to=convert_to,
+                filter_name=filter_name,
+                timeout=timeout,
+            )
+        except LibreOfficePoolError as exc:
+            logger.warning("libreoffice pool unavailable, falling back to cold start: %s", exc)
+    return _convert_cold(
+        source_path,
+        working_dir,
+        convert_to=convert_to,
+        filter_name=filter_name,
+        timeout=timeout,
+    )
+
+
+__all__ = [
+    "LibreOfficeError",
+    "LibreOfficePool",
+    "LibreOfficePoolError",
+    "convert_file",
+    "find_libreoffice",
+    "get_pool",
+    "shutdown_pool",
+]
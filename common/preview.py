@@ -4,11 +4,12 @@ import base64
 import io
 import os
 import re
-import shutil
-import subprocess
 import tempfile
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from common import render_cache
+from common.libreoffice import LibreOfficeError, convert_file
 
 try:
     import fitz  # type: ignore
@@ -42,6 +43,9 @@ except Exception:  # pragma: no cover - optional dependency
     _OPENPYXL_OK = False
 
 _SANITIZE_RE = re.compile(r"[^A-Za-z0-9._-]+")
+PREVIEW_DPI = 300
+PREVIEW_MAX_DIM = 1600
+PREVIEW_JPEG_QUALITY = 85
 
 
 class PreviewError(RuntimeError):
@@ -54,39 +58,58 @@ def _sanitize_basename(filename: str, default: str = "document") -> str:
     return sanitized[:48] or default
 
 
-def _make_preview(png_bytes: bytes, max_dim: int = 1600) -> bytes:
+def _make_preview(png_bytes: bytes, max_dim: int = PREVIEW_MAX_DIM) -> bytes:
     if not _PIL_OK or Image is None:  # pragma: no cover - fallback path
         return png_bytes
     with Image.open(io.BytesIO(png_bytes)) as img:
         img = img.convert("RGB")
         img.thumbnail((max_dim, max_dim), Image.LANCZOS)
         out = io.BytesIO()
-        img.save(out, format="JPEG", quality=85, optimize=True)
+        img.save(out, format="JPEG", quality=PREVIEW_JPEG_QUALITY, optimize=True)
         return out.getvalue()
 
 
-def _convert_pdf(pdf_bytes: bytes, filename: str) -> List[Dict[str, Any]]:
+def _page_filename(base: str, idx: int, total: int) -> str:
+    return f"{base}-{idx:02}.png" if total > 1 else f"{base}.png"
+
+
+def _iter_pdf_pages(
+    pdf_bytes: bytes,
+    filename: str,
+    *,
+    page_indices: Optional[Iterable[int]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Rasterise PDF pages one by one; ``page_indices`` (1-based) limits the work to those pages."""
     if not _FITZ_OK or fitz is None:
         raise PreviewError("PyMuPDF (fitz) недоступен в окружении превью.")
     doc = fitz.open(stream=pdf_bytes, filetype="pdf")  # type: ignore[call-arg]
-    pages: List[Dict[str, Any]] = []
     try:
         total = doc.page_count
         base = Path(filename).stem or "page"
-        for idx, page in enumerate(doc, start=1):
-            pix = page.get_pixmap(dpi=300, alpha=False)
-            out_name = f"{base}-{idx:02}.png" if total > 1 else f"{base}.png"
-            pages.append(
-                {
-                    "filename": out_name,
-                    "content": pix.tobytes("png"),
-                    "page_index": idx,
-                    "pages_total": total,
-                }
-            )
+        if page_indices is None:
+            wanted = range(1, total + 1)
+        else:
+            wanted = sorted({idx for idx in page_indices if 1 <= idx <= total})
+        for idx in wanted:
+            page = doc.load_page(idx - 1)
+            pix = page.get_pixmap(dpi=PREVIEW_DPI, alpha=False)
+            yield {
+                "filename": _page_filename(base, idx, total),
+                "content": pix.tobytes("png"),
+                "page_index": idx,
+                "pages_total": total,
+            }
     finally:
         doc.close()
-    return pages
+
+
+def _convert_pdf(
+    pdf_bytes: bytes,
+    filename: str,
+    *,
+    page_indices: Optional[Iterable[int]] = None,
+) -> List[Dict[str, Any]]:
+    return list(_iter_pdf_pages(pdf_bytes, filename, page_indices=page_indices))
 
 
 def _wrap_png_as_pages(png_bytes: bytes, filename: str) -> List[Dict[str, Any]]:
@@ -110,44 +133,10 @@ def _convert_doc_to_pdf_bytes(doc_bytes: bytes, suffix: str) -> bytes:
         tmpdir_path = Path(tmpdir)
         src_path = tmpdir_path / f"source{suffix}"
         src_path.write_bytes(doc_bytes)
-        binary = shutil.which("libreoffice") or shutil.which("soffice")
-        if not binary:
-            raise PreviewError("LibreOffice не найден в окружении превью.")
-        cmd = [
-            binary,
-            "--headless",
-            "--nologo",
-            "--nodefault",
-            "--nofirststartwizard",
-            "--norestore",
-            "--nolockcheck",
-            "--convert-to",
-            "pdf",
-            "--outdir",
-            str(tmpdir_path),
-            str(src_path),
-        ]
-        env = os.environ.copy()
-        env.setdefault("HOME", str(tmpdir_path))
-        env.setdefault("TMPDIR", str(tmpdir_path))
-        proc = subprocess.run(
-            cmd,
-            capture_output=True,
-            timeout=240,
-            cwd=tmpdir_path,
-            env=env,
-        )
-        if proc.returncode != 0:
-            raise PreviewError(
-                "LibreOffice не смог обработать документ: "
-                f"{proc.stderr.decode(errors='ignore') or proc.stdout.decode(errors='ignore')}"
-            )
-        pdf_path = src_path.with_suffix(".pdf")
-        if not pdf_path.exists():
-            candidates = list(tmpdir_path.glob("*.pdf"))
-            if not candidates:
-                raise PreviewError("LibreOffice не создал PDF-файл.")
-            pdf_path = candidates[0]
+        try:
+            pdf_path = convert_file(src_path, tmpdir_path, convert_to="pdf")
+        except LibreOfficeError as exc:
+            raise PreviewError(f"LibreOffice не смог обработать документ: {exc}") from exc
         return pdf_path.read_bytes()
 
 
@@ -165,30 +154,15 @@ def _range_to_a1(bounds: Tuple[int, int, int, int]) -> str:
 
 def _prepare_excel_bytes_for_openpyxl(excel_bytes: bytes, suffix: str) -> Tuple[bytes, str]:
     if suffix == ".xls":
-        with tempfile.NamedTemporaryFile(suffix=".xls", delete=False) as tmp:
-            tmp.write(excel_bytes)
-            tmp.flush()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir_path = Path(tmpdir)
+            src_path = tmpdir_path / "converted.xls"
+            src_path.write_bytes(excel_bytes)
             try:
-                binary = shutil.which("libreoffice") or shutil.which("soffice")
-                if not binary:
-                    raise PreviewError("LibreOffice не найден, XLS нельзя обработать.")
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    out_path = Path(tmpdir) / "converted.xlsx"
-                    cmd = [
-                        binary,
-                        "--headless",
-                        "--convert-to",
-                        "xlsx",
-                        str(Path(tmp.name)),
-                        "--outdir",
-                        tmpdir,
-                    ]
-                    proc = subprocess.run(cmd, capture_output=True, timeout=240)
-                    if proc.returncode != 0 or not out_path.exists():
-                        raise PreviewError("Не удалось конвертировать XLS в XLSX через LibreOffice.")
-                    return out_path.read_bytes(), ".xlsx"
-            finally:
-                os.unlink(tmp.name)
+                out_path = convert_file(src_path, tmpdir_path, convert_to="xlsx")
+            except LibreOfficeError as exc:
+                raise PreviewError("Не удалось конвертировать XLS в XLSX через LibreOffice.") from exc
+            return out_path.read_bytes(), ".xlsx"
     return excel_bytes, suffix
 
 
@@ -247,7 +221,8 @@ def _export_excel_region_to_pdf(excel_bytes: bytes, suffix: str, sheet_name: str
         return _convert_doc_to_pdf_bytes(src_path.read_bytes(), ".xlsx")
 
 
-def _extract_excel_tables(excel_bytes: bytes, filename: str) -> Dict[str, Any]:
+def _iter_excel_tables(excel_bytes: bytes, filename: str, analysis: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield one rendered page per detected table; fills ``analysis['sheets_total']``."""
     if not _OPENPYXL_OK or openpyxl is None:
         raise PreviewError("openpyxl недоступен, не удаётся обработать Excel.")
     suffix = Path(filename).suffix or ".xlsx"
@@ -255,9 +230,10 @@ def _extract_excel_tables(excel_bytes: bytes, filename: str) -> Dict[str, Any]:
     wb = openpyxl.load_workbook(io.BytesIO(prepared_bytes), data_only=True)  # type: ignore[arg-type]
     try:
         total_sheets = len(wb.worksheets)
+        analysis["sheets_total"] = total_sheets
         orig_base = (os.path.splitext(filename)[0] or "document").strip()
         base_name = _sanitize_basename(filename)
-        tables: List[Dict[str, Any]] = []
+        emitted = 0
         for sheet_index, ws in enumerate(wb.worksheets):
             regions = _worksheet_detect_tables(ws)
             if not regions:
@@ -273,76 +249,192 @@ def _extract_excel_tables(excel_bytes: bytes, filename: str) -> Dict[str, Any]:
                     continue
                 first = png_pages[0]
                 display_name = (orig_base or "document") + ".png"
-                tables.append(
-                    {
-                        "filename": display_name,
-                        "content": first["content"],
-                        "sheet_name": ws.title,
-                        "table_range": _range_to_a1(bounds),
-                        "sheet_index": sheet_index,
-                        "sheets_total": total_sheets,
-                        "table_index": table_idx,
-                        "tables_in_sheet": tables_in_sheet,
-                        "base_name": base_name,
-                        "display_name": display_name,
-                        "page_index": first.get("page_index", len(tables) + 1),
-                        "pages_total": first.get("pages_total"),
-                    }
-                )
-        return {"pages": tables, "sheets_total": total_sheets}
+                emitted += 1
+                yield {
+                    "filename": display_name,
+                    "content": first["content"],
+                    "sheet_name": ws.title,
+                    "table_range": _range_to_a1(bounds),
+                    "sheet_index": sheet_index,
+                    "sheets_total": total_sheets,
+                    "table_index": table_idx,
+                    "tables_in_sheet": tables_in_sheet,
+                    "base_name": base_name,
+                    "display_name": display_name,
+                    "page_index": first.get("page_index", emitted),
+                    "pages_total": first.get("pages_total"),
+                    # Every table is page 1 of its own PDF; the id tells them apart.
+                    "page_id": emitted,
+                }
     finally:
         wb.close()
 
 
-def generate_preview(file_bytes: bytes, filename: str, render_format: str) -> Dict[str, Any]:
+_PAGE_META_KEYS = (
+    "sheet_name",
+    "table_range",
+    "sheet_index",
+    "sheets_total",
+    "table_index",
+    "tables_in_sheet",
+    "base_name",
+    "display_name",
+    "page_index",
+    "pages_total",
+    "page_id",
+)
+
+
+def _build_page_info(entry: Dict[str, Any], filename: str) -> Dict[str, Any] | None:
+    png_bytes = entry.get("content")
+    if not png_bytes:
+        return None
+    page_info: Dict[str, Any] = {
+        "filename": entry.get("filename") or filename,
+        "preview_bytes": _make_preview(png_bytes),
+        "fullres_bytes": png_bytes,
+    }
+    for key in _PAGE_META_KEYS:
+        if key in entry:
+            page_info[key] = entry[key]
+    return page_info
+
+
+def generate_preview(
+    file_bytes: bytes,
+    filename: str,
+    render_format: str,
+    *,
+    max_pages: Optional[int] = None,
+    on_page: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """Build preview pages for a document.
+
+    With ``max_pages`` PDF and Word documents are rendered lazily: only the
+    first ``max_pages`` pages are rasterised, the rest are listed in
+    ``pending_pages`` and ``render_pdf`` holds the PDF to render them from
+    later with :func:`render_preview_pages`.  ``on_page`` is called with every
+    page as soon as it is ready, before the whole document is done.
+    """
     fmt = (render_format or '').strip().lower()
     if fmt not in {"pdf", "docx", "xlsx", "png"}:
         raise PreviewError(f"Неизвестный формат превью: {render_format}")
+    lazy = bool(max_pages) and max_pages > 0 and fmt in {"pdf", "docx"}  # type: ignore[operator]
+
+    cache_key = render_cache.make_key(
+        "preview",
+        file_bytes,
+        fmt=fmt,
+        filename=filename,
+        dpi=PREVIEW_DPI,
+        max_dim=PREVIEW_MAX_DIM,
+        quality=PREVIEW_JPEG_QUALITY,
+        max_pages=max_pages if lazy else None,
+    )
+    cached = _load_cached_preview(cache_key)
+    if cached is not None:
+        if cached.get("pending_pages") and fmt == "pdf":
+            cached["render_pdf"] = file_bytes
+        if on_page is not None:
+            for page in cached["pages"]:
+                on_page(page)
+        return cached
 
     analysis: Dict[str, Any] = {}
+    render_pdf: bytes | None = None
     if fmt == "pdf":
-        pages_raw = _convert_pdf(file_bytes, filename)
+        render_pdf = file_bytes
     elif fmt == "docx":
         suffix = Path(filename).suffix or ".docx"
-        pages_raw = _convert_doc_to_png(file_bytes, suffix, filename)
+        render_pdf = _convert_doc_to_pdf_bytes(file_bytes, suffix)
+
+    pages_raw: Iterable[Dict[str, Any]]
+    if render_pdf is not None:
+        page_indices = range(1, int(max_pages) + 1) if lazy else None  # type: ignore[arg-type]
+        pages_raw = _iter_pdf_pages(render_pdf, filename, page_indices=page_indices)
     elif fmt == "png":
         pages_raw = _wrap_png_as_pages(file_bytes, filename)
     else:  # fmt == "xlsx"
-        analysis = _extract_excel_tables(file_bytes, filename)
-        pages_raw = list(analysis.get("pages") or [])
-
-    if not pages_raw:
-        raise PreviewError("Не удалось подготовить страницы для превью.")
+        pages_raw = _iter_excel_tables(file_bytes, filename, analysis)
 
     pages: List[Dict[str, Any]] = []
     for entry in pages_raw:
-        png_bytes = entry.get("content")
-        if not png_bytes:
+        page_info = _build_page_info(entry, filename)
+        if page_info is None:
             continue
-        preview = _make_preview(png_bytes)
-        page_info: Dict[str, Any] = {
-            "filename": entry.get("filename") or filename,
-            "preview_bytes": preview,
-            "fullres_bytes": png_bytes,
-        }
-        for key in (
-            "sheet_name",
-            "table_range",
-            "sheet_index",
-            "sheets_total",
-            "table_index",
-            "tables_in_sheet",
-            "base_name",
-            "display_name",
-            "page_index",
-            "pages_total",
-        ):
-            if key in entry:
-                page_info[key] = entry[key]
         pages.append(page_info)
+        if on_page is not None:
+            on_page(page_info)
+
+    if not pages:
+        raise PreviewError("Не удалось подготовить страницы для превью.")
+
+    result: Dict[str, Any] = {"pages": pages, "analysis": analysis}
+    if lazy:
+        total = int(pages[0].get("pages_total") or len(pages))
+        base = Path(filename).stem or "page"
+        rendered = {page.get("page_index") for page in pages}
+        result["pages_total"] = total
+        result["pending_pages"] = [
+            {"page_index": idx, "pages_total": total, "filename": _page_filename(base, idx, total)}
+            for idx in range(1, total + 1)
+            if idx not in rendered
+        ]
+        if result["pending_pages"]:
+            result["render_pdf"] = render_pdf
+    _store_cached_preview(cache_key, result, keep_pdf=fmt == "docx")
+    return result
+
 
-    return {"pages": pages, "analysis": {k: v for k, v in analysis.items() if k != "pages"}}
+def render_preview_pages(pdf_bytes: bytes, filename: str, page_indices: Iterable[int]) -> List[Dict[str, Any]]:
+    """Render selected pages of a lazily previewed document."""
+    pages: List[Dict[str, Any]] = []
+    for entry in _convert_pdf(pdf_bytes, filename, page_indices=page_indices):
+        page_info = _build_page_info(entry, filename)
+        if page_info is not None:
+            pages.append(page_info)
+    return pages
 
 
-__all__ = ["generate_preview", "PreviewError"]
+def _load_cached_preview(cache_key: str) -> Dict[str, Any] | None:
+    cached = render_cache.get(cache_key)
+    if cached is None:
+        return None
+    meta, blobs = cached
+    pages: List[Dict[str, Any]] = []
+    for idx, page_meta in enumerate(meta.get("pages") or []):
+        preview = blobs.get(f"p{idx}")
+        fullres = blobs.get(f"f{idx}")
+        if not preview or not fullres:
+            return None
+        pages.append({**page_meta, "preview_bytes": preview, "fullres_bytes": fullres})
+    if not pages:
+        return None
+    result: Dict[str, Any] = {"pages": pages, "analysis": meta.get("analysis") or {}}
+    if "pages_total" in meta:
+        result["pages_total"] = meta["pages_total"]
+        result["pending_pages"] = meta.get("pending_pages") or []
+        if "pdf" in blobs:
+            result["render_pdf"] = blobs["pdf"]
+    return result
+
+
+def _store_cached_preview(cache_key: str, result: Dict[str, Any], *, keep_pdf: bool = False) -> None:
+    pages_meta: List[Dict[str, Any]] = []
+    blobs: Dict[str, bytes] = {}
+    for idx, page in enumerate(result["pages"]):
+        pages_meta.append({k: v for k, v in page.items() if k not in {"preview_bytes", "fullres_bytes"}})
+        blobs[f"p{idx}"] = page["preview_bytes"]
+        blobs[f"f{idx}"] = page["fullres_bytes"]
+    meta: Dict[str, Any] = {"pages": pages_meta, "analysis": result["analysis"]}
+    if "pages_total" in result:
+        meta["pages_total"] = result["pages_total"]
+        meta["pending_pages"] = result.get("pending_pages") or []
+        if keep_pdf and result.get("render_pdf"):
+            # Word documents: keep the converted PDF so later pages skip LibreOffice.
+            blobs["pdf"] = result["render_pdf"]
+    render_cache.put(cache_key, meta, blobs)
+
+
+__all__ = ["generate_preview", "render_preview_pages", "PreviewError"]
 
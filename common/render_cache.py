@@ -0,0 +1,133 @@
+"""Content-addressed cache for rendered document pages.
+
+Entries are keyed by ``sha256(source bytes + render parameters)`` and stored in
+Redis as a single hash per document (``meta`` JSON plus one field per page
+blob), so a whole render expires at once.  Every hit refreshes the TTL.
+
+The cache lives in its own Redis (``RENDER_CACHE_REDIS_URL``, the
+``render-cache`` service) with its own ``maxmemory`` and ``allkeys-lru``
+policy: large entries are evicted there under memory pressure and can never
+push source blobs, rendered pages, manifests or Celery keys out of the main
+Redis.  Without a dedicated URL the cache falls back to ``REDIS_URL`` and
+relies on its TTL alone.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import redis  # type: ignore
+
+    _REDIS_OK = True
+except Exception:  # pragma: no cover - optional dependency
+    redis = None  # type: ignore
+    _REDIS_OK = False
+
+try:
+    from worker.metrics import record_render_cache
+except Exception:  # pragma: no cover - metrics live in the worker image only
+    record_render_cache = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+RENDER_CACHE_REDIS_URL = os.getenv("RENDER_CACHE_REDIS_URL") or REDIS_URL
+RENDER_CACHE_ENABLED = os.getenv("RENDER_CACHE_ENABLED", "1").lower() not in {"0", "false", "no"}
+RENDER_CACHE_PREFIX = os.getenv("RENDER_CACHE_PREFIX", "rcache")
+RENDER_CACHE_TTL = int(os.getenv("RENDER_CACHE_TTL", "86400"))
+RENDER_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RENDER_CACHE_MAX_ENTRY_BYTES", str(96 * 1024 * 1024)))
+
+_client = None
+
+
+def _get_client():
+    global _client
+    if _client is None and _REDIS_OK and redis is not None:
+        _client = redis.Redis.from_url(RENDER_CACHE_REDIS_URL)
+    return _client
+
+
+def _observe(layer: str, outcome: str) -> None:
+    if record_render_cache is not None:
+        try:
+            record_render_cache(layer, outcome)  # type: ignore[misc]
+        except Exception:
+            pass
+
+
+def make_key(layer: str, payload: bytes, **params: Any) -> str:
+    """Build a cache key from the source bytes and the render parameters."""
+    digest = hashlib.sha256(payload)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return f"{RENDER_CACHE_PREFIX}:{layer}:{digest.hexdigest()}"
+
+
+def _layer_of(key: str) -> str:
+    parts = key.split(":")
+    return parts[1] if len(parts) > 2 else "unknown"
+
+
+def get(key: str) -> Optional[Tuple[Dict[str, Any], Dict[str, bytes]]]:
+    """Return ``(meta, blobs)`` for a cached render or None."""
+    if not RENDER_CACHE_ENABLED:
+        return None
+    client = _get_client()
+    if client is None:
+        return None
+    layer = _layer_of(key)
+    try:
+        pipe = client.pipeline()
+        pipe.hgetall(key)
+        pipe.expire(key, RENDER_CACHE_TTL)
+        raw, _ = pipe.execute()
+    except Exception as exc:  # pragma: no cover - redis failure path
+        logger.warning("render cache: lookup failed key=%s: %s", key, exc)
+        _observe(layer, "error")
+        return None
+    if not raw or b"meta" not in raw:
+        _observe(layer, "miss")
+        return None
+    try:
+        meta = json.loads(raw.pop(b"meta"))
+    except ValueError:
+        _observe(layer, "miss")
+        return None
+    blobs = {field.decode("utf-8"): value for field, value in raw.items()}
+    _observe(layer, "hit")
+    return meta, blobs
+
+
+def put(key: str, meta: Dict[str, Any], blobs: Dict[str, bytes]) -> bool:
+    """Store a render. Entries larger than the configured bound are skipped."""
+    if not RENDER_CACHE_ENABLED:
+        return False
+    client = _get_client()
+    if client is None:
+        return False
+    layer = _layer_of(key)
+    total = sum(len(value) for value in blobs.values())
+    if total > RENDER_CACHE_MAX_ENTRY_BYTES:
+        _observe(layer, "skip")
+        return False
+    mapping: Dict[str, Any] = {"meta": json.dumps(meta, default=str)}
+    mapping.update(blobs)
+    try:
+        pipe = client.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, RENDER_CACHE_TTL)
+        pipe.execute()
+    except Exception as exc:  # pragma: no cover - redis failure path
+        logger.warning("render cache: store failed key=%s: %s", key, exc)
+        _observe(layer, "error")
+        return False
+    _observe(layer, "store")
+    return True
+
+
+__all__ = ["get", "make_key", "put", "RENDER_CACHE_ENABLED", "RENDER_CACHE_TTL"]
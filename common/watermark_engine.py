@@ -0,0 +1,220 @@
+"""Tiled watermark renderer shared by the publish worker and the bot preview.
+
+The watermark is a single-colour text tile repeated over the page, so the
+whole overlay is fully described by an ``L``-mode alpha mask.  Masks are built
+once per (text, page size, settings) and kept in a byte-bounded LRU; stamping
+a page is then one ``Image.paste(color, mask=...)`` call that blends in place
+on the RGB buffer instead of compositing every tile into a full-size RGBA
+overlay.  A 50-page document with identical page sizes builds one mask.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from common.watermark import WATERMARK_SETTINGS, WatermarkSettings
+
+try:
+    from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+    _PIL_OK = True
+except Exception:  # pragma: no cover - optional dependency
+    Image = ImageChops = ImageDraw = ImageFont = None  # type: ignore
+    _PIL_OK = False
+
+try:
+    from worker.metrics import record_watermark_overlay
+except Exception:  # pragma: no cover - metrics live in the worker image only
+    record_watermark_overlay = None  # type: ignore
+
+# An A4@300dpi mask is ~8.7 MB, so the default keeps about a dozen page sizes.
+WATERMARK_OVERLAY_CACHE_BYTES = int(os.getenv("WATERMARK_OVERLAY_CACHE_BYTES", str(128 * 1024 * 1024)))
+
+_OverlayKey = Tuple[str, int, int, WatermarkSettings]
+
+
+class _OverlayCache:
+    """LRU of alpha masks bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[_OverlayKey, Image.Image]" = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: _OverlayKey) -> "Optional[Image.Image]":
+        with self._lock:
+            mask = self._entries.get(key)
+            if mask is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        _observe("hit" if mask is not None else "miss")
+        return mask
+
+    def put(self, key: _OverlayKey, mask: "Image.Image") -> None:
+        size = mask.width * mask.height
+        if size > self.max_bytes:
+            return
+        evicted = 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.width * previous.height
+            self._entries[key] = mask
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= old.width * old.height
+                evicted += 1
+            self.evictions += evicted
+        for _ in range(evicted):
+            _observe("eviction")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_OVERLAY_CACHE = _OverlayCache(WATERMARK_OVERLAY_CACHE_BYTES)
+
+
+def _observe(outcome: str) -> None:
+    if record_watermark_overlay is not None:
+        try:
+            record_watermark_overlay(outcome)  # type: ignore[misc]
+        except Exception:
+            pass
+
+
+def overlay_cache_stats() -> Dict[str, int]:
+    """Hit/miss/eviction counters and current size of the overlay cache."""
+    return _OVERLAY_CACHE.stats()
+
+
+def load_font(size: int, settings: WatermarkSettings = WATERMARK_SETTINGS) -> "ImageFont.FreeTypeFont":
+    candidates = [
+        settings.font_preferred,
+        "/usr/share/fonts/truetype/roboto/Roboto-Regular.ttf",
+        settings.font_fallback,
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    ]
+    for path in candidates:
+        try:
+            return ImageFont.truetype(path, size)
+        except Exception:
+            continue
+    return ImageFont.load_default()
+
+
+def _render_tile(text: str, width: int, height: int, cfg: WatermarkSettings) -> "Image.Image":
+    """Alpha mask of one rotated text tile for a ``width`` x ``height`` page."""
+    font_size = max(cfg.min_font_size, int(max(width, height) * cfg.font_scale))
+    font = load_font(font_size, cfg)
+    tile_w = max(64, int(width * cfg.tile_scale_x))
+    tile_h = max(64, int(height * cfg.tile_scale_y))
+
+    tile = Image.new("L", (tile_w, tile_h), 0)
+    drawer = ImageDraw.Draw(tile)
+    bbox = drawer.textbbox((0, 0), text, font=font)
+    tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    if cfg.text_offset < 0:
+        pos_x = (tile_w - tw) // 2
+        pos_y = (tile_h - th) // 2
+    else:
+        pos_x = cfg.text_offset
+        pos_y = cfg.text_offset
+    drawer.text((pos_x, pos_y), text, font=font, fill=max(16, min(255, cfg.opacity)))
+    return tile.rotate(cfg.angle, expand=True)
+
+
+def build_overlay(text: str, size: Tuple[int, int], cfg: WatermarkSettings = WATERMARK_SETTINGS) -> "Image.Image":
+    """Full-page alpha mask with the tile repeated on the configured grid.
+
+    Overlapping tiles are merged with ``screen`` (``a + b - a*b``), which is
+    exactly the alpha of stacking them with ``alpha_composite``.
+    """
+    width, height = size
+    tile = _render_tile(text, width, height, cfg)
+    mask = Image.new("L", (width, height), 0)
+    base_step = max(1, cfg.step)
+    step_x = max(base_step, tile.width // 2)
+    step_y = max(base_step, tile.height // 2)
+    for y in range(-tile.height, height + tile.height, step_y):
+        for x in range(-tile.width, width + tile.width, step_x):
+            left, top = max(x, 0), max(y, 0)
+            right, bottom = min(x + tile.width, width), min(y + tile.height, height)
+            if right <= left or bottom <= top:
+                continue
+            box = (left, top, right, bottom)
+            part = tile.crop((left - x, top - y, right - x, bottom - y))
+            mask.paste(ImageChops.screen(mask.crop(box), part), box)
+    return mask
+
+
+def get_overlay(text: str, size: Tuple[int, int], cfg: WatermarkSettings = WATERMARK_SETTINGS) -> "Image.Image":
+    key: _OverlayKey = (text, size[0], size[1], cfg)
+    mask = _OVERLAY_CACHE.get(key)
+    if mask is None:
+        mask = build_overlay(text, size, cfg)
+        _OVERLAY_CACHE.put(key, mask)
+    return mask
+
+
+def apply_watermark(
+    img: "Image.Image",
+    text: str,
+    *,
+    settings: WatermarkSettings | None = None,
+) -> "Image.Image":
+    """Stamp a tiled watermark; RGB images are modified in place and returned."""
+    if not _PIL_OK:
+        raise RuntimeError("Pillow недоступен для нанесения водяного знака.")
+    rgb = img if img.mode == "RGB" else img.convert("RGB")
+    if not text or not str(text).strip():
+        return rgb
+    cfg = settings or WATERMARK_SETTINGS
+    mask = get_overlay(str(text), rgb.size, cfg)
+    rgb.paste(cfg.color, (0, 0, rgb.width, rgb.height), mask)
+    return rgb
+
+
+def watermark_png_bytes(png_bytes: bytes, text: str, *, settings: WatermarkSettings | None = None) -> bytes:
+    if not _PIL_OK:
+        raise RuntimeError("Pillow недоступен для нанесения водяного знака.")
+    with Image.open(io.BytesIO(png_bytes)) as img:
+        stamped = apply_watermark(img.convert("RGB"), text, settings=settings)
+    out = io.BytesIO()
+    stamped.save(out, format="PNG")
+    return out.getvalue()
+
+
+__all__ = [
+    "WATERMARK_OVERLAY_CACHE_BYTES",
+    "apply_watermark",
+    "build_overlay",
+    "get_overlay",
+    "load_font",
+    "overlay_cache_stats",
+    "watermark_png_bytes",
+]
@@ -0,0 +1,142 @@
+-- Инкрементальное ведение analytics.channel_stats.
+-- Вместо ежечасного пересчёта по всем каналам триггеры применяют дельты
+-- при вставке/удалении/изменении публикаций и клиентов и помечают канал
+-- как dirty; периодическая сверка (tasks.stats.update_channel_stats)
+-- пересчитывает только помеченные каналы.
+
+ALTER TABLE analytics.channel_stats
+    ADD COLUMN IF NOT EXISTS dirty BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE INDEX IF NOT EXISTS idx_channel_stats_dirty
+    ON analytics.channel_stats(channel_id) WHERE dirty;
+
+-- Прибавляет дельты к строкам каналов (создаёт недостающие) и ставит dirty.
+-- Каналы, удаляемые каскадом вместе с публикациями, пропускаются.
+CREATE OR REPLACE FUNCTION analytics.channel_stats_apply(
+    p_channel BIGINT[],
+    p_files   BIGINT[],
+    p_views   BIGINT[],
+    p_clients BIGINT[],
+    p_blocked BIGINT[]
+) RETURNS void
+LANGUAGE sql AS $$
+    INSERT INTO analytics.channel_stats AS s
+        (channel_id, files_count, views_total, clients_total, blocked_total, dirty, last_updated)
+    SELECT d.channel_id,
+           COALESCE(d.files, 0), COALESCE(d.views, 0),
+           COALESCE(d.clients, 0), COALESCE(d.blocked, 0),
+           TRUE, now()
+    FROM unnest(p_channel, p_files, p_views, p_clients, p_blocked)
+        AS d(channel_id, files, views, clients, blocked)
+    WHERE d.channel_id IS NOT NULL
+      AND EXISTS (SELECT 1 FROM core.channels c WHERE c.id = d.channel_id)
+    ON CONFLICT (channel_id) DO UPDATE
+        SET files_count   = s.files_count   + EXCLUDED.files_count,
+            views_total   = s.views_total   + EXCLUDED.views_total,
+            clients_total = s.clients_total + EXCLUDED.clients_total,
+            blocked_total = s.blocked_total + EXCLUDED.blocked_total,
+            dirty = TRUE,
+            last_updated = now();
+$$;
+
+-- Триггеры уровня оператора: многострочная вставка публикаций
+-- (record_channel_files) даёт одну дельту на канал, а не на файл.
+-- Ветки обращаются только к тем переходным таблицам, что есть у операции.
+CREATE OR REPLACE FUNCTION analytics.channel_stats_publications_delta() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM analytics.channel_stats_apply(array_agg(channel_id), array_agg(files), array_agg(views), NULL, NULL)
+        FROM (
+            SELECT channel_id, COUNT(*) AS files, SUM(views) AS views
+            FROM new_rows WHERE NOT deleted
+            GROUP BY channel_id
+        ) d;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM analytics.channel_stats_apply(array_agg(channel_id), array_agg(files), array_agg(views), NULL, NULL)
+        FROM (
+            SELECT channel_id, -COUNT(*) AS files, -SUM(views) AS views
+            FROM old_rows WHERE NOT deleted
+            GROUP BY channel_id
+        ) d;
+    ELSE
+        PERFORM analytics.channel_stats_apply(array_agg(channel_id), array_agg(files), array_agg(views), NULL, NULL)
+        FROM (
+            SELECT channel_id, SUM(files) AS files, SUM(views) AS views
+            FROM (
+                SELECT channel_id, 1 AS files, views FROM new_rows WHERE NOT deleted
+                UNION ALL
+                SELECT channel_id, -1, -views FROM old_rows WHERE NOT deleted
+            ) u
+            GROUP BY channel_id
+            HAVING SUM(files) <> 0 OR SUM(views) <> 0
+        ) d;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION analytics.channel_stats_clients_delta() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM analytics.channel_stats_apply(array_agg(channel_id), NULL, NULL, array_agg(clients), array_agg(blocked))
+        FROM (
+            SELECT channel_id, COUNT(*) AS clients, COUNT(*) FILTER (WHERE blocked) AS blocked
+            FROM new_rows
+            GROUP BY channel_id
+        ) d;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM analytics.channel_stats_apply(array_agg(channel_id), NULL, NULL, array_agg(clients), array_agg(blocked))
+        FROM (
+            SELECT channel_id, -COUNT(*) AS clients, -COUNT(*) FILTER (WHERE blocked) AS blocked
+            FROM old_rows
+            GROUP BY channel_id
+        ) d;
+    ELSE
+        PERFORM analytics.channel_stats_apply(array_agg(channel_id), NULL, NULL, array_agg(clients), array_agg(blocked))
+        FROM (
+            SELECT channel_id, SUM(clients) AS clients, SUM(blocked) AS blocked
+            FROM (
+                SELECT channel_id, 1 AS clients, blocked::int AS blocked FROM new_rows
+                UNION ALL
+                SELECT channel_id, -1, -(blocked::int) FROM old_rows
+            ) u
+            GROUP BY channel_id
+            HAVING SUM(clients) <> 0 OR SUM(blocked) <> 0
+        ) d;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_channel_stats_pub_ins ON core.publications;
+DROP TRIGGER IF EXISTS trg_channel_stats_pub_upd ON core.publications;
+DROP TRIGGER IF EXISTS trg_channel_stats_pub_del ON core.publications;
+CREATE TRIGGER trg_channel_stats_pub_ins AFTER INSERT ON core.publications
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION analytics.channel_stats_publications_delta();
+CREATE TRIGGER trg_channel_stats_pub_upd AFTER UPDATE ON core.publications
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION analytics.channel_stats_publications_delta();
+CREATE TRIGGER trg_channel_stats_pub_del AFTER DELETE ON core.publications
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION analytics.channel_stats_publications_delta();
+
+DROP TRIGGER IF EXISTS trg_channel_stats_cl_ins ON core.clients;
+DROP TRIGGER IF EXISTS trg_channel_stats_cl_upd ON core.clients;
+DROP TRIGGER IF EXISTS trg_channel_stats_cl_del ON core.clients;
+CREATE TRIGGER trg_channel_stats_cl_ins AFTER INSERT ON core.clients
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION analytics.channel_stats_clients_delta();
+CREATE TRIGGER trg_channel_stats_cl_upd AFTER UPDATE ON core.clients
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION analytics.channel_stats_clients_delta();
+CREATE TRIGGER trg_channel_stats_cl_del AFTER DELETE ON core.clients
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION analytics.channel_stats_clients_delta();
+
+-- Стартовое состояние: все существующие каналы сверяются при первом запуске задачи.
+INSERT INTO analytics.channel_stats (channel_id, dirty)
+SELECT id, TRUE FROM core.channels
+ON CONFLICT (channel_id) DO UPDATE SET dirty = TRUE;
@@ -0,0 +1,18 @@
+-- Материализованный analytics.profile_overview.
+-- Прежнее представление считало агрегаты по каналам, публикациям, клиентам
+-- и инвайтам при каждом открытии «Мой профиль»/«Мои каналы».  Теперь:
+--   * analytics.profile_overview_live — то же представление (живой расчёт);
+--   * analytics.profile_overview — его снимок с уникальным индексом по
+--     contractor_id, обновляется REFRESH ... CONCURRENTLY из Celery beat
+--     (tasks.stats.refresh_profile_overview); refreshed_at — время снимка,
+--     по нему сервисный слой ограничивает устаревание.
+
+ALTER VIEW IF EXISTS analytics.profile_overview RENAME TO profile_overview_live;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics.profile_overview AS
+SELECT v.*, now() AS refreshed_at
+FROM analytics.profile_overview_live v;
+
+-- Уникальный индекс обязателен для REFRESH MATERIALIZED VIEW CONCURRENTLY.
+CREATE UNIQUE INDEX IF NOT EXISTS ux_profile_overview_contractor
+    ON analytics.profile_overview(contractor_id);
@@ -4,7 +4,7 @@ import logging
 from typing import Optional, Dict, Any, List
 
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
@@ -12,15 +12,18 @@ logger = logging.getLogger(__name__)
 
 from telethon import TelegramClient
 from telethon.sessions import StringSession
-from telethon.errors import FloodWaitError
 from telethon.errors.rpcerrorlist import (
     SessionPasswordNeededError, PhoneCodeInvalidError, PhoneNumberInvalidError
 )
 from telethon.tl.functions.messages import ToggleNoForwardsRequest
 from telethon.tl.functions.channels import CreateChannelRequest, EditAdminRequest, InviteToChannelRequest, EditPhotoRequest
-from telethon.tl.types import ChatAdminRights, PeerChannel, InputChatUploadedPhoto, ChannelParticipantsAdmins
+from telethon.tl.types import ChatAdminRights, InputChatUploadedPhoto, ChannelParticipantsAdmins
 from cryptography.fernet import Fernet
-from tg_ops.views import get_message_views, get_channel_message_views
+from tg_ops.views import get_message_counters, get_channel_message_views
+from client_pool import STALE_PEER_ERRORS, ClientPool
+from entity_cache import EntityCache
+from scheduler import FloodDeferred, FloodScheduler
+import metrics
 from typing import List, Dict, Optional
 
 # ---------- ENV ----------
@@ -31,8 +34,19 @@ API_ID = int(_api_id) if _api_id.isdigit() else 0
 API_HASH = os.getenv("API_HASH") or os.getenv("TG_API_HASH") or ""
 SESSION_SECRET = os.getenv("SESSION_SECRET", "")
 FLOODWAIT_FALLBACK = int(os.getenv("USERBOT_FLOODWAIT_FALLBACK", "5"))
+# FloodWait короче — вызов ждёт в очереди планировщика, длиннее — сразу 429 с retry_after
+FLOODWAIT_MAX_INLINE = float(os.getenv("USERBOT_FLOODWAIT_MAX_INLINE", "5"))
+# Одновременных вызовов Telegram от имени одного подрядчика
+SESSION_CONCURRENCY = int(os.getenv("USERBOT_SESSION_CONCURRENCY", "4"))
 SESSIONS_DIR = os.getenv("SESSIONS_DIR", "/app/sessions")
 BOT_USERNAME = (os.getenv("BOT_USERNAME") or "").lstrip("@")
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+# Сколько каналов одного подрядчика /rooms/get_views_bulk опрашивает одновременно
+VIEWS_BULK_CONCURRENCY = max(1, int(os.getenv("USERBOT_VIEWS_CONCURRENCY", "4")))
+# Пул подключённых клиентов: не больше N подключений, простаивающие закрываются через M сек
+CLIENT_POOL_MAX = int(os.getenv("USERBOT_CLIENT_POOL_MAX", "50"))
+CLIENT_IDLE_TIMEOUT = float(os.getenv("USERBOT_CLIENT_IDLE_TIMEOUT", "300"))
+ENTITY_CACHE_SIZE = int(os.getenv("USERBOT_ENTITY_CACHE_SIZE", "1000"))
 
 if not API_ID or not API_HASH:
     raise RuntimeError("API_ID/API_HASH not set")
@@ -68,12 +82,15 @@ def load_session(contractor_id: str) -> Optional[str]:
         logger.error(f"Error decrypting session for contractor_id={contractor_id}: {type(e).__name__}: {str(e)}")
         return None
 
-async def with_floodwait(coro):
-    try:
-        return await coro
-    except FloodWaitError as e:
-        await asyncio.sleep(getattr(e, "seconds", FLOODWAIT_FALLBACK))
-        return await coro
+flood = FloodScheduler(
+    max_inline_wait=FLOODWAIT_MAX_INLINE,
+    max_concurrency=SESSION_CONCURRENCY,
+    fallback_wait=FLOODWAIT_FALLBACK,
+)
+
+async def with_floodwait(contractor_id: str, method: str, call):
+    """Вызов через планировщик FloodWait; ``call`` — фабрика новой корутины."""
+    return await flood.run(contractor_id, method, call)
 
 async def get_client_for_contractor(contractor_id: str) -> TelegramClient:
     # contractor_id - это Telegram user ID (как и в /session/status и при сохранении сессий)
@@ -84,17 +101,47 @@ async def get_client_for_contractor(contractor_id: str) -> TelegramClient:
         logger.warning(f"Session not found for contractor_id={contractor_id}")
         raise HTTPException(400, "Нет сессии подрядчика. Сначала выполните вход по номеру.")
     logger.info(f"Session loaded for contractor_id={contractor_id}, connecting...")
-    client = TelegramClient(StringSession(sess), API_ID, API_HASH)
+    client = TelegramClient(StringSession(sess), API_ID, API_HASH, flood_sleep_threshold=0)
     await client.connect()
     if not await client.is_user_authorized():
         logger.warning(f"Session not authorized for contractor_id={contractor_id}")
+        await client.disconnect()
         raise HTTPException(401, "Сессия больше не авторизована")
     logger.info(f"Client connected and authorized for contractor_id={contractor_id}")
     return client
 
+# Клиенты живут между запросами; эндпоинты берут их через clients.acquire/release.
+clients = ClientPool(
+    get_client_for_contractor,
+    max_clients=CLIENT_POOL_MAX,
+    idle_timeout=CLIENT_IDLE_TIMEOUT,
+    entity_cache_size=ENTITY_CACHE_SIZE,
+    entity_store=EntityCache(REDIS_URL),
+    scheduler=flood,
+)
+
 # ---------- APP ----------
 app = FastAPI(title="SmetaBot Userbot (phone only)")
 
+@app.on_event("shutdown")
+async def _close_clients():
+    await clients.close()
+
+@app.exception_handler(FloodDeferred)
+async def _flood_deferred(_request, exc: FloodDeferred):
+    # Подрядчик упёрся в FloodWait: не держим запрос, а говорим, когда повторить.
+    retry_after = max(1, int(exc.retry_after + 0.999))
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "method": exc.method, "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
 # ----------- MODELS -----------
 class SessionStatusResp(BaseModel):
     has_session: bool
@@ -150,6 +197,23 @@ class GetViewsReq(BaseModel):
 class GetViewsResp(BaseModel):
     ok: bool
     views: Dict[int, int]
+    forwards: Dict[int, int] = {}
+    error: Optional[str] = None
+
+class ChannelViewsReq(BaseModel):
+    channel_id: int
+    message_ids: List[int]
+
+class GetViewsBulkReq(BaseModel):
+    contractor_id: str
+    channels: List[ChannelViewsReq]
+
+class GetViewsBulkResp(BaseModel):
+    ok: bool
+    views: Dict[int, Dict[int, int]] = {}     # channel_id -> {message_id: views}
+    forwards: Dict[int, Dict[int, int]] = {}  # channel_id -> {message_id: forwards}
+    errors: Dict[int, str] = {}               # channel_id -> ошибка
+    retry_after: Optional[int] = None         # FloodWait: через сколько сек повторить пропущенные каналы
     error: Optional[str] = None
 
 class GetAdminsReq(BaseModel):
@@ -174,7 +238,7 @@ async def session_status(contractor_id: str, verify: bool = False):
         return SessionStatusResp(has_session=False, authorized=False)
     if not verify:
         return SessionStatusResp(has_session=True, authorized=True)
-    client = TelegramClient(StringSession(sess), API_ID, API_HASH)
+    client = TelegramClient(StringSession(sess), API_ID, API_HASH, flood_sleep_threshold=0)
     try:
         await client.connect()
         ok = await client.is_user_authorized()
@@ -188,10 +252,10 @@ _pending_phone: Dict[str, Dict[str, Any]] = {}  # token -> {client, contractor_i
 @app.post("/login/phone/start", response_model=PhoneStartResp)
 async def phone_start(req: PhoneStartReq):
     token = secrets.token_urlsafe(24)
-    client = TelegramClient(StringSession(), API_ID, API_HASH)
+    client = TelegramClient(StringSession(), API_ID, API_HASH, flood_sleep_threshold=0)
     await client.connect()
     try:
-        await with_floodwait(client.send_code_request(req.phone))
+        await with_floodwait(req.contractor_id, "send_code_request", lambda: client.send_code_request(req.phone))
     except PhoneNumberInvalidError:
         await client.disconnect()
         raise HTTPException(400, "Неверный номер телефона")
@@ -205,10 +269,13 @@ async def phone_confirm(req: PhoneConfirmReq):
         raise HTTPException(404, "Нет активного логина. Начните заново.")
     client: TelegramClient = info["client"]
     try:
-        await with_floodwait(client.sign_in(phone=info["phone"], code=req.code))
+        await with_floodwait(
+            info["contractor_id"], "sign_in", lambda: client.sign_in(phone=info["phone"], code=req.code)
+        )
         me = await client.get_me()
         sess = client.session.save()
         save_session(info["contractor_id"], sess)
+        await clients.invalidate(info["contractor_id"])
         info["ready"] = True
         info["me"] = dict(id=me.id, username=me.username, phone=me.phone)
         return PhoneConfirmResp(status="ready", me=info["me"])
@@ -223,10 +290,11 @@ async def phone_2fa(req: PhonePasswordReq):
     if not info:
         raise HTTPException(404, "Нет активного логина. Начните заново.")
     client: TelegramClient = info["client"]
-    await with_floodwait(client.sign_in(password=req.password))
+    await with_floodwait(info["contractor_id"], "sign_in", lambda: client.sign_in(password=req.password))
     me = await client.get_me()
     sess = client.session.save()
     save_session(info["contractor_id"], sess)
+    await clients.invalidate(info["contractor_id"])
     info["ready"] = True
     info["me"] = dict(id=me.id, username=me.username, phone=me.phone)
     await client.disconnect()
@@ -519,71 +587,84 @@ checkSession();
 async def create_room(req: CreateRoomReq):
     logger.info(f"Creating room for contractor_id={req.contractor_id}, title={req.title}")
     try:
-        client = await get_client_for_contractor(req.contractor_id)
+        client = await clients.acquire(req.contractor_id)
     except HTTPException as e:
-        logger.error(f"HTTPException in get_client_for_contractor: {e.status_code} - {e.detail}")
+        logger.error(f"HTTPException in clients.acquire: {e.status_code} - {e.detail}")
         raise e
     except Exception as e:
-        logger.error(f"Exception in get_client_for_contractor: {type(e).__name__}: {str(e)}")
+        logger.error(f"Exception in clients.acquire: {type(e).__name__}: {str(e)}")
         raise HTTPException(400, f"Ошибка получения клиента: {str(e)}")
     
     try:
         logger.info(f"Creating channel with title: {req.title}")
-        r = await with_floodwait(client(CreateChannelRequest(
+        r = await client(CreateChannelRequest(
             title=req.title,
             about=req.about or "",
             megagroup=False,
             for_import=False
-        )))
+        ))
         ch = r.chats[0]
         logger.info(f"Channel created with id={ch.id}")
+        await clients.remember_channel(req.contractor_id, client, ch)
         await asyncio.sleep(1.5)
         logger.info(f"Enabling no forwards for channel id={ch.id}")
-        await with_floodwait(client(ToggleNoForwardsRequest(peer=ch, enabled=True)))
+        await client(ToggleNoForwardsRequest(peer=ch, enabled=True))
         await asyncio.sleep(1.0)
         logger.info(f"Room creation completed, channel_id={ch.id}")
         return CreateRoomResp(channel_id=ch.id)
+    except FloodDeferred:
+        raise
     except Exception as e:
         logger.error(f"Exception in create_room: {type(e).__name__}: {str(e)}", exc_info=True)
         raise HTTPException(400, f"Ошибка создания канала: {str(e)}")
     finally:
-        await client.disconnect()
+        await clients.release(req.contractor_id, client)
 
 @app.post("/rooms/add_bot_admin")
 async def add_bot_admin(req: AddBotAdminReq):
-    client = await get_client_for_contractor(req.contractor_id)
-    try:
+    client = await clients.acquire(req.contractor_id)
+    bot_username = req.bot_username
+    if bot_username and not bot_username.startswith("@"):  # normalize
+        bot_username = f"@{bot_username}"
+    rights = ChatAdminRights(
+        post_messages=True, invite_users=True,
+        add_admins=False, change_info=True,
+        ban_users=False, delete_messages=False,
+        pin_messages=False, manage_call=False,
+        anonymous=False, edit_messages=False
+    )
+
+    async def _promote() -> None:
         # Ensure we resolve a channel, not a user with the same numeric id
-        entity = await client.get_entity(PeerChannel(int(req.channel_id)))
-        bot_username = req.bot_username
-        if bot_username and not bot_username.startswith("@"):  # normalize
-            bot_username = f"@{bot_username}"
-        bot = await client.get_entity(bot_username)
-        rights = ChatAdminRights(
-            post_messages=True, invite_users=True,
-            add_admins=False, change_info=True,
-            ban_users=False, delete_messages=False,
-            pin_messages=False, manage_call=False,
-            anonymous=False, edit_messages=False
-        )
+        entity = await clients.channel(req.contractor_id, client, req.channel_id)
+        bot = await clients.user(req.contractor_id, client, bot_username)
         try:
-            await with_floodwait(client(EditAdminRequest(
+            await client(EditAdminRequest(
                 channel=entity, user_id=bot, admin_rights=rights, rank="bot"
-            )))
+            ))
+        except (FloodDeferred, *STALE_PEER_ERRORS):
+            raise
         except Exception:
             # Try inviting first (for supergroups) then promote
             try:
-                await with_floodwait(client(InviteToChannelRequest(channel=entity, users=[bot])))
+                await client(InviteToChannelRequest(channel=entity, users=[bot]))
                 await asyncio.sleep(0.8)
+            except (FloodDeferred, *STALE_PEER_ERRORS):
+                raise
             except Exception:
                 pass
-            await with_floodwait(client(EditAdminRequest(
+            await client(EditAdminRequest(
                 channel=entity, user_id=bot, admin_rights=rights, rank="bot"
-            )))
+            ))
+
+    try:
+        await clients.retry_stale(
+            req.contractor_id, client, _promote, channel_id=req.channel_id, username=bot_username
+        )
         await asyncio.sleep(0.5)
         return {"ok": True}
     finally:
-        await client.disconnect()
+        await clients.release(req.contractor_id, client)
 
 
 @app.post("/rooms/set_photo")
@@ -594,9 +675,8 @@ async def set_room_photo(req: SetPhotoReq):
     """
     import base64, io
     from PIL import Image
-    client = await get_client_for_contractor(req.contractor_id)
+    client = await clients.acquire(req.contractor_id)
     try:
-        entity = await client.get_entity(PeerChannel(int(req.channel_id)))
         raw = base64.b64decode(req.photo_b64)
         # Ensure JPEG format
         try:
@@ -609,12 +689,17 @@ async def set_room_photo(req: SetPhotoReq):
             jpeg_bytes = buf.read()
         except Exception:
             jpeg_bytes = raw
-        up = await with_floodwait(client.upload_file(jpeg_bytes))
-        await with_floodwait(client(EditPhotoRequest(channel=entity, photo=InputChatUploadedPhoto(up))))
+        up = await client.upload_file(jpeg_bytes)
+
+        async def _edit_photo() -> None:
+            entity = await clients.channel(req.contractor_id, client, req.channel_id)
+            await client(EditPhotoRequest(channel=entity, photo=InputChatUploadedPhoto(up)))
+
+        await clients.retry_stale(req.contractor_id, client, _edit_photo, channel_id=req.channel_id)
         await asyncio.sleep(0.5)
         return {"ok": True}
     finally:
-        await client.disconnect()
+        await clients.release(req.contractor_id, client)
 
 
 class RefreshStatsReq(BaseModel):
@@ -626,53 +711,139 @@ class RefreshStatsResp(BaseModel):
     updated: int
     error: Optional[str] = None
 
+async def _channel_counters(contractor_id: str, client, channel_id: int, message_ids: List[int]):
+    entity = await clients.channel(contractor_id, client, channel_id)
+    return await get_message_counters(client, channel_id, message_ids, entity=entity)
+
+async def _recent_views(contractor_id: str, client, channel_id: int, limit: int):
+    entity = await clients.channel(contractor_id, client, channel_id)
+    return await get_channel_message_views(client, channel_id, limit, entity=entity)
+
 @app.post("/rooms/get_views", response_model=GetViewsResp)
 async def get_room_views(req: GetViewsReq):
     """Получает количество просмотров для сообщений в канале."""
-    client = await get_client_for_contractor(req.contractor_id)
+    client = await clients.acquire(req.contractor_id)
     try:
         if req.message_ids:
             # Получаем просмотры для конкретных сообщений
-            views = await get_message_views(client, req.channel_id, req.message_ids)
+            counters = await clients.retry_stale(
+                req.contractor_id,
+                client,
+                lambda: _channel_counters(req.contractor_id, client, req.channel_id, req.message_ids),
+                channel_id=req.channel_id,
+            )
+            return GetViewsResp(
+                ok=True,
+                views={m: v for m, (v, _) in counters.items()},
+                forwards={m: f for m, (_, f) in counters.items()},
+            )
         else:
             # Получаем просмотры для последних сообщений
-            views = await get_channel_message_views(client, req.channel_id, req.limit)
+            views = await clients.retry_stale(
+                req.contractor_id,
+                client,
+                lambda: _recent_views(req.contractor_id, client, req.channel_id, req.limit),
+                channel_id=req.channel_id,
+            )
 
         return GetViewsResp(ok=True, views=views)
+    except FloodDeferred:
+        raise
     except Exception as e:
         return GetViewsResp(ok=False, views={}, error=str(e))
     finally:
-        await client.disconnect()
+        await clients.release(req.contractor_id, client)
+
+@app.post("/rooms/get_views_bulk", response_model=GetViewsBulkResp)
+async def get_rooms_views_bulk(req: GetViewsBulkReq):
+    """Просмотры сообщений сразу по нескольким каналам подрядчика.
+
+    Один клиент из пула на весь запрос; каналы опрашиваются параллельно,
+    но не более VIEWS_BULK_CONCURRENCY одновременно.
+    """
+    try:
+        client = await clients.acquire(req.contractor_id)
+    except HTTPException as e:
+        return GetViewsBulkResp(ok=False, error=str(e.detail))
+    sem = asyncio.Semaphore(VIEWS_BULK_CONCURRENCY)
+    views: Dict[int, Dict[int, int]] = {}
+    forwards: Dict[int, Dict[int, int]] = {}
+    errors: Dict[int, str] = {}
+    retry_after = 0.0
+
+    async def _one(item: ChannelViewsReq) -> None:
+        nonlocal retry_after
+        if not item.message_ids:
+            views[item.channel_id] = {}
+            forwards[item.channel_id] = {}
+            return
+        async with sem:
+            try:
+                counters = await clients.retry_stale(
+                    req.contractor_id,
+                    client,
+                    lambda: _channel_counters(req.contractor_id, client, item.channel_id, item.message_ids),
+                    channel_id=item.channel_id,
+                )
+                views[item.channel_id] = {m: v for m, (v, _) in counters.items()}
+                forwards[item.channel_id] = {m: f for m, (_, f) in counters.items()}
+            except FloodDeferred as e:
+                errors[item.channel_id] = str(e)
+                retry_after = max(retry_after, e.retry_after)
+            except Exception as e:
+                errors[item.channel_id] = str(e)
+
+    try:
+        await asyncio.gather(*(_one(item) for item in req.channels))
+        return GetViewsBulkResp(
+            ok=True,
+            views=views,
+            forwards=forwards,
+            errors=errors,
+            retry_after=int(retry_after + 0.999) if retry_after else None,
+        )
+    finally:
+        await clients.release(req.contractor_id, client)
 
 @app.post("/rooms/refresh_stats", response_model=RefreshStatsResp)
 async def refresh_channel_stats(req: RefreshStatsReq):
     """Обновляет статистику просмотров для канала."""
-    client = await get_client_for_contractor(req.contractor_id)
+    client = await clients.acquire(req.contractor_id)
     try:
         # Получаем просмотры для последних сообщений канала
-        views = await get_channel_message_views(client, req.channel_id, limit=100)
+        views = await clients.retry_stale(
+            req.contractor_id,
+            client,
+            lambda: _recent_views(req.contractor_id, client, req.channel_id, 100),
+            channel_id=req.channel_id,
+        )
         
         # Здесь можно добавить логику обновления БД через HTTP запрос к backend
         # Пока просто возвращаем количество найденных сообщений
         return RefreshStatsResp(ok=True, updated=len(views))
         
+    except FloodDeferred:
+        raise
     except Exception as e:
         return RefreshStatsResp(ok=False, updated=0, error=str(e))
     finally:
-        await client.disconnect()
+        await clients.release(req.contractor_id, client)
 
 
 @app.post("/rooms/get_admins", response_model=GetAdminsResp)
 async def get_room_admins(req: GetAdminsReq):
     """Возвращает список администраторов канала."""
-    client = await get_client_for_contractor(req.contractor_id)
+    client = await clients.acquire(req.contractor_id)
     try:
-        entity = await client.get_entity(PeerChannel(int(req.channel_id)))
-        participants = await client.get_participants(
-            entity,
-            filter=ChannelParticipantsAdmins(),
-            limit=req.limit or 50,
-        )
+        async def _admins():
+            entity = await clients.channel(req.contractor_id, client, req.channel_id)
+            return await client.get_participants(
+                entity,
+                filter=ChannelParticipantsAdmins(),
+                limit=req.limit or 50,
+            )
+
+        participants = await clients.retry_stale(req.contractor_id, client, _admins, channel_id=req.channel_id)
         admins: List[AdminInfo] = []
         for user in participants:
             if not getattr(user, "bot", False):
@@ -685,10 +856,12 @@ async def get_room_admins(req: GetAdminsReq):
                     )
                 )
         return GetAdminsResp(ok=True, admins=admins)
+    except FloodDeferred:
+        raise
     except Exception as e:
         return GetAdminsResp(ok=False, admins=[], error=str(e))
     finally:
-        await client.disconnect()
+        await clients.release(req.contractor_id, client)
 
 
 @app.get("/", include_in_schema=False)
@@ -0,0 +1,300 @@
+"""Пул долгоживущих Telethon-клиентов подрядчиков.
+
+Раньше каждый запрос к userbot расшифровывал файл сессии, создавал
+``TelegramClient``, подключался, проверял авторизацию и отключался — сотни
+миллисекунд до полезной работы.  Пул держит по одному подключённому клиенту
+на подрядчика:
+
+* ``acquire``/``release`` (или ``session``) — клиент выдаётся сразу, если уже подключён;
+  несколько запросов одного подрядчика работают через один клиент;
+* простой дольше ``idle_timeout`` — клиент отключается фоновой задачей;
+* больше ``max_clients`` подключений — закрывается давно не использованный
+  свободный клиент (LRU);
+* потерянное соединение переподключается при выдаче, при неудаче клиент
+  пересоздаётся из сессии;
+* ``channel``/``user`` кэшируют InputPeer (access hash) на клиента, а с
+  ``entity_store`` — ещё и в общем кэше (см. entity_cache), так что
+  повторные операции с каналом не тратят RPC на разрешение сущности даже
+  после пересоздания клиента или в другом процессе; ``retry_stale`` при
+  CHANNEL_INVALID/PEER_ID_INVALID забывает закэшированные сущности и
+  повторяет операцию с заново разрешёнными;
+* со ``scheduler`` выдаётся не сам клиент, а обёртка, чьи RPC идут через
+  планировщик FloodWait (см. scheduler).
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+
+from telethon import TelegramClient, utils
+from telethon.errors import ChannelInvalidError, PeerIdInvalidError
+from telethon.tl.types import InputPeerUser, PeerChannel
+
+from entity_cache import EntityCache
+from scheduler import FloodScheduler
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Ошибки, которыми Telegram отвечает на устаревший или чужой access hash.
+STALE_PEER_ERRORS = (ChannelInvalidError, PeerIdInvalidError)
+
+
+class _Entry:
+    __slots__ = ("client", "handle", "in_use", "last_used", "entities")
+
+    def __init__(self, client: TelegramClient, handle) -> None:
+        self.client = client
+        self.handle = handle  # то, что получают вызывающие: клиент или его обёртка
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self.entities: "OrderedDict[object, object]" = OrderedDict()
+
+
+class ClientPool:
+    def __init__(
+        self,
+        connect: Callable[[str], Awaitable[TelegramClient]],
+        *,
+        max_clients: int = 50,
+        idle_timeout: float = 300.0,
+        entity_cache_size: int = 1000,
+        entity_store: Optional[EntityCache] = None,
+        scheduler: Optional[FloodScheduler] = None,
+    ) -> None:
+        self._connect = connect
+        self.max_clients = max(1, max_clients)
+        self.idle_timeout = idle_timeout
+        self.entity_cache_size = max(0, entity_cache_size)
+        self.entity_store = entity_store
+        self.scheduler = scheduler
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Выведенные из пула клиенты, которые ещё обслуживают запросы.
+        self._retired: Dict[int, _Entry] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def acquire(self, contractor_id: str) -> TelegramClient:
+        """Подключённый и авторизованный клиент подрядчика; вернуть через ``release``."""
+        self._ensure_reaper()
+        lock = self._locks.setdefault(contractor_id, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(contractor_id)
+            if entry is not None:
+                # Занят с этого момента: пока идёт переподключение, вытеснение его не тронет.
+                entry.in_use += 1
+                if not entry.client.is_connected():
+                    try:
+                        await entry.client.connect()
+                    except Exception as e:
+                        logger.warning(f"Reconnect failed for contractor_id={contractor_id}: {type(e).__name__}: {e}")
+                        entry.in_use -= 1
+                        self._entries.pop(contractor_id, None)
+                        await self._retire(contractor_id, entry)
+                        entry = None
+            if entry is None:
+                # Исключения фабрики (нет сессии, сессия не авторизована) уходят вызывающему.
+                client = await self._connect(contractor_id)
+                handle = self.scheduler.bind(contractor_id, client) if self.scheduler is not None else client
+                entry = _Entry(client, handle)
+                entry.in_use = 1
+                self._entries[contractor_id] = entry
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(contractor_id)
+        await self._evict_overflow()
+        return entry.handle
+
+    async def release(self, contractor_id: str, client: TelegramClient) -> None:
+        entry = self._entries.get(contractor_id)
+        if entry is None or entry.handle is not client:
+            entry = self._retired.get(id(client))
+            if entry is None:
+                return
+        entry.in_use = max(0, entry.in_use - 1)
+        entry.last_used = time.monotonic()
+        if entry.in_use == 0 and self._retired.pop(id(client), None) is not None:
+            await self._disconnect(contractor_id, entry)
+
+    @asynccontextmanager
+    async def session(self, contractor_id: str) -> AsyncIterator[TelegramClient]:
+        client = await self.acquire(contractor_id)
+        try:
+            yield client
+        finally:
+            await self.release(contractor_id, client)
+
+    async def invalidate(self, contractor_id: str) -> None:
+        """Вывести клиента подрядчика из пула (например, после повторного входа).
+
+        Сущности в общем кэше тоже забываются: access hash привязан к аккаунту,
+        а после входа сессия может принадлежать другому.
+        """
+        entry = self._entries.pop(contractor_id, None)
+        if entry is not None:
+            await self._retire(contractor_id, entry)
+        if self.entity_store is not None:
+            await self.entity_store.forget_contractor(contractor_id)
+
+    async def channel(self, contractor_id: str, client: TelegramClient, channel_id: int):
+        """InputPeerChannel из кэша; при промахе — одно разрешение через Telethon."""
+        channel_id = int(channel_id)
+        peer = self._cached(contractor_id, client, channel_id)
+        if peer is not None:
+            return peer
+        if self.entity_store is not None:
+            peer = await self.entity_store.get_channel(contractor_id, channel_id)
+        if peer is None:
+            peer = await client.get_input_entity(PeerChannel(channel_id))
+            if self.entity_store is not None:
+                await self.entity_store.put_channel(contractor_id, peer)
+        self._remember(contractor_id, client, channel_id, peer)
+        return peer
+
+    async def user(self, contractor_id: str, client: TelegramClient, username: str):
+        """InputPeerUser по @username (например, бота) без повторного ResolveUsername."""
+        key = username.lstrip("@").lower()
+        peer = self._cached(contractor_id, client, key)
+        if peer is not None:
+            return peer
+        if self.entity_store is not None:
+            peer = await self.entity_store.get_user(contractor_id, key)
+        if peer is None:
+            peer = await client.get_input_entity(f"@{key}")
+            if self.entity_store is not None and isinstance(peer, InputPeerUser):
+                await self.entity_store.put_user(contractor_id, key, peer)
+        self._remember(contractor_id, client, key, peer)
+        return peer
+
+    async def retry_stale(
+        self,
+        contractor_id: str,
+        client: TelegramClient,
+        call: Callable[[], Awaitable[T]],
+        *,
+        channel_id: Optional[int] = None,
+        username: Optional[str] = None,
+    ) -> T:
+        """Выполнить ``call`` (он сам берёт сущности через ``channel``/``user``).
+
+        Если Telegram отверг закэшированный access hash, сущности забываются в
+        кэше клиента и в общем кэше, и ``call`` повторяется один раз — уже с
+        заново разрешёнными.
+        """
+        try:
+            return await call()
+        except STALE_PEER_ERRORS as e:
+            logger.info(f"Stale entity for contractor_id={contractor_id}, resolving again: {type(e).__name__}")
+            if channel_id is not None:
+                await self.forget_channel(contractor_id, client, channel_id)
+            if username:
+                key = username.lstrip("@").lower()
+                self._forget(contractor_id, client, key)
+                if self.entity_store is not None:
+                    await self.entity_store.forget_user(contractor_id, key)
+            return await call()
+
+    async def forget_channel(self, contractor_id: str, client: TelegramClient, channel_id: int) -> None:
+        self._forget(contractor_id, client, int(channel_id))
+        if self.entity_store is not None:
+            await self.entity_store.forget_channel(contractor_id, int(channel_id))
+
+    async def remember_channel(self, contractor_id: str, client: TelegramClient, channel) -> None:
+        """Сохранить access hash только что полученного канала (например, созданного)."""
+        peer = utils.get_input_peer(channel)
+        self._remember(contractor_id, client, int(peer.channel_id), peer)
+        if self.entity_store is not None:
+            await self.entity_store.put_channel(contractor_id, peer)
+
+    def _cached(self, contractor_id: str, client: TelegramClient, key: object):
+        entry = self._entries.get(contractor_id)
+        if entry is None or entry.handle is not client or key not in entry.entities:
+            return None
+        entry.entities.move_to_end(key)
+        return entry.entities[key]
+
+    def _forget(self, contractor_id: str, client: TelegramClient, key: object) -> None:
+        entry = self._entries.get(contractor_id)
+        if entry is not None and entry.handle is client:
+            entry.entities.pop(key, None)
+
+    def _remember(self, contractor_id: str, client: TelegramClient, key: object, peer: object) -> None:
+        entry = self._entries.get(contractor_id)
+        if entry is None or entry.handle is not client or not self.entity_cache_size:
+            return
+        entry.entities[key] = peer
+        while len(entry.entities) > self.entity_cache_size:
+            entry.entities.popitem(last=False)
+
+    async def close(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        entries = list(self._entries.items()) + [(None, entry) for entry in self._retired.values()]
+        self._entries.clear()
+        self._retired.clear()
+        for contractor_id, entry in entries:
+            await self._disconnect(contractor_id, entry)
+        if self.entity_store is not None:
+            await self.entity_store.close()
+
+    async def reap_idle(self) -> int:
+        """Отключить клиентов, простаивающих дольше ``idle_timeout``."""
+        deadline = time.monotonic() - self.idle_timeout
+        idle = [
+            (contractor_id, entry)
+            for contractor_id, entry in self._entries.items()
+            if entry.in_use == 0 and entry.last_used < deadline
+        ]
+        reaped = 0
+        for contractor_id, entry in idle:
+            # Пока отключался предыдущий клиент, этот могли выдать запросу или заменить.
+            if self._entries.get(contractor_id) is not entry or entry.in_use or entry.last_used >= deadline:
+                continue
+            del self._entries[contractor_id]
+            await self._disconnect(contractor_id, entry)
+            reaped += 1
+        return reaped
+
+    async def _evict_overflow(self) -> None:
+        # От самых давно использованных; занятые клиенты не трогаем.
+        for contractor_id, entry in list(self._entries.items()):
+            if len(self._entries) <= self.max_clients:
+                return
+            if entry.in_use == 0:
+                del self._entries[contractor_id]
+                await self._disconnect(contractor_id, entry)
+        if len(self._entries) > self.max_clients:
+            logger.warning(f"Client pool over limit: {len(self._entries)}/{self.max_clients} clients busy")
+
+    async def _retire(self, contractor_id: str, entry: _Entry) -> None:
+        # Занятый клиент закрывается последним release, свободный — сразу.
+        if entry.in_use:
+            self._retired[id(entry.handle)] = entry
+        else:
+            await self._disconnect(contractor_id, entry)
+
+    async def _disconnect(self, contractor_id: Optional[str], entry: _Entry) -> None:
+        try:
+            await entry.client.disconnect()
+        except Exception as e:
+            logger.warning(f"Disconnect failed for contractor_id={contractor_id}: {type(e).__name__}: {e}")
+
+    def _ensure_reaper(self) -> None:
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(self._reap_forever())
+
+    async def _reap_forever(self) -> None:
+        interval = max(1.0, min(self.idle_timeout / 2, 60.0))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reap_idle()
+            except Exception:
+                logger.exception("Client pool reaper failed")
@@ -0,0 +1,126 @@
+"""Общий кэш access hash каналов и пользователей в Redis.
+
+StringSession не сохраняет сущности, поэтому каждый новый клиент (после
+рестарта, простоя в пуле или в другом процессе userbot) заново разрешал
+канал через ``get_entity`` — лишний ``GetChannels`` и риск FloodWait.
+Access hash постоянен для пары «аккаунт — канал», так что ключ включает
+подрядчика:
+
+    tgentity:<contractor_id>:c:<channel_id>  -> access_hash
+    tgentity:<contractor_id>:u:<username>    -> "<user_id>:<access_hash>"
+
+Redis недоступен или не установлен — кэш просто пропускается.
+"""
+
+import logging
+import os
+from typing import Optional
+
+from telethon.tl.types import InputPeerChannel, InputPeerUser
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - redis не установлен
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+ENTITY_CACHE_ENABLED = os.getenv("USERBOT_ENTITY_CACHE_ENABLED", "1").lower() not in {"0", "false", "no"}
+ENTITY_CACHE_PREFIX = os.getenv("USERBOT_ENTITY_CACHE_PREFIX", "tgentity")
+ENTITY_CACHE_TTL = int(os.getenv("USERBOT_ENTITY_CACHE_TTL", str(30 * 86400)))
+
+
+class EntityCache:
+    def __init__(self, url: Optional[str], *, prefix: str = ENTITY_CACHE_PREFIX, ttl: int = ENTITY_CACHE_TTL) -> None:
+        self.prefix = prefix
+        self.ttl = ttl
+        self._redis = None
+        if url and aioredis is not None and ENTITY_CACHE_ENABLED:
+            self._redis = aioredis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+
+    @property
+    def enabled(self) -> bool:
+        return self._redis is not None
+
+    def _key(self, contractor_id: str, kind: str, name: object) -> str:
+        return f"{self.prefix}:{contractor_id}:{kind}:{name}"
+
+    async def _get(self, key: str) -> Optional[str]:
+        if self._redis is None:
+            return None
+        try:
+            raw = await self._redis.getex(key, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Entity cache lookup failed: {type(e).__name__}: {e}")
+            return None
+        return raw.decode("utf-8") if raw else None
+
+    async def _set(self, key: str, value: str) -> None:
+        if self._redis is None:
+            return
+        try:
+            await self._redis.set(key, value, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Entity cache store failed: {type(e).__name__}: {e}")
+
+    async def get_channel(self, contractor_id: str, channel_id: int) -> Optional[InputPeerChannel]:
+        raw = await self._get(self._key(contractor_id, "c", int(channel_id)))
+        if raw is None:
+            return None
+        try:
+            return InputPeerChannel(channel_id=int(channel_id), access_hash=int(raw))
+        except ValueError:
+            return None
+
+    async def put_channel(self, contractor_id: str, peer: InputPeerChannel) -> None:
+        await self._set(self._key(contractor_id, "c", peer.channel_id), str(peer.access_hash))
+
+    async def get_user(self, contractor_id: str, username: str) -> Optional[InputPeerUser]:
+        raw = await self._get(self._key(contractor_id, "u", username.lstrip("@").lower()))
+        if raw is None:
+            return None
+        try:
+            user_id, access_hash = raw.split(":", 1)
+            return InputPeerUser(user_id=int(user_id), access_hash=int(access_hash))
+        except ValueError:
+            return None
+
+    async def put_user(self, contractor_id: str, username: str, peer: InputPeerUser) -> None:
+        await self._set(
+            self._key(contractor_id, "u", username.lstrip("@").lower()),
+            f"{peer.user_id}:{peer.access_hash}",
+        )
+
+    async def forget_channel(self, contractor_id: str, channel_id: int) -> None:
+        if self._redis is None:
+            return
+        try:
+            await self._redis.delete(self._key(contractor_id, "c", int(channel_id)))
+        except Exception:
+            pass
+
+    async def forget_user(self, contractor_id: str, username: str) -> None:
+        if self._redis is None:
+            return
+        try:
+            await self._redis.delete(self._key(contractor_id, "u", username.lstrip("@").lower()))
+        except Exception:
+            pass
+
+    async def forget_contractor(self, contractor_id: str) -> None:
+        """Удалить все сущности подрядчика (после повторного входа — другой аккаунт)."""
+        if self._redis is None:
+            return
+        try:
+            keys = [key async for key in self._redis.scan_iter(match=f"{self.prefix}:{contractor_id}:*", count=500)]
+            if keys:
+                await self._redis.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Entity cache cleanup failed: {type(e).__name__}: {e}")
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            try:
+                await self._redis.aclose()
+            except Exception:
+                pass
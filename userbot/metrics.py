@@ -0,0 +1,52 @@
+"""Prometheus-метрики userbot (FloodWait и очередь планировщика), отдаются на /metrics."""
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+registry = CollectorRegistry()
+
+flood_wait_total = Counter(
+    "smetabot_userbot_flood_wait_total",
+    "FloodWait errors returned by Telegram, grouped by method.",
+    ["method"],
+    registry=registry,
+)
+flood_wait_seconds = Histogram(
+    "smetabot_userbot_flood_wait_seconds",
+    "Wait requested by Telegram in FloodWait errors.",
+    buckets=(1, 2, 5, 10, 30, 60, 300, 900, 3600),
+    registry=registry,
+)
+scheduler_wait_seconds = Histogram(
+    "smetabot_userbot_scheduler_wait_seconds",
+    "Time a call spent queued in the scheduler before reaching Telegram.",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10),
+    registry=registry,
+)
+scheduler_deferred_total = Counter(
+    "smetabot_userbot_scheduler_deferred_total",
+    "Calls rejected with a retry-after hint instead of waiting, grouped by method.",
+    ["method"],
+    registry=registry,
+)
+scheduler_backlog = Gauge(
+    "smetabot_userbot_scheduler_backlog",
+    "Calls currently queued in the scheduler.",
+    registry=registry,
+)
+
+
+def record_flood_wait(method: str, seconds: float) -> None:
+    flood_wait_total.labels(method=method).inc()
+    flood_wait_seconds.observe(seconds)
+
+
+def record_deferred(method: str) -> None:
+    scheduler_deferred_total.labels(method=method).inc()
+
+
+def record_queue_wait(seconds: float) -> None:
+    scheduler_wait_seconds.observe(seconds)
+
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(registry), CONTENT_TYPE_LATEST
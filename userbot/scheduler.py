@@ -0,0 +1,169 @@
+"""Планировщик вызовов Telegram с учётом FloodWait.
+
+Раньше ``with_floodwait`` засыпал на запрошенное Telegram время прямо в
+обработчике и повторно await-ил тот же объект корутины (что невозможно),
+а Telethon сам спал на FloodWait до 60 с внутри вызова.  Теперь:
+
+* клиенты создаются с ``flood_sleep_threshold=0`` — FloodWait всегда
+  доходит сюда;
+* для каждой пары «подрядчик — метод» хранится срок, до которого Telegram
+  запретил вызовы; новые вызовы ждут его в очереди, если ждать не дольше
+  ``max_inline_wait``, иначе сразу получают ``FloodDeferred`` с подсказкой
+  retry_after (HTTP 429 для клиента API);
+* у подрядчика не больше ``max_concurrency`` одновременных вызовов, а после
+  каждого FloodWait интервал между его вызовами растёт (и постепенно
+  уменьшается при успешных) — один «зажатый» подрядчик не держит остальных;
+* ожидание, очередь и FloodWait видны в метриках (userbot/metrics.py).
+
+Вызов передаётся фабрикой (``lambda: client(Request(...))``), чтобы повтор
+создавал новую корутину.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Tuple, TypeVar
+
+from telethon.errors import FloodWaitError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class FloodDeferred(Exception):
+    """Вызов не выполнен: Telegram ограничил метод, повторить через ``retry_after`` сек."""
+
+    def __init__(self, contractor_id: str, method: str, retry_after: float) -> None:
+        super().__init__(f"FloodWait on {method}, retry after {retry_after:.0f}s")
+        self.contractor_id = contractor_id
+        self.method = method
+        self.retry_after = retry_after
+
+
+class FloodScheduler:
+    def __init__(
+        self,
+        *,
+        max_inline_wait: float = 5.0,
+        max_concurrency: int = 4,
+        max_attempts: int = 3,
+        pace_start: float = 0.2,
+        pace_max: float = 5.0,
+        fallback_wait: float = 5.0,
+    ) -> None:
+        self.max_inline_wait = max_inline_wait
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.pace_start = pace_start
+        self.pace_max = pace_max
+        self.fallback_wait = fallback_wait
+        self._deadlines: Dict[Tuple[str, str], float] = {}
+        self._pace: Dict[str, float] = {}
+        self._next_start: Dict[str, float] = {}
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        self._backlog = 0
+
+    def retry_after(self, contractor_id: str, method: str) -> float:
+        """Сколько секунд ещё нельзя вызывать ``method`` от имени подрядчика."""
+        now = time.monotonic()
+        deadline = self._deadlines.get((contractor_id, method), 0.0)
+        if deadline and deadline <= now:
+            del self._deadlines[(contractor_id, method)]
+        return max(0.0, deadline - now, self._next_start.get(contractor_id, 0.0) - now)
+
+    def bind(self, contractor_id: str, client) -> "ScheduledClient":
+        return ScheduledClient(self, contractor_id, client)
+
+    async def run(self, contractor_id: str, method: str, call: Callable[[], Awaitable[T]]) -> T:
+        for attempt in range(1, self.max_attempts + 1):
+            await self._wait_turn(contractor_id, method)
+            slot = self._slots.setdefault(contractor_id, asyncio.Semaphore(self.max_concurrency))
+            async with slot:
+                self._next_start[contractor_id] = time.monotonic() + self._pace.get(contractor_id, 0.0)
+                try:
+                    result = await call()
+                except FloodWaitError as e:
+                    seconds = float(getattr(e, "seconds", 0) or self.fallback_wait)
+                    self._on_flood(contractor_id, method, seconds)
+                    if seconds > self.max_inline_wait or attempt == self.max_attempts:
+                        metrics.record_deferred(method)
+                        raise FloodDeferred(contractor_id, method, seconds) from e
+                    continue
+            self._on_success(contractor_id)
+            return result
+        raise AssertionError("unreachable")
+
+    async def _wait_turn(self, contractor_id: str, method: str) -> None:
+        # Ждём в очереди, пока метод снова разрешён; долгие сроки сразу отдаём вызывающему.
+        queued_at = time.monotonic()
+        self._backlog += 1
+        metrics.scheduler_backlog.set(self._backlog)
+        try:
+            while True:
+                wait = self.retry_after(contractor_id, method)
+                if wait <= 0:
+                    break
+                if wait > self.max_inline_wait:
+                    metrics.record_deferred(method)
+                    raise FloodDeferred(contractor_id, method, wait)
+                await asyncio.sleep(wait)
+        finally:
+            self._backlog -= 1
+            metrics.scheduler_backlog.set(self._backlog)
+            metrics.record_queue_wait(time.monotonic() - queued_at)
+
+    def _on_flood(self, contractor_id: str, method: str, seconds: float) -> None:
+        logger.warning(f"FloodWait {seconds:.0f}s for contractor_id={contractor_id}, method={method}")
+        metrics.record_flood_wait(method, seconds)
+        key = (contractor_id, method)
+        self._deadlines[key] = max(self._deadlines.get(key, 0.0), time.monotonic() + seconds)
+        pace = self._pace.get(contractor_id, 0.0)
+        self._pace[contractor_id] = min(self.pace_max, max(pace * 2, self.pace_start))
+
+    def _on_success(self, contractor_id: str) -> None:
+        pace = self._pace.get(contractor_id)
+        if pace is None:
+            return
+        pace /= 2
+        if pace < self.pace_start / 4:
+            self._pace.pop(contractor_id, None)
+        else:
+            self._pace[contractor_id] = pace
+
+
+# Высокоуровневые методы Telethon, которые делают RPC и идут через планировщик.
+_SCHEDULED_METHODS = frozenset({
+    "get_input_entity",
+    "get_entity",
+    "get_messages",
+    "get_participants",
+    "upload_file",
+    "get_me",
+})
+
+
+class ScheduledClient:
+    """Обёртка клиента: ``await client(Request)`` и RPC-методы идут через планировщик."""
+
+    def __init__(self, scheduler: FloodScheduler, contractor_id: str, client) -> None:
+        self.scheduler = scheduler
+        self.contractor_id = contractor_id
+        self.client = client
+
+    async def __call__(self, request):
+        return await self.scheduler.run(
+            self.contractor_id, type(request).__name__, lambda: self.client(request)
+        )
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.client, name)
+        if name not in _SCHEDULED_METHODS:
+            return attr
+
+        async def scheduled(*args, **kwargs):
+            return await self.scheduler.run(self.contractor_id, name, lambda: attr(*args, **kwargs))
+
+        return scheduled
@@ -1,66 +1,109 @@
 import asyncio
+import os
 from typing import Dict, List, Optional, Tuple
 from telethon import TelegramClient
+from telethon.tl.functions.messages import GetMessagesViewsRequest
 from telethon.tl.types import PeerChannel
-from telethon.errors import FloodWaitError
+from telethon.errors import RPCError
 import logging
 
 logger = logging.getLogger(__name__)
 
+# messages.getMessagesViews принимает не больше 100 id за вызов
+VIEWS_BATCH_SIZE = 100
+# Сколько пачек одного канала запрашивается одновременно
+VIEWS_BATCH_CONCURRENCY = max(1, int(os.getenv("USERBOT_VIEWS_BATCH_CONCURRENCY", "3")))
+
+
+async def get_message_counters(
+    client: TelegramClient,
+    channel_id: int,
+    message_ids: List[int],
+    entity=None,
+) -> Dict[int, Tuple[int, int]]:
+    """
+    Получает просмотры и пересылки сообщений канала через messages.getMessagesViews.
+
+    В отличие от get_messages не тянет сами сообщения (текст, медиа, документы) —
+    только счётчики; increment=False, чтобы не накручивать просмотры.
+    Пачки по VIEWS_BATCH_SIZE id запрашиваются параллельно
+    (не более VIEWS_BATCH_CONCURRENCY одновременно).  FloodWait здесь не
+    ждём: клиент из пула пропускает вызовы через планировщик (scheduler),
+    и его FloodDeferred уходит вызывающему.  Остальные ошибки Telegram
+    (CHANNEL_INVALID, CHANNEL_PRIVATE, ...) тоже пробрасываются: пустой
+    результат означал бы «просмотров нет», а не «канал недоступен».
+
+    Args:
+        client: Telethon клиент
+        channel_id: ID канала в Telegram
+        message_ids: Список ID сообщений
+        entity: InputPeer канала, если уже известен (без повторного разрешения)
+
+    Returns:
+        Dict[message_id, (views, forwards)]; удалённые сообщения пропускаются
+    """
+    counters: Dict[int, Tuple[int, int]] = {}
+    if not message_ids:
+        return counters
+
+    try:
+        if entity is None:
+            entity = await client.get_input_entity(PeerChannel(channel_id))
+    except (RPCError, ValueError) as e:
+        logger.error(f"Error accessing channel {channel_id}: {e}")
+        raise
+
+    ids = list(dict.fromkeys(int(m) for m in message_ids))
+    batches = [ids[i:i + VIEWS_BATCH_SIZE] for i in range(0, len(ids), VIEWS_BATCH_SIZE)]
+    sem = asyncio.Semaphore(VIEWS_BATCH_CONCURRENCY)
+
+    async def _batch(num: int, batch: List[int]) -> None:
+        request = GetMessagesViewsRequest(peer=entity, id=batch, increment=False)
+        async with sem:
+            try:
+                result = await client(request)
+            except RPCError as e:
+                logger.error(f"Error getting views for channel {channel_id}, batch {num + 1}: {e}")
+                raise
+        # Ответ идёт в порядке запрошенных id
+        for message_id, item in zip(batch, result.views):
+            if item.views is not None:
+                counters[message_id] = (item.views, item.forwards or 0)
+
+    # Дожидаемся всех пачек, затем пробрасываем первую ошибку (например, FloodDeferred).
+    results = await asyncio.gather(*(_batch(num, batch) for num, batch in enumerate(batches)), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return counters
+
+
 async def get_message_views(
-    client: TelegramClient, 
-    channel_id: int, 
-    message_ids: List[int]
+    client: TelegramClient,
+    channel_id: int,
+    message_ids: List[int],
+    entity=None,
 ) -> Dict[int, int]:
     """
     Получает количество просмотров для сообщений в канале.
-    
+
     Args:
         client: Telethon клиент
         channel_id: ID канала в Telegram
         message_ids: Список ID сообщений
-        
+        entity: InputPeer канала, если уже известен (без повторного разрешения)
+
     Returns:
         Dict[message_id, views_count]
     """
-    views_data = {}
-    
-    try:
-        # Получаем канал
-        entity = await client.get_entity(PeerChannel(channel_id))
-        
-        # Получаем сообщения пакетами по 100 (лимит Telegram API)
-        batch_size = 100
-        for i in range(0, len(message_ids), batch_size):
-            batch = message_ids[i:i + batch_size]
-            
-            try:
-                # Получаем сообщения
-                messages = await client.get_messages(entity, ids=batch)
-                
-                for msg in messages:
-                    if msg and hasattr(msg, 'views'):
-                        views_data[msg.id] = msg.views or 0
-                    else:
-                        views_data[msg.id] = 0
-                        
-            except FloodWaitError as e:
-                logger.warning(f"FloodWait {e.seconds}s for channel {channel_id}, batch {i//batch_size + 1}")
-                await asyncio.sleep(e.seconds)
-                continue
-            except Exception as e:
-                logger.error(f"Error getting messages for channel {channel_id}: {e}")
-                continue
-                
-    except Exception as e:
-        logger.error(f"Error accessing channel {channel_id}: {e}")
-        
-    return views_data
+    counters = await get_message_counters(client, channel_id, message_ids, entity=entity)
+    return {message_id: views for message_id, (views, _) in counters.items()}
 
 async def get_channel_message_views(
     client: TelegramClient, 
     channel_id: int, 
-    limit: int = 100
+    limit: int = 100,
+    entity=None,
 ) -> Dict[int, int]:
     """
     Получает просмотры для последних сообщений в канале.
@@ -69,6 +112,7 @@ async def get_channel_message_views(
         client: Telethon клиент
         channel_id: ID канала в Telegram
         limit: Максимальное количество сообщений
+        entity: InputPeer канала, если уже известен (без повторного разрешения)
         
     Returns:
         Dict[message_id, views_count]
@@ -77,7 +121,8 @@ async def get_channel_message_views(
     
     try:
         # Получаем канал
-        entity = await client.get_entity(PeerChannel(channel_id))
+        if entity is None:
+            entity = await client.get_input_entity(PeerChannel(channel_id))
         
         # Получаем последние сообщения
         messages = await client.get_messages(entity, limit=limit)
@@ -86,7 +131,8 @@ async def get_channel_message_views(
             if msg and hasattr(msg, 'views'):
                 views_data[msg.id] = msg.views or 0
                 
-    except Exception as e:
+    except (RPCError, ValueError) as e:
         logger.error(f"Error getting channel messages for {channel_id}: {e}")
-        
-    return views_data
\ No newline at end of file
+        raise
+
+    return views_data
@@ -0,0 +1,192 @@
+"""Benchmark view collection: full message fetch vs messages.getMessagesViews.
+
+Usage (from the userbot directory)::
+
+    python -m utils.bench_views --channels 20 --messages 300 --latency-ms 40
+
+No Telegram account is needed: ``FakeMTProto`` answers the two RPCs with
+real TL objects (document posts with thumbnails for ``channels.getMessages``,
+counters for ``messages.getMessagesViews``), serialises them to MTProto
+bytes, charges link latency plus transfer time over one shared connection
+and parses the bytes back on the "client" side.  The report shows wall
+time, RPC count and bytes received for each path.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from telethon.extensions import BinaryReader
+from telethon.tl.functions.channels import GetMessagesRequest
+from telethon.tl.functions.messages import GetMessagesViewsRequest
+from telethon.tl.types import (
+    Channel,
+    ChatPhotoEmpty,
+    Document,
+    DocumentAttributeFilename,
+    DocumentAttributeImageSize,
+    InputChannel,
+    InputMessageID,
+    InputPeerChannel,
+    Message,
+    MessageMediaDocument,
+    MessageViews,
+    PeerChannel,
+    PhotoSize,
+    PhotoStrippedSize,
+)
+from telethon.tl.types.messages import ChannelMessages, MessageViews as MessagesMessageViews
+
+from tg_ops import views as views_ops
+
+
+class FakeMTProto:
+    """In-process responder standing in for a Telethon client."""
+
+    def __init__(self, latency: float, bandwidth: float) -> None:
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stats = {"rpc": 0, "bytes_in": 0, "bytes_out": 0}
+        self._link = asyncio.Lock()
+        self._now = datetime.now(timezone.utc)
+
+    def _channel(self, channel_id: int) -> Channel:
+        return Channel(
+            id=channel_id,
+            title=f"Смета {channel_id}",
+            photo=ChatPhotoEmpty(),
+            date=self._now,
+            access_hash=channel_id * 7,
+            broadcast=True,
+            noforwards=True,
+        )
+
+    def _message(self, channel_id: int, message_id: int) -> Message:
+        document = Document(
+            id=random.getrandbits(62),
+            access_hash=random.getrandbits(62),
+            file_reference=random.randbytes(24),
+            date=self._now,
+            mime_type="image/png",
+            size=1_800_000,
+            dc_id=2,
+            attributes=[
+                DocumentAttributeImageSize(w=2480, h=3508),
+                DocumentAttributeFilename(file_name=f"smeta_{message_id}_page_01.png"),
+            ],
+            thumbs=[
+                PhotoStrippedSize(type="i", bytes=random.randbytes(600)),
+                PhotoSize(type="m", w=226, h=320, size=9_000),
+            ],
+        )
+        return Message(
+            id=message_id,
+            peer_id=PeerChannel(channel_id),
+            date=self._now,
+            message="",
+            post=True,
+            noforwards=True,
+            media=MessageMediaDocument(document=document),
+            views=message_id * 3,
+            forwards=message_id % 5,
+        )
+
+    async def __call__(self, request):
+        if isinstance(request, GetMessagesRequest):
+            channel_id = request.channel.channel_id
+            response = ChannelMessages(
+                pts=1,
+                count=len(request.id),
+                messages=[self._message(channel_id, m.id) for m in request.id],
+                topics=[],
+                chats=[self._channel(channel_id)],
+                users=[],
+            )
+        elif isinstance(request, GetMessagesViewsRequest):
+            channel_id = request.peer.channel_id
+            response = MessagesMessageViews(
+                views=[MessageViews(views=m * 3, forwards=m % 5) for m in request.id],
+                chats=[self._channel(channel_id)],
+                users=[],
+            )
+        else:
+            raise NotImplementedError(type(request).__name__)
+
+        sent, received = bytes(request), bytes(response)
+        self.stats["rpc"] += 1
+        self.stats["bytes_out"] += len(sent)
+        self.stats["bytes_in"] += len(received)
+        await asyncio.sleep(self.latency)
+        async with self._link:  # one TCP connection: transfers do not overlap
+            await asyncio.sleep((len(sent) + len(received)) / self.bandwidth)
+        return BinaryReader(received).tgread_object()
+
+    async def get_messages(self, entity, ids: List[int]):
+        channel = InputChannel(entity.channel_id, entity.access_hash)
+        result = await self(GetMessagesRequest(channel=channel, id=[InputMessageID(i) for i in ids]))
+        return result.messages
+
+    async def get_input_entity(self, peer):
+        return InputPeerChannel(peer.channel_id, peer.channel_id * 7)
+
+
+async def _legacy_views(client: FakeMTProto, entity, message_ids: List[int]) -> Dict[int, int]:
+    # The previous tg_ops.views.get_message_views: full messages, 100 per call, one call at a time.
+    views: Dict[int, int] = {}
+    for i in range(0, len(message_ids), 100):
+        for msg in await client.get_messages(entity, ids=message_ids[i:i + 100]):
+            views[msg.id] = msg.views or 0
+    return views
+
+
+async def _run(label: str, collect, channels: int, messages: int, latency: float, bandwidth: float) -> Dict[int, int]:
+    client = FakeMTProto(latency, bandwidth)
+    ids = list(range(1, messages + 1))
+    started = time.perf_counter()
+    total: Dict[int, int] = {}
+    for channel_id in range(1000, 1000 + channels):
+        entity = InputPeerChannel(channel_id, channel_id * 7)
+        total.update({channel_id * 1_000_000 + m: v for m, v in (await collect(client, channel_id, entity, ids)).items()})
+    elapsed = time.perf_counter() - started
+    stats = client.stats
+    print(
+        f"{label:<20} {elapsed * 1000:9.1f} ms  rpc={stats['rpc']:<5} "
+        f"received={stats['bytes_in'] / 1024:9.1f} KiB  sent={stats['bytes_out'] / 1024:7.1f} KiB"
+    )
+    return total
+
+
+async def _main(args: argparse.Namespace) -> None:
+    latency = args.latency_ms / 1000.0
+    bandwidth = args.bandwidth_kib * 1024.0
+    legacy = await _run(
+        "get_messages",
+        lambda client, _cid, entity, ids: _legacy_views(client, entity, ids),
+        args.channels, args.messages, latency, bandwidth,
+    )
+    current = await _run(
+        "getMessagesViews",
+        lambda client, cid, entity, ids: views_ops.get_message_views(client, cid, ids, entity=entity),
+        args.channels, args.messages, latency, bandwidth,
+    )
+    if legacy != current:
+        raise SystemExit("view counts differ between the two paths")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=300, help="message ids per channel")
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="round-trip time per RPC")
+    parser.add_argument("--bandwidth-kib", type=float, default=1024.0, help="link throughput, KiB/s")
+    parser.add_argument("--batch-concurrency", type=int, default=views_ops.VIEWS_BATCH_CONCURRENCY)
+    args = parser.parse_args()
+    views_ops.VIEWS_BATCH_CONCURRENCY = max(1, args.batch_concurrency)
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
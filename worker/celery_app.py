@@ -47,9 +47,14 @@ celery.conf.update(
         "tasks.render.render_pdf_to_jpeg_300dpi": {"queue": pdf_queue},
         "tasks.render.process_and_publish_pdf": {"queue": pdf_queue},
         "tasks.render.process_and_publish_png": {"queue": publish_queue},
+        "tasks.render.publish_stored_pages": {"queue": publish_queue},
+        "tasks.render.publish_page": {"queue": publish_queue},
+        "tasks.render.publish_album": {"queue": publish_queue},
+        "tasks.render.record_publications": {"queue": publish_queue},
         "tasks.render.process_and_publish_doc": {"queue": office_queue},
         "tasks.render.process_and_publish_excel": {"queue": office_queue},
         "tasks.preview.generate_preview_task": {"queue": preview_queue},
+        "tasks.preview.generate_preview_pages_task": {"queue": preview_queue},
         "tasks.publish.send_document": {"queue": publish_queue},
     },
     beat_schedule={
@@ -59,7 +64,16 @@ celery.conf.update(
         },
         "update-channel-stats": {
             "task": "tasks.stats.update_channel_stats",
-            "schedule": 3600.0,  # Каждый час
+            "schedule": 300.0,  # Каждые 5 минут: только каналы с флагом dirty
+        },
+        "rebuild-channel-stats": {
+            "task": "tasks.stats.update_channel_stats",
+            "schedule": 86400.0,  # Раз в день: полный пересчёт на случай расхождений
+            "kwargs": {"full": True},
+        },
+        "refresh-profile-overview": {
+            "task": "tasks.stats.refresh_profile_overview",
+            "schedule": 120.0,  # Каждые 2 минуты (PROFILE_OVERVIEW_MAX_STALENESS — предел устаревания)
         },
         "apply-queued-gifts": {
             "task": "tasks.stats.apply_queued_gifts",
@@ -80,5 +94,11 @@ import tasks.preview  # noqa: F401
 import tasks.stats  # noqa: F401
 
 from worker.metrics import setup_celery_signal_handlers  # noqa: E402
+from tasks.render.utils.libreoffice import setup_pool_signal_handlers  # noqa: E402
+from tasks.bot_api import setup_session_signal_handlers  # noqa: E402
+from tasks.db_loop import setup_db_signal_handlers  # noqa: E402
 
 setup_celery_signal_handlers()
+setup_pool_signal_handlers()
+setup_session_signal_handlers()
+setup_db_signal_handlers()
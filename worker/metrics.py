@@ -68,6 +68,70 @@ publish_payload_size = Histogram(
     registry=_registry,
 )
 
+render_cache_total = Counter(
+    "smetabot_render_cache_total",
+    "Render cache lookups and writes grouped by layer and outcome.",
+    ["layer", "outcome"],
+    registry=_registry,
+)
+watermark_overlay_total = Counter(
+    "smetabot_watermark_overlay_cache_total",
+    "Watermark overlay cache events grouped by outcome (hit, miss, eviction).",
+    ["outcome"],
+    registry=_registry,
+)
+page_encode_duration = Histogram(
+    "smetabot_page_encode_duration_seconds",
+    "Time spent encoding a page before publication.",
+    ["format"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5),
+    registry=_registry,
+)
+page_encode_size = Histogram(
+    "smetabot_page_encode_bytes",
+    "Size of encoded pages (bytes).",
+    ["format"],
+    buckets=(64 * 1024, 256 * 1024, 512 * 1024, 1024 * 1024, 3 * 1024 * 1024, 6 * 1024 * 1024, 10 * 1024 * 1024),
+    registry=_registry,
+)
+rate_limit_wait = Histogram(
+    "smetabot_rate_limit_wait_seconds",
+    "Time a send waited for the shared Telegram rate limiter, by exhausted scope.",
+    ["scope"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+    registry=_registry,
+)
+rate_limit_throttled_total = Counter(
+    "smetabot_rate_limit_throttled_total",
+    "Sends delayed locally by the rate limiter instead of hitting Telegram's limit.",
+    ["scope"],
+    registry=_registry,
+)
+stats_job_duration = Histogram(
+    "smetabot_stats_job_duration_seconds",
+    "Duration of analytics refresh jobs.",
+    ["job", "outcome"],
+    buckets=(0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300),
+    registry=_registry,
+)
+stats_job_rows = Counter(
+    "smetabot_stats_job_rows_total",
+    "Rows written by analytics refresh jobs.",
+    ["job"],
+    registry=_registry,
+)
+file_id_cache_total = Counter(
+    "smetabot_publish_file_id_cache_total",
+    "Telegram file_id reuse cache lookups grouped by outcome (hit, miss, stale).",
+    ["outcome"],
+    registry=_registry,
+)
+telegram_flood_total = Counter(
+    "smetabot_telegram_flood_total",
+    "429 Too Many Requests answers received from the Bot API.",
+    registry=_registry,
+)
+
 
 class _PublishStatsAggregator:
     """Aggregates publication stats and emits periodic summaries to logs."""
@@ -150,6 +214,44 @@ def record_publish(outcome: Literal["success", "failure"], duration: float, retr
     _aggregator.record(outcome == "success", duration, retries, size_bytes)
 
 
+def record_render_cache(layer: str, outcome: str) -> None:
+    """Track a render cache event (hit, miss, store, skip or error)."""
+    render_cache_total.labels(layer=layer, outcome=outcome).inc()
+
+
+def record_watermark_overlay(outcome: str) -> None:
+    """Track a watermark overlay cache event (hit, miss or eviction)."""
+    watermark_overlay_total.labels(outcome=outcome).inc()
+
+
+def record_encode(fmt: str, duration: float, size_bytes: int) -> None:
+    """Track latency and output size of one page encode."""
+    page_encode_duration.labels(format=fmt).observe(duration)
+    page_encode_size.labels(format=fmt).observe(size_bytes)
+
+
+def record_rate_limit_wait(scope: str, seconds: float) -> None:
+    """Track one local wait imposed by the Telegram rate limiter."""
+    rate_limit_throttled_total.labels(scope=scope).inc()
+    rate_limit_wait.labels(scope=scope).observe(seconds)
+
+
+def record_telegram_flood(retry_after: float) -> None:
+    """Track a 429 answer from Telegram."""
+    telegram_flood_total.inc()
+
+
+def record_file_id_cache(outcome: str) -> None:
+    """Track a file_id reuse cache event (hit, miss or stale)."""
+    file_id_cache_total.labels(outcome=outcome).inc()
+
+
+def record_stats_job(job: str, outcome: str, duration: float, rows: int) -> None:
+    """Track duration and written rows of one analytics refresh run."""
+    stats_job_duration.labels(job=job, outcome=outcome).observe(duration)
+    stats_job_rows.labels(job=job).inc(rows)
+
+
 def start_metrics_server() -> None:
     """Start the Prometheus HTTP server once."""
     global _METRICS_SERVER_STARTED
@@ -0,0 +1,122 @@
+"""Shared HTTP client for Telegram Bot API calls made by the publish tasks.
+
+Every worker process keeps one keep-alive session, so consecutive pages reuse
+the TCP/TLS connection to ``api.telegram.org`` instead of paying a handshake
+per request.  ``httpx`` with HTTP/2 is used when installed (``httpx[http2]``),
+otherwise a ``requests.Session`` with a bounded connection pool.
+
+Environment:
+
+* ``TELEGRAM_API_BASE`` – Bot API root, e.g. a local stub
+  (``python -m worker.utils.stub_bot_api``);
+* ``BOT_API_POOL_MAXSIZE`` – connections kept per process (default 4);
+* ``BOT_API_HTTP2`` – prefer HTTP/2 when httpx is available (default on);
+* ``BOT_API_TIMEOUT`` – request timeout in seconds (default 60).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from threading import Lock
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx  # type: ignore
+    import h2  # type: ignore  # noqa: F401 - httpx needs it for http2=True
+
+    _HTTP2_OK = True
+except Exception:  # pragma: no cover - optional dependency
+    httpx = None  # type: ignore
+    _HTTP2_OK = False
+
+logger = logging.getLogger(__name__)
+
+BOT_TOKEN = os.getenv("BOT_TOKEN", "")
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+BOT_API_POOL_MAXSIZE = int(os.getenv("BOT_API_POOL_MAXSIZE", "4"))
+BOT_API_HTTP2 = os.getenv("BOT_API_HTTP2", "1").lower() not in {"0", "false", "no"}
+BOT_API_TIMEOUT = float(os.getenv("BOT_API_TIMEOUT", "60"))
+
+_session: Any = None
+_session_pid: Optional[int] = None
+_session_lock = Lock()
+
+
+def api_url(method: str, token: str | None = None) -> str:
+    return f"{TELEGRAM_API_BASE}/bot{token or BOT_TOKEN}/{method}"
+
+
+def _new_session() -> Any:
+    if BOT_API_HTTP2 and _HTTP2_OK:
+        limits = httpx.Limits(
+            max_connections=BOT_API_POOL_MAXSIZE,
+            max_keepalive_connections=BOT_API_POOL_MAXSIZE,
+        )
+        return httpx.Client(http2=True, limits=limits, timeout=BOT_API_TIMEOUT)
+    session = requests.Session()
+    # Retries are handled by the callers, which know about Telegram error codes.
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=BOT_API_POOL_MAXSIZE, max_retries=0, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> Any:
+    """Keep-alive session of the current process (recreated after a fork)."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            # A session inherited from the parent shares its sockets; never reuse it.
+            _session = _new_session()
+            _session_pid = pid
+        return _session
+
+
+def close_session() -> None:
+    global _session, _session_pid
+    with _session_lock:
+        session, pid = _session, _session_pid
+        _session = None
+        _session_pid = None
+    if session is not None and pid == os.getpid():
+        try:
+            session.close()
+        except Exception:  # pragma: no cover - best effort
+            logger.debug("bot_api: failed to close session", exc_info=True)
+
+
+def post(
+    method: str,
+    *,
+    data: dict[str, Any] | None = None,
+    files: dict[str, Any] | None = None,
+    timeout: float | None = None,
+) -> Any:
+    """POST a Bot API method through the pooled session; returns the raw response."""
+    return get_session().post(api_url(method), data=data, files=files, timeout=timeout or BOT_API_TIMEOUT)
+
+
+def setup_session_signal_handlers() -> None:
+    """Close the pooled connections when a worker process exits."""
+    from celery import signals  # Imported lazily to avoid circular deps.
+
+    @signals.worker_process_shutdown.connect  # type: ignore[arg-type]
+    def _on_worker_process_shutdown(**_: object) -> None:
+        close_session()
+
+
+__all__ = [
+    "TELEGRAM_API_BASE",
+    "api_url",
+    "close_session",
+    "get_session",
+    "post",
+    "setup_session_signal_handlers",
+]
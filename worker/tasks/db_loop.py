@@ -0,0 +1,137 @@
+"""Long-lived event loop and asyncpg pool for synchronous Celery tasks.
+
+The DB layer (``bot.services.db``) is async.  Calling it through
+``asyncio.run`` opens a fresh loop and pool (TCP + auth handshake) for every
+call and throws both away afterwards.  Instead each worker process runs one
+loop in a daemon thread, the pool lives on that loop, and tasks submit
+coroutines with ``run``::
+
+    from tasks import db_loop
+    row = db_loop.run(db_service.fetchrow("SELECT 1"))
+
+The loop is started lazily (or on ``worker_process_init`` with
+``WORKER_DB_PRESTART=1``), recreated after a fork, and the pool is closed on
+``worker_process_shutdown``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Optional, TypeVar
+
+from bot.services import db as db_service
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+WORKER_DB_POOL_MIN = int(os.getenv("WORKER_DB_POOL_MIN", "1"))
+WORKER_DB_POOL_MAX = int(os.getenv("WORKER_DB_POOL_MAX", "2"))
+WORKER_DB_TIMEOUT = float(os.getenv("WORKER_DB_TIMEOUT", "60"))
+WORKER_DB_PRESTART = os.getenv("WORKER_DB_PRESTART", "0").lower() in {"1", "true", "yes"}
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_pid: Optional[int] = None
+_pool_ready = False
+_lock = threading.Lock()
+
+
+def _start_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _thread, _pid, _pool_ready
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="db-loop", daemon=True)
+    thread.start()
+    _loop, _thread, _pid, _pool_ready = loop, thread, os.getpid(), False
+    return loop
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    loop = _loop
+    if loop is not None and _pid == os.getpid() and loop.is_running():
+        return loop
+    with _lock:
+        if _loop is None or _pid != os.getpid() or not _loop.is_running():
+            if _pid != os.getpid():
+                # The pool inherited from the parent belongs to a loop that does not run here.
+                db_service._pool = None
+            return _start_loop()
+        return _loop
+
+
+def _ensure_pool(loop: asyncio.AbstractEventLoop) -> None:
+    global _pool_ready
+    if _pool_ready:
+        return
+    with _lock:
+        if _pool_ready:
+            return
+        future = asyncio.run_coroutine_threadsafe(
+            db_service.init_pool(min_size=WORKER_DB_POOL_MIN, max_size=WORKER_DB_POOL_MAX),
+            loop,
+        )
+        future.result(WORKER_DB_TIMEOUT)
+        _pool_ready = True
+
+
+def run(coro: Awaitable[T], timeout: float | None = None) -> T:
+    """Run ``coro`` on the process loop with the shared pool and wait for it."""
+    loop = _get_loop()
+    try:
+        _ensure_pool(loop)
+    except Exception:
+        if asyncio.iscoroutine(coro):
+            coro.close()
+        raise
+    future = asyncio.run_coroutine_threadsafe(coro, loop)  # type: ignore[arg-type]
+    try:
+        return future.result(timeout or WORKER_DB_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+
+def start() -> None:
+    """Start the loop and open the pool ahead of the first task."""
+    try:
+        _ensure_pool(_get_loop())
+    except Exception:
+        logger.warning("db_loop: failed to open the DB pool at startup", exc_info=True)
+
+
+def shutdown() -> None:
+    global _loop, _thread, _pid, _pool_ready
+    with _lock:
+        loop, thread, pid = _loop, _thread, _pid
+        _loop = _thread = _pid = None
+        _pool_ready = False
+    if loop is None or pid != os.getpid():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(db_service.close_pool(), loop).result(10)
+    except Exception:
+        logger.warning("db_loop: failed to close the DB pool", exc_info=True)
+    loop.call_soon_threadsafe(loop.stop)
+    if thread is not None:
+        thread.join(5)
+    loop.close()
+
+
+def setup_db_signal_handlers() -> None:
+    """Open the pool with each worker process and close it on shutdown."""
+    from celery import signals  # Imported lazily to avoid circular deps.
+
+    @signals.worker_process_init.connect  # type: ignore[arg-type]
+    def _on_worker_process_init(**_: Any) -> None:
+        if WORKER_DB_PRESTART:
+            start()
+
+    @signals.worker_process_shutdown.connect  # type: ignore[arg-type]
+    def _on_worker_process_shutdown(**_: Any) -> None:
+        shutdown()
+
+
+__all__ = ["run", "setup_db_signal_handlers", "shutdown", "start"]
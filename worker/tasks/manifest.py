@@ -0,0 +1,165 @@
+"""Render artifact manifests shared by the preview and publish tasks.
+
+A manifest ties one uploaded document to everything already rendered for it:
+the source blob key, the full-resolution PNG key of every page and the page
+metadata.  Reading a manifest extends the TTL of all referenced blobs, so a
+user who keeps browsing the preview never forces the publish path to render
+the document again.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+MANIFEST_PREFIX = os.getenv("RENDER_MANIFEST_PREFIX", "manifest")
+MANIFEST_TTL = int(
+    os.getenv("RENDER_MANIFEST_TTL", os.getenv("FULLRES_BLOB_TTL", os.getenv("SOURCE_BLOB_TTL", "3600")))
+)
+
+
+def page_id(page: Dict[str, Any], default: int = 0) -> int:
+    """Unique id of a manifest page.
+
+    Spreadsheet tables are each rendered from their own PDF and all carry
+    ``page_index == 1``, so they get an explicit ``page_id``; for paged
+    documents the page number is the id.
+    """
+    return int(page.get("page_id") or page.get("page_index") or default)
+
+
+def manifest_keys(manifest: Dict[str, Any]) -> List[str]:
+    """All storage keys referenced by a manifest (excluding the manifest itself)."""
+    keys: List[str] = []
+    for field in ("source_key", "render_key"):
+        key = manifest.get(field)
+        if key and key not in keys:
+            keys.append(key)
+    for page in manifest.get("pages") or []:
+        for field in ("fullres_key", "preview_key"):
+            key = page.get(field)
+            if key:
+                keys.append(key)
+    return keys
+
+
+def _extend(storage, keys: Iterable[str], ttl: int) -> None:
+    pipe = storage.pipeline()
+    for key in keys:
+        # GT: never shorten a TTL that is already longer.
+        pipe.expire(key, ttl, gt=True)
+    pipe.execute()
+
+
+def create_manifest(
+    storage,
+    *,
+    source_key: Optional[str],
+    filename: str,
+    render_format: str,
+    pages: List[Dict[str, Any]],
+    render_key: Optional[str] = None,
+    pages_total: Optional[int] = None,
+) -> str:
+    key = f"{MANIFEST_PREFIX}:{uuid.uuid4().hex}"
+    manifest = {
+        "source_key": source_key,
+        "filename": filename,
+        "render_format": render_format,
+        "pages": pages,
+        "render_key": render_key,
+        "pages_total": pages_total,
+    }
+    storage.set(key, json.dumps(manifest, default=str), ex=MANIFEST_TTL)
+    _extend(storage, manifest_keys(manifest), MANIFEST_TTL)
+    return key
+
+
+def load_manifest(storage, key: str, *, touch: bool = True) -> Optional[Dict[str, Any]]:
+    if not key:
+        return None
+    raw = storage.get(key)
+    if raw is None:
+        return None
+    try:
+        manifest = json.loads(raw)
+    except ValueError:
+        return None
+    if touch:
+        _extend(storage, [key, *manifest_keys(manifest)], MANIFEST_TTL)
+    return manifest
+
+
+def add_manifest_pages(storage, key: str, pages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Merge freshly rendered pages into a manifest.
+
+    Runs as a WATCH/MULTI transaction because on-demand and prefetch renders
+    may update the same manifest concurrently.  A page rendered again replaces
+    its previous entry; returns the updated manifest or None if it has expired.
+    """
+    result: Dict[str, Any] = {}
+
+    def _apply(pipe) -> None:
+        raw = pipe.get(key)
+        if raw is None:
+            result.clear()
+            return
+        manifest = json.loads(raw)
+        merged = {page_id(page): page for page in manifest.get("pages") or []}
+        for page in pages:
+            merged[page_id(page)] = page
+        manifest["pages"] = [merged[idx] for idx in sorted(merged)]
+        pipe.multi()
+        pipe.set(key, json.dumps(manifest, default=str), ex=MANIFEST_TTL)
+        result.clear()
+        result.update(manifest)
+
+    storage.transaction(_apply, key)
+    if not result:
+        return None
+    _extend(storage, manifest_keys(result), MANIFEST_TTL)
+    return result
+
+
+def load_manifest_pages(
+    storage,
+    manifest: Dict[str, Any],
+    page_indices: List[int],
+) -> Tuple[Dict[int, Tuple[str, bytes]], List[int]]:
+    """Fetch already rendered pages by :func:`page_id`; return ``(found, missing_ids)``."""
+    by_index: Dict[int, Dict[str, Any]] = {}
+    for position, page in enumerate(manifest.get("pages") or [], start=1):
+        by_index[page_id(page, position)] = page
+
+    wanted: List[Tuple[int, str, str]] = []
+    missing: List[int] = []
+    for idx in page_indices:
+        page = by_index.get(idx)
+        if page and page.get("fullres_key"):
+            wanted.append((idx, page["fullres_key"], page.get("filename") or f"page-{idx:03d}.png"))
+        else:
+            missing.append(idx)
+
+    found: Dict[int, Tuple[str, bytes]] = {}
+    if wanted:
+        blobs = storage.mget([key for _, key, _ in wanted])
+        for (idx, _, name), blob in zip(wanted, blobs):
+            if blob is None:
+                missing.append(idx)
+            else:
+                found[idx] = (name, blob)
+    return found, missing
+
+
+__all__ = [
+    "MANIFEST_PREFIX",
+    "MANIFEST_TTL",
+    "add_manifest_pages",
+    "create_manifest",
+    "load_manifest",
+    "load_manifest_pages",
+    "manifest_keys",
+    "page_id",
+]
@@ -1,19 +1,27 @@
 from __future__ import annotations
 
 import base64
+import json
 import os
 import uuid
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, List, Optional
 
 import redis
 from celery import shared_task
 
-from common.preview import PreviewError, generate_preview
+from common.preview import PreviewError, generate_preview, render_preview_pages
+from tasks.manifest import add_manifest_pages, create_manifest, load_manifest, page_id
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 PREVIEW_BLOB_TTL = int(os.getenv("PREVIEW_BLOB_TTL", os.getenv("SOURCE_BLOB_TTL", "3600")))
 FULLRES_BLOB_PREFIX = os.getenv("FULLRES_BLOB_PREFIX", "renderpng")
 FULLRES_BLOB_TTL = int(os.getenv("FULLRES_BLOB_TTL", os.getenv("SOURCE_BLOB_TTL", "3600")))
+RENDER_PDF_PREFIX = os.getenv("RENDER_PDF_PREFIX", "renderpdf")
+# Pages rendered up front for PDF/Word; 0 disables lazy rendering.
+PREVIEW_INITIAL_PAGES = int(os.getenv("PREVIEW_INITIAL_PAGES", "3"))
+# Pages rendered in the background ahead of the one the user is looking at.
+PREVIEW_PREFETCH_PAGES = int(os.getenv("PREVIEW_PREFETCH_PAGES", "2"))
+PREVIEW_STREAM_TTL = int(os.getenv("PREVIEW_STREAM_TTL", "600"))
 _storage = redis.Redis.from_url(REDIS_URL)
 
 
@@ -29,6 +37,12 @@ def _store_fullres(payload: bytes) -> str:
     return key
 
 
+def _store_render_pdf(payload: bytes) -> str:
+    key = f"{RENDER_PDF_PREFIX}:{uuid.uuid4().hex}"
+    _storage.set(key, payload, ex=FULLRES_BLOB_TTL)
+    return key
+
+
 def _load_source_blob(key: str) -> bytes:
     if not key:
         raise PreviewError("Storage key is empty.")
@@ -41,6 +55,59 @@ def _load_source_blob(key: str) -> bytes:
     return data
 
 
+def _store_pages(entries: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    pages_meta: List[Dict[str, Any]] = []
+    for entry in entries:
+        preview_bytes = entry.get("preview_bytes")
+        fullres_bytes = entry.get("fullres_bytes")
+        if not preview_bytes:
+            continue
+        preview_key = _store_preview(preview_bytes)
+        meta = {
+            k: v
+            for k, v in entry.items()
+            if k not in {"preview_bytes", "fullres_bytes"}
+        }
+        meta["preview_key"] = preview_key
+        if fullres_bytes:
+            meta["fullres_key"] = _store_fullres(fullres_bytes)
+        pages_meta.append(meta)
+    return pages_meta
+
+
+def _emit(stream_key: Optional[str], event: str, payload: Dict[str, Any]) -> None:
+    """Publish a progress event to the per-job stream the bot is reading."""
+    if not stream_key:
+        return
+    try:
+        pipe = _storage.pipeline()
+        pipe.xadd(stream_key, {"event": event, "data": json.dumps(payload, default=str)})
+        pipe.expire(stream_key, PREVIEW_STREAM_TTL)
+        pipe.execute()
+    except Exception:  # pragma: no cover - redis failure path
+        pass
+
+
+def _schedule_prefetch(manifest_key: str, page_indices: List[int]) -> None:
+    if not page_indices:
+        return
+    generate_preview_pages_task.apply_async(
+        kwargs={"manifest_key": manifest_key, "page_indices": page_indices},
+    )
+
+
+def _next_unrendered(manifest: Dict[str, Any], after: int, limit: int) -> List[int]:
+    total = int(manifest.get("pages_total") or 0)
+    rendered = {page_id(page) for page in manifest.get("pages") or []}
+    upcoming: List[int] = []
+    idx = after + 1
+    while idx <= total and len(upcoming) < limit:
+        if idx not in rendered:
+            upcoming.append(idx)
+        idx += 1
+    return upcoming
+
+
 @shared_task
 def generate_preview_task(
     *,
@@ -48,8 +115,40 @@ def generate_preview_task(
     file_key: Optional[str] = None,
     filename: str,
     render_format: str,
+    initial_pages: Optional[int] = None,
+    stream_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Generate preview pages for a document.
+
+    PDF and Word documents only get their first ``initial_pages`` pages
+    rendered; the rest are returned as ``pending_pages`` and rendered later by
+    :func:`generate_preview_pages_task`.  With ``stream_key`` every page is
+    also published as a ``page`` event as soon as it is stored, followed by a
+    final ``done`` (the task result) or ``error`` event.
+    """
+    try:
+        return _generate_preview(
+            file_b64=file_b64,
+            file_key=file_key,
+            filename=filename,
+            render_format=render_format,
+            initial_pages=initial_pages,
+            stream_key=stream_key,
+        )
+    except Exception as exc:
+        _emit(stream_key, "error", {"message": str(exc)})
+        raise
+
+
+def _generate_preview(
+    *,
+    file_b64: str,
+    file_key: Optional[str],
+    filename: str,
+    render_format: str,
+    initial_pages: Optional[int],
+    stream_key: Optional[str],
 ) -> Dict[str, Any]:
-    """Generate preview pages for a document."""
     try:
         if file_key:
             file_bytes = _load_source_blob(file_key)
@@ -60,25 +159,105 @@ def generate_preview_task(
     except Exception as exc:  # pragma: no cover - invalid input
         raise PreviewError(f"Failed to decode source document: {exc}") from exc
 
-    result = generate_preview(file_bytes, filename, render_format)
-    pages_meta: list[Dict[str, Any]] = []
-    for entry in result.get("pages", []):
-        preview_bytes = entry.get("preview_bytes")
-        fullres_bytes = entry.get("fullres_bytes")
-        if not preview_bytes:
-            continue
-        preview_key = _store_preview(preview_bytes)
-        meta = {
-            k: v
-            for k, v in entry.items()
-            if k not in {"preview_bytes", "fullres_bytes"}
-        }
-        meta["preview_key"] = preview_key
-        if fullres_bytes:
-            meta["fullres_key"] = _store_fullres(fullres_bytes)
-        pages_meta.append(meta)
+    pages_meta: List[Dict[str, Any]] = []
+
+    def _on_page(entry: Dict[str, Any]) -> None:
+        for meta in _store_pages([entry]):
+            pages_meta.append(meta)
+            _emit(stream_key, "page", meta)
+
+    if initial_pages is None:
+        initial_pages = PREVIEW_INITIAL_PAGES
+    result = generate_preview(
+        file_bytes,
+        filename,
+        render_format,
+        max_pages=initial_pages or None,
+        on_page=_on_page,
+    )
+    pending_pages = list(result.get("pending_pages") or [])
+
+    render_key: Optional[str] = None
+    if pending_pages:
+        if render_format == "pdf" and file_key:
+            render_key = file_key
+        else:
+            render_key = _store_render_pdf(result["render_pdf"])
+
+    manifest_key = create_manifest(
+        _storage,
+        source_key=file_key,
+        filename=filename,
+        render_format=render_format,
+        # The bot consumes these preview blobs right away; keep only the full-res keys.
+        pages=[{k: v for k, v in meta.items() if k != "preview_key"} for meta in pages_meta],
+        render_key=render_key,
+        pages_total=result.get("pages_total"),
+    )
+    if pending_pages:
+        _schedule_prefetch(
+            manifest_key,
+            [int(page["page_index"]) for page in pending_pages[:PREVIEW_PREFETCH_PAGES]],
+        )
+    summary = {
+        "pages": pages_meta,
+        "pending_pages": pending_pages,
+        "pages_total": result.get("pages_total") or len(pages_meta),
+        "analysis": result.get("analysis", {}),
+        "manifest_key": manifest_key,
+        "render_key": render_key,
+    }
+    _emit(stream_key, "done", summary)
+    return summary
+
+
+@shared_task
+def generate_preview_pages_task(
+    *,
+    manifest_key: str,
+    page_indices: List[int],
+    prefetch: int = 0,
+) -> Dict[str, Any]:
+    """Render (or reuse) pages of a lazily previewed document.
+
+    Pages already rendered by a prefetch are returned from the manifest.  With
+    ``prefetch`` the next pages after the requested ones are queued as well.
+    """
+    manifest = load_manifest(_storage, manifest_key)
+    if manifest is None:
+        raise PreviewError("Срок хранения превью истёк, загрузите файл заново.")
+    total = int(manifest.get("pages_total") or 0)
+    wanted = sorted({int(idx) for idx in page_indices if 1 <= int(idx) <= total})
+
+    known = {page_id(page): page for page in manifest.get("pages") or []}
+    candidates = [known[idx] for idx in wanted if known.get(idx, {}).get("preview_key")]
+    ready: List[Dict[str, Any]] = []
+    if candidates:
+        pipe = _storage.pipeline()
+        for page in candidates:
+            pipe.exists(page["preview_key"], page.get("fullres_key") or page["preview_key"])
+        for page, alive in zip(candidates, pipe.execute()):
+            if alive == 2:
+                ready.append(page)
+    ready_indices = {page_id(page) for page in ready}
+    todo = [idx for idx in wanted if idx not in ready_indices]
+
+    if todo:
+        render_key = manifest.get("render_key")
+        if not render_key:
+            raise PreviewError("Документ не поддерживает постраничное превью.")
+        pdf_bytes = _load_source_blob(render_key)
+        rendered = _store_pages(render_preview_pages(pdf_bytes, manifest.get("filename") or "document", todo))
+        updated = add_manifest_pages(_storage, manifest_key, rendered)
+        if updated is not None:
+            manifest = updated
+        ready.extend(rendered)
+
+    if prefetch > 0 and wanted:
+        _schedule_prefetch(manifest_key, _next_unrendered(manifest, wanted[-1], prefetch))
 
-    return {"pages": pages_meta, "analysis": result.get("analysis", {})}
+    ready.sort(key=lambda page: int(page.get("page_index") or 0))
+    return {"pages": ready, "pages_total": total}
 
 
-__all__ = ["generate_preview_task"]
+__all__ = ["generate_preview_task", "generate_preview_pages_task"]
@@ -1,62 +1,371 @@
 from celery import shared_task
+import hashlib
+import json
 import logging
 import os
 import mimetypes
+import random
 import time
 
-from worker.metrics import record_publish
+import redis
+
+from worker.metrics import record_file_id_cache, record_publish
+
+from . import bot_api, rate_limit
 
-BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 logger = logging.getLogger(__name__)
 
-@shared_task
-def send_document(chat_id: int, file_bytes: bytes, filename: str = "smeta.png", caption: str = "") -> dict[str, object] | None:
-    """Send bytes to Telegram as a document (protect_content=True).
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+SEND_BACKOFF = [1, 2, 3, 5, 8]
+# Share of the backoff added as random jitter so retries of one burst spread out.
+PUBLISH_RETRY_JITTER = float(os.getenv("PUBLISH_RETRY_JITTER", "0.5"))
+# Longest rate-limiter wait a task sleeps through before rescheduling itself.
+PUBLISH_INLINE_WAIT = float(os.getenv("PUBLISH_INLINE_WAIT", "2"))
+PUBLISH_IDEMPOTENCY_PREFIX = os.getenv("PUBLISH_IDEMPOTENCY_PREFIX", "tgsent")
+PUBLISH_IDEMPOTENCY_TTL = int(os.getenv("PUBLISH_IDEMPOTENCY_TTL", "86400"))
+_IN_FLIGHT_TTL = 120
+MEDIA_GROUP_MAX = 10
+# Telegram file_id of already uploaded pages, keyed by content hash + file name.
+FILE_ID_CACHE_ENABLED = os.getenv("FILE_ID_CACHE_ENABLED", "1").lower() not in {"0", "false", "no"}
+FILE_ID_CACHE_PREFIX = os.getenv("FILE_ID_CACHE_PREFIX", "tgfile")
+FILE_ID_CACHE_TTL = int(os.getenv("FILE_ID_CACHE_TTL", str(30 * 86400)))
+
+_storage = redis.Redis.from_url(REDIS_URL)
+
+
+class RetryLater(Exception):
+    """A send attempt failed transiently; try again after ``countdown`` seconds."""
+
+    def __init__(self, countdown: float, reason: str, *, permanent: bool = False) -> None:
+        super().__init__(f"{reason}, retry in {countdown:.1f}s")
+        self.countdown = countdown
+        self.reason = reason
+        self.permanent = permanent
+
+
+def retry_countdown(attempt: int) -> float:
+    """Backoff for the given (1-based) attempt with random jitter on top."""
+    base = SEND_BACKOFF[min(max(attempt, 1), len(SEND_BACKOFF)) - 1]
+    return base + random.uniform(0, base * PUBLISH_RETRY_JITTER)
+
+
+# 400 descriptions for a request that a resend cannot fix.  Others, such as
+# "chat not found" or missing rights right after a channel is created, are
+# retried on the normal failure budget.
+PERMANENT_400_MARKERS = (
+    "wrong file",
+    "file must be non-empty",
+    "file is too big",
+    "invalid file",
+    "media_empty",
+    "group send failed",
+    "can't parse",
+)
+
+
+def _is_permanent(status_code: int, description: str) -> bool:
+    description = description.lower()
+    return status_code == 400 and any(marker in description for marker in PERMANENT_400_MARKERS)
+
+
+def is_throttle(exc: RetryLater) -> bool:
+    """Waits imposed by rate limits (ours or Telegram's) or a concurrent sender, not failures."""
+    return exc.reason in {"flood", "in_flight"} or exc.reason.startswith("rate_limit_")
+
+
+def reschedule(task, exc: RetryLater, failures: int, **kwargs: object) -> int:
+    """Retry a bound task after ``exc.countdown`` instead of sleeping in the worker.
+
+    Throttling waits are not counted against the ``len(SEND_BACKOFF)``
+    failure budget (tasks keep it in the ``failures`` kwarg and run with
+    ``max_retries=None``).  Returns the updated failure count when the task
+    should give up: permanent error or budget spent.
+    """
+    if not is_throttle(exc):
+        failures += 1
+    if not exc.permanent and failures <= len(SEND_BACKOFF):
+        raise task.retry(
+            countdown=exc.countdown,
+            kwargs={**task.request.kwargs, **kwargs, "failures": failures},
+        )
+    return failures
+
+
+def _sent_key(idempotency_key: str) -> str:
+    return f"{PUBLISH_IDEMPOTENCY_PREFIX}:{idempotency_key}"
+
+
+def delivered(idempotency_key: str) -> dict[str, object] | None:
+    """Telegram answer stored for an idempotency key that was already sent."""
+    try:
+        raw = _storage.get(_sent_key(idempotency_key))
+    except Exception:
+        logger.warning("publish: idempotency lookup failed for %s", idempotency_key, exc_info=True)
+        return None
+    if not raw:
+        return None
+    try:
+        payload = json.loads(raw)
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def _claim(idempotency_key: str) -> bool:
+    try:
+        return bool(_storage.set(f"{_sent_key(idempotency_key)}:lock", "1", nx=True, ex=_IN_FLIGHT_TTL))
+    except Exception:
+        return True
+
+
+def _release(idempotency_key: str, payload: dict[str, object] | None) -> None:
+    try:
+        pipe = _storage.pipeline()
+        if payload is not None:
+            pipe.set(_sent_key(idempotency_key), json.dumps(payload), ex=PUBLISH_IDEMPOTENCY_TTL)
+        pipe.delete(f"{_sent_key(idempotency_key)}:lock")
+        pipe.execute()
+    except Exception:
+        logger.warning("publish: failed to store idempotency key %s", idempotency_key, exc_info=True)
+
+
+def _content_key(filename: str, file_bytes: bytes) -> str:
+    # The name is part of the key: a reused file_id keeps the name it was uploaded with.
+    digest = hashlib.sha256(file_bytes)
+    digest.update(b"\0" + filename.encode("utf-8"))
+    return f"{FILE_ID_CACHE_PREFIX}:{digest.hexdigest()}"
+
+
+def _cached_file_id(content_key: str) -> str | None:
+    if not FILE_ID_CACHE_ENABLED:
+        return None
+    try:
+        raw = _storage.getex(content_key, ex=FILE_ID_CACHE_TTL)
+    except Exception:
+        logger.warning("publish: file_id cache lookup failed", exc_info=True)
+        return None
+    record_file_id_cache("hit" if raw else "miss")
+    return raw.decode("utf-8") if raw else None
+
 
-    Retries transient errors (e.g., channel not ready, bot rights not yet propagated)
-    with small backoff to handle races right after channel creation.
+def _remember_file_ids(content_keys: list[str], messages: list[object]) -> None:
+    if not FILE_ID_CACHE_ENABLED:
+        return
+    try:
+        pipe = _storage.pipeline()
+        for content_key, message in zip(content_keys, messages):
+            document = message.get("document") if isinstance(message, dict) else None
+            file_id = document.get("file_id") if isinstance(document, dict) else None
+            if isinstance(file_id, str) and file_id:
+                pipe.set(content_key, file_id, ex=FILE_ID_CACHE_TTL)
+        pipe.execute()
+    except Exception:
+        logger.warning("publish: failed to store file_id", exc_info=True)
+
+
+def _forget_file_ids(content_keys: list[str]) -> None:
+    record_file_id_cache("stale")
+    try:
+        _storage.delete(*content_keys)
+    except Exception:
+        pass
+
+
+def _call_once(
+    method: str,
+    chat_id: int,
+    data: dict[str, object],
+    files: dict[str, object],
+    *,
+    attempt: int,
+    cost: int = 1,
+    idempotency_key: str | None = None,
+) -> dict[str, object]:
+    """One rate-limited, idempotent Bot API upload; raises ``RetryLater`` on failure."""
+    if idempotency_key:
+        previous = delivered(idempotency_key)
+        if previous is not None:
+            logger.info("%s: %s already delivered, skipping", method, idempotency_key)
+            return previous
+        if not _claim(idempotency_key):
+            raise RetryLater(retry_countdown(attempt), "in_flight")
+
+    payload: dict[str, object] | None = None
+    try:
+        try:
+            rate_limit.acquire(chat_id, cost, max_wait=PUBLISH_INLINE_WAIT)
+        except rate_limit.RateLimited as exc:
+            raise RetryLater(exc.wait, f"rate_limit_{exc.scope}") from exc
+
+        try:
+            response = bot_api.post(method, data=data, files=files)
+        except Exception as exc:  # pragma: no cover - network path
+            logger.exception("%s exception attempt=%d", method, attempt)
+            raise RetryLater(retry_countdown(attempt), "exception") from exc
+
+        if response.status_code >= 400:
+            logger.warning(
+                "%s attempt=%d status=%d response=%s",
+                method,
+                attempt,
+                response.status_code,
+                response.text[:500],
+            )
+            retry_after = rate_limit.retry_after_from(response)
+            if retry_after is not None:
+                rate_limit.penalize(chat_id, retry_after)
+                raise RetryLater(retry_after, "flood")
+            raise RetryLater(
+                retry_countdown(attempt),
+                f"http_{response.status_code}",
+                permanent=_is_permanent(response.status_code, response.text),
+            )
+
+        try:
+            answer = response.json()
+        except ValueError:
+            answer = {"ok": False}
+        if not isinstance(answer, dict):
+            answer = {"ok": False}
+        if answer.get("ok"):
+            payload = answer
+        return answer
+    finally:
+        if idempotency_key:
+            _release(idempotency_key, payload)
+
+
+def send_document_once(
+    chat_id: int,
+    file_bytes: bytes,
+    filename: str = "smeta.png",
+    caption: str = "",
+    *,
+    attempt: int = 1,
+    idempotency_key: str | None = None,
+) -> dict[str, object]:
+    """Make one sendDocument attempt without sleeping through backoff.
+
+    Returns the Telegram JSON answer, or raises ``RetryLater`` with the delay
+    the caller should wait (Telegram's ``retry_after`` for 429s).  With an
+    ``idempotency_key`` a page that was already delivered is answered from
+    Redis instead of being posted a second time.
     """
     import io
-    import requests
+
+    content_key = _content_key(filename, file_bytes)
+    data = {"chat_id": chat_id, "caption": caption, "protect_content": True}
+    file_id = _cached_file_id(content_key)
+    if file_id:
+        try:
+            # Identical page uploaded before: send by file_id, no upload at all.
+            return _call_once(
+                "sendDocument",
+                chat_id,
+                {**data, "document": file_id},
+                {},
+                attempt=attempt,
+                idempotency_key=idempotency_key,
+            )
+        except RetryLater as exc:
+            if exc.reason != "http_400":
+                raise
+            _forget_file_ids([content_key])
 
     mime = mimetypes.guess_type(filename)[0] or "application/octet-stream"
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendDocument"
-    backoff = [1, 2, 3, 5, 8]
-    payload_size = len(file_bytes)
-    start = time.monotonic()
+    files = {"document": (filename, io.BytesIO(file_bytes), mime)}
+    answer = _call_once("sendDocument", chat_id, data, files, attempt=attempt, idempotency_key=idempotency_key)
+    if answer.get("ok"):
+        _remember_file_ids([content_key], [answer.get("result")])
+    return answer
 
-    for attempt, delay in enumerate([0] + backoff, start=1):
-        try:
-            files = {"document": (filename, io.BytesIO(file_bytes), mime)}
-            data = {"chat_id": chat_id, "caption": caption, "protect_content": True}
-            response = requests.post(url, data=data, files=files, timeout=60)
-            if response.status_code >= 400:
-                logger.warning(
-                    "send_document attempt=%d status=%d response=%s",
-                    attempt,
-                    response.status_code,
-                    response.text[:500],
-                )
-                if attempt < len(backoff) + 1 and response.status_code in (400, 403, 429):
-                    time.sleep(delay)
-                    continue
-                response.raise_for_status()
-            duration = time.monotonic() - start
-            record_publish("success", duration, attempt - 1, payload_size)
-            try:
-                payload = response.json()
-            except ValueError:
-                payload = {"ok": False}
-            return payload if isinstance(payload, dict) else {"ok": False}
-        except Exception:  # pragma: no cover - network path
-            logger.exception("send_document exception attempt=%d", attempt)
-            if attempt < len(backoff) + 1:
-                time.sleep(delay)
+
+def send_media_group_once(
+    chat_id: int,
+    documents: list[tuple[str, bytes]],
+    *,
+    attempt: int = 1,
+    idempotency_key: str | None = None,
+) -> dict[str, object]:
+    """Send 2-10 files as one document album (sendMediaGroup), one attempt.
+
+    On success ``result`` is the list of messages in album order.  Takes one
+    rate-limit token per file, since Telegram counts every album item.
+    """
+    import io
+
+    if not 2 <= len(documents) <= MEDIA_GROUP_MAX:
+        raise ValueError(f"sendMediaGroup accepts 2..{MEDIA_GROUP_MAX} files, got {len(documents)}")
+    content_keys = [_content_key(filename, file_bytes) for filename, file_bytes in documents]
+    file_ids = [_cached_file_id(key) for key in content_keys]
+
+    def _send(use_cache: bool) -> dict[str, object]:
+        media = []
+        files = {}
+        for idx, (filename, file_bytes) in enumerate(documents):
+            if use_cache and file_ids[idx]:
+                media.append({"type": "document", "media": file_ids[idx]})
                 continue
-            duration = time.monotonic() - start
-            record_publish("failure", duration, attempt - 1, payload_size)
-            return None
+            field = f"file{idx}"
+            mime = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            files[field] = (filename, io.BytesIO(file_bytes), mime)
+            media.append({"type": "document", "media": f"attach://{field}"})
+        data = {"chat_id": chat_id, "media": json.dumps(media), "protect_content": True}
+        return _call_once(
+            "sendMediaGroup",
+            chat_id,
+            data,
+            files,
+            attempt=attempt,
+            cost=len(documents),
+            idempotency_key=idempotency_key,
+        )
+
+    reused = [key for key, file_id in zip(content_keys, file_ids) if file_id]
+    try:
+        answer = _send(use_cache=True)
+    except RetryLater as exc:
+        if exc.reason != "http_400" or not reused:
+            raise
+        # One of the cached file_ids is no longer valid; upload everything.
+        _forget_file_ids(reused)
+        answer = _send(use_cache=False)
+    result = answer.get("result")
+    if answer.get("ok") and isinstance(result, list):
+        _remember_file_ids(content_keys, result)
+    return answer
+
+
+@shared_task(bind=True, max_retries=None)
+def send_document(
+    self,
+    chat_id: int,
+    file_bytes: bytes,
+    filename: str = "smeta.png",
+    caption: str = "",
+    idempotency_key: str | None = None,
+    failures: int = 0,
+) -> dict[str, object] | None:
+    """Send bytes to Telegram as a document (protect_content=True).
 
-    duration = time.monotonic() - start
-    record_publish("failure", duration, len(backoff), payload_size)
-    return None
+    Transient errors (e.g., channel not ready, bot rights not yet propagated
+    right after channel creation) reschedule the task with a countdown; the
+    worker never sleeps through the backoff.
+    """
+    payload_size = len(file_bytes)
+    start = time.monotonic()
+    try:
+        payload = send_document_once(
+            chat_id,
+            file_bytes,
+            filename,
+            caption,
+            attempt=failures + 1,
+            idempotency_key=idempotency_key or f"task:{self.request.id}",
+        )
+    except RetryLater as exc:
+        failures = reschedule(self, exc, failures)
+        record_publish("failure", time.monotonic() - start, failures, payload_size)
+        return None
+    record_publish("success", time.monotonic() - start, failures, payload_size)
+    return payload
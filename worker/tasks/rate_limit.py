@@ -0,0 +1,189 @@
+"""Redis token buckets shared by every publish worker.
+
+Before each Telegram send a task takes one token from the global bot bucket
+and one from the bucket of the target chat in a single Lua call, so several
+workers together stay under Telegram's limits instead of discovering them
+through 429s.  When Telegram still answers 429, ``penalize`` blocks the chat
+for the ``retry_after`` it asked for and every worker honours it.
+
+Environment (rates are tokens per second, bursts are bucket sizes):
+
+* ``TG_GLOBAL_RATE`` / ``TG_GLOBAL_BURST`` – whole bot (default 25 / 25);
+* ``TG_CHAT_RATE`` / ``TG_CHAT_BURST`` – one chat (default 20 per minute / 3);
+* ``TG_RATE_LIMIT_ENABLED`` – set to ``0`` to bypass the limiter.
+
+Redis problems never block a publication: the limiter then fails open.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import time
+from typing import Tuple
+
+import redis
+
+from worker.metrics import record_rate_limit_wait, record_telegram_flood
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+TG_RATE_LIMIT_ENABLED = os.getenv("TG_RATE_LIMIT_ENABLED", "1").lower() not in {"0", "false", "no"}
+TG_RATE_LIMIT_PREFIX = os.getenv("TG_RATE_LIMIT_PREFIX", "tglimit")
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))
+TG_GLOBAL_BURST = float(os.getenv("TG_GLOBAL_BURST", "25"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", str(20 / 60)))
+TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))
+
+_SCOPES = {1: "global", 2: "chat", 3: "retry_after"}
+
+# KEYS: global bucket, chat bucket, global block, chat block
+# ARGV: now_ms, cost, global rate/ms, global burst, chat rate/ms, chat burst, bucket ttl ms
+# Returns {wait_ms, scope}; wait_ms == 0 means the tokens were taken.
+_ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+for i = 3, 4 do
+  local blocked = redis.call('PTTL', KEYS[i])
+  if blocked > 0 then
+    return {blocked, 3}
+  end
+end
+local wait, scope = 0, 0
+local tokens = {}
+for i = 1, 2 do
+  local rate = tonumber(ARGV[1 + 2 * i])
+  local burst = tonumber(ARGV[2 + 2 * i])
+  local state = redis.call('HMGET', KEYS[i], 't', 'ts')
+  local available = tonumber(state[1]) or burst
+  local ts = tonumber(state[2]) or now
+  available = math.min(burst, available + math.max(0, now - ts) * rate)
+  tokens[i] = available
+  if available < cost then
+    local need = math.ceil((cost - available) / rate)
+    if need > wait then
+      wait, scope = need, i
+    end
+  end
+end
+if wait > 0 then
+  return {wait, scope}
+end
+for i = 1, 2 do
+  redis.call('HSET', KEYS[i], 't', tokens[i] - cost, 'ts', now)
+  redis.call('PEXPIRE', KEYS[i], ARGV[7])
+end
+return {0, 0}
+"""
+
+_client = None
+_script = None
+
+
+class RateLimited(Exception):
+    """Raised by ``acquire`` when the wait would exceed ``max_wait``."""
+
+    def __init__(self, wait: float, scope: str) -> None:
+        super().__init__(f"rate limited ({scope}) for {wait:.2f}s")
+        self.wait = wait
+        self.scope = scope
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(REDIS_URL)
+    return _client
+
+
+def _get_script():
+    global _script
+    if _script is None:
+        _script = _get_client().register_script(_ACQUIRE_LUA)
+    return _script
+
+
+def _keys(chat_id: int | str) -> list[str]:
+    return [
+        f"{TG_RATE_LIMIT_PREFIX}:bucket:global",
+        f"{TG_RATE_LIMIT_PREFIX}:bucket:{chat_id}",
+        f"{TG_RATE_LIMIT_PREFIX}:block:global",
+        f"{TG_RATE_LIMIT_PREFIX}:block:{chat_id}",
+    ]
+
+
+def try_acquire(chat_id: int | str, cost: int = 1) -> Tuple[float, str]:
+    """Take ``cost`` tokens for ``chat_id`` if available.
+
+    Returns ``(0.0, "")`` on success, otherwise the seconds to wait and the
+    scope that is exhausted (``global``, ``chat`` or ``retry_after``).
+    """
+    if not TG_RATE_LIMIT_ENABLED:
+        return 0.0, ""
+    # Refill both buckets completely within ttl; idle buckets then expire.
+    ttl_ms = int(1000 * max(TG_GLOBAL_BURST / TG_GLOBAL_RATE, TG_CHAT_BURST / TG_CHAT_RATE)) + 1000
+    try:
+        wait_ms, scope = _get_script()(
+            keys=_keys(chat_id),
+            args=[
+                int(time.time() * 1000),
+                cost,
+                TG_GLOBAL_RATE / 1000.0,
+                max(TG_GLOBAL_BURST, cost),
+                TG_CHAT_RATE / 1000.0,
+                max(TG_CHAT_BURST, cost),
+                ttl_ms,
+            ],
+        )
+    except Exception:
+        logger.warning("rate_limit: redis unavailable, sending without limiter", exc_info=True)
+        return 0.0, ""
+    return int(wait_ms) / 1000.0, _SCOPES.get(int(scope), "")
+
+
+def acquire(chat_id: int | str, cost: int = 1, *, max_wait: float | None = None) -> float:
+    """Block until tokens are taken; returns the seconds spent waiting.
+
+    Raises ``RateLimited`` instead of sleeping past ``max_wait`` seconds so a
+    caller can reschedule instead of holding the worker.
+    """
+    waited = 0.0
+    while True:
+        wait, scope = try_acquire(chat_id, cost)
+        if wait <= 0:
+            return waited
+        if max_wait is not None and waited + wait > max_wait:
+            record_rate_limit_wait(scope, wait)
+            raise RateLimited(wait, scope)
+        record_rate_limit_wait(scope, wait)
+        time.sleep(wait)
+        waited += wait
+
+
+def penalize(chat_id: int | str, retry_after: float, *, scope: str = "chat") -> None:
+    """Stop all workers from sending to ``chat_id`` (or at all) for ``retry_after`` seconds."""
+    record_telegram_flood(retry_after)
+    if not TG_RATE_LIMIT_ENABLED or retry_after <= 0:
+        return
+    key = _keys(chat_id)[3 if scope == "chat" else 2]
+    try:
+        _get_client().set(key, "1", px=int(retry_after * 1000))
+    except Exception:
+        logger.warning("rate_limit: failed to store retry_after for %s", chat_id, exc_info=True)
+
+
+def retry_after_from(response) -> float | None:
+    """``parameters.retry_after`` of a Telegram 429 response, if present."""
+    if getattr(response, "status_code", None) != 429:
+        return None
+    try:
+        payload = response.json()
+    except ValueError:
+        return None
+    params = payload.get("parameters") if isinstance(payload, dict) else None
+    value = params.get("retry_after") if isinstance(params, dict) else None
+    return float(value) if isinstance(value, (int, float)) else None
+
+
+__all__ = ["RateLimited", "acquire", "penalize", "retry_after_from", "try_acquire"]
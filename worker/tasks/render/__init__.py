@@ -5,22 +5,38 @@ import io
 import mimetypes
 import os
 import re
+import time
 import traceback
+import uuid
+from dataclasses import replace
 from pathlib import Path
 from typing import List, Optional, Tuple
 
 import redis
-from celery import shared_task
+from celery import chain, shared_task
+from celery.exceptions import Retry
 
+from common import render_cache
 from common.watermark import WATERMARK_SETTINGS, WatermarkSettings
 from PIL import Image
 
-from ..publish import send_document
+from ..manifest import load_manifest, load_manifest_pages
+from ..publish import (
+    MEDIA_GROUP_MAX,
+    RetryLater,
+    delivered,
+    reschedule,
+    send_document_once,
+    send_media_group_once,
+)
 from bot.services import channels as channels_service
 from bot.services import db as db_service
+from tasks import db_loop
 from tasks.watermark import apply_tiled_watermark
+from worker.metrics import record_publish
 
 from .doc_to_png import convert as convert_doc_to_png
+from .encode import ENCODE_SETTINGS, encode_page, encoded_filename, needs_reencode
 from .pdf_to_png import convert as convert_pdf_to_png
 from .xls_to_png import convert as convert_xls_to_png
 
@@ -42,6 +58,14 @@ _SANITIZE_RE = re.compile(r"[^A-Za-z0-9._-]+")
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 _storage = redis.Redis.from_url(REDIS_URL)
 
+# Rendered pages are handed over to the publish queue instead of being sent inline.
+PUBLISH_QUEUE = os.getenv("CELERY_PUBLISH_QUEUE", "publish")
+FANOUT_PAGE_PREFIX = os.getenv("FULLRES_BLOB_PREFIX", "renderpng")
+FANOUT_PAGE_TTL = int(os.getenv("FULLRES_BLOB_TTL", os.getenv("SOURCE_BLOB_TTL", "3600")))
+# Opt-in: send pages as sendMediaGroup document albums of up to PUBLISH_ALBUM_SIZE files.
+PUBLISH_ALBUM = os.getenv("PUBLISH_ALBUM", "0").lower() in {"1", "true", "yes"}
+PUBLISH_ALBUM_SIZE = max(2, min(MEDIA_GROUP_MAX, int(os.getenv("PUBLISH_ALBUM_SIZE", str(MEDIA_GROUP_MAX)))))
+
 
 def _sanitize_basename(filename: str, default: str) -> str:
     base = Path(filename).stem or default
@@ -72,8 +96,27 @@ def _guess_mime(filename: str, provided: str | None) -> str:
 
 
 def render_to_png(file_bytes: bytes, filename: str, mime_type: str | None) -> List[Tuple[str, bytes]]:
-    """Render supported office documents to PNG images."""
+    """Render supported office documents to PNG images, reusing cached renders."""
     mime = _guess_mime(filename, mime_type)
+    cache_key = render_cache.make_key("render", file_bytes, mime=mime, filename=filename, dpi=300, color=True)
+    cached = render_cache.get(cache_key)
+    if cached is not None:
+        meta, blobs = cached
+        names = list(meta.get("names") or [])
+        if names and all(str(idx) in blobs for idx in range(len(names))):
+            return [(name, blobs[str(idx)]) for idx, name in enumerate(names)]
+
+    pages = _render_to_png_uncached(file_bytes, filename, mime)
+    if pages:
+        render_cache.put(
+            cache_key,
+            {"names": [name for name, _ in pages]},
+            {str(idx): payload for idx, (_, payload) in enumerate(pages)},
+        )
+    return pages
+
+
+def _render_to_png_uncached(file_bytes: bytes, filename: str, mime: str) -> List[Tuple[str, bytes]]:
     suffix = Path(filename).suffix.lower()
 
     if mime in PDF_MIME_TYPES:
@@ -107,9 +150,21 @@ def _apply_watermark(
             text=str(watermark_text),
             settings=settings or WATERMARK_SETTINGS,
         )
-        out = io.BytesIO()
-        stamped.save(out, format="PNG", optimize=True)
-        return out.getvalue()
+        payload, _ = encode_page(stamped, settings=replace(ENCODE_SETTINGS, format="png"))
+        return payload
+
+
+def _prepare_page(filename: str, png_bytes: bytes, watermark_text: str | None) -> Tuple[str, bytes]:
+    """Watermark a rendered page and run it through the encoding stage."""
+    stamp = bool(watermark_text and str(watermark_text).strip())
+    if not stamp and not needs_reencode():
+        return filename, png_bytes
+    with Image.open(io.BytesIO(png_bytes)) as img:
+        page = img.convert("RGB")
+        if stamp:
+            page = apply_tiled_watermark(page, text=str(watermark_text), settings=WATERMARK_SETTINGS)
+        payload, suffix = encode_page(page)
+    return encoded_filename(filename, suffix), payload
 
 
 def _decode_b64(data_b64: str) -> bytes:
@@ -119,85 +174,59 @@ def _decode_b64(data_b64: str) -> bytes:
         raise RuntimeError(f"Failed to decode Base64 payload: {exc}") from exc
 
 
-def _send_png(chat_id: int, filename: str, payload: bytes) -> dict[str, object] | None:
-    response = send_document.run(chat_id, payload, filename, caption="")
-    if isinstance(response, dict) and response.get("ok"):
-        return response.get("result")
-    return None
+# tg_chat_id -> (core.channels.id, expires_at); channels are never renumbered.
+_CHANNEL_IDS: dict[int, Tuple[int, float]] = {}
+CHANNEL_ID_CACHE_TTL = float(os.getenv("CHANNEL_ID_CACHE_TTL", "600"))
 
 
-async def _record_publication_async(
-    chat_id: int,
-    filename: str,
-    message_payload: dict[str, object],
-    source_document_id: int | None = None,
-) -> None:
-    """Записывает публикацию в core.publications и событие в analytics.events."""
-    await db_service.init_pool()
-    try:
-        # Прямой импорт для избежания циклических зависимостей
-        from bot.services.events import log_file_posted
-        
-        document = message_payload.get("document") if isinstance(message_payload, dict) else None
-        message_id = int(message_payload.get("message_id", 0))
-        
-        mime_type = None
-        if document and isinstance(document, dict):
-            mime_type_val = document.get("mime_type")
-            if isinstance(mime_type_val, str):
-                mime_type = mime_type_val
-        
-        try:
-            print(f"DEBUG: filename={filename}, mime_type={mime_type}, message_payload keys={list(message_payload.keys()) if message_payload else None}")
-            publication_id = await channels_service.record_channel_file(
-                channel_id=chat_id,
-                message_id=message_id,
-                filename=filename,
-                file_type=mime_type,
-                views=int(message_payload.get("views", 0) or 0),
-            )
-            channel_db = await db_service.fetchrow(
-                "SELECT id FROM core.channels WHERE tg_chat_id = $1",
-                chat_id
-            )
-            if channel_db:
-                channel_db_id = channel_db["id"]
-                await log_file_posted(
-                    channel_id=channel_db_id,
-                    message_id=message_id,
-                    file_name=filename,
-                    file_type=mime_type or "unknown",
-                )
-        except Exception as exc:
-            print(f"Failed to record publication: {exc}")
-    finally:
-        await db_service.close_pool()
+async def _channel_db_id(chat_id: int) -> int | None:
+    cached = _CHANNEL_IDS.get(chat_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    row = await db_service.fetchrow("SELECT id FROM core.channels WHERE tg_chat_id = $1", chat_id)
+    if not row:
+        return None
+    _CHANNEL_IDS[chat_id] = (int(row["id"]), time.monotonic() + CHANNEL_ID_CACHE_TTL)
+    return int(row["id"])
 
 
-def _record_publication(chat_id: int, filename: str, message_payload: dict[str, object] | None, source_document_id: int | None = None) -> None:
-    if not message_payload:
+async def _record_publications_async(chat_id: int, entries: List[Tuple[str, dict[str, object]]]) -> None:
+    """Записывает публикации в core.publications и события в analytics.events.
+
+    Выполняется на постоянном цикле воркера (``db_loop``): вся пачка пишется
+    одной транзакцией, id канала берётся из кэша процесса.
+    """
+    channel_db_id = await _channel_db_id(chat_id)
+    if channel_db_id is None:
+        print(f"Failed to record publications: канал с tg_chat_id={chat_id} не найден")
+        return
+    rows = []
+    for filename, message_payload in entries:
+        document = message_payload.get("document")
+        mime_type = None
+        if isinstance(document, dict) and isinstance(document.get("mime_type"), str):
+            mime_type = document["mime_type"]
+        rows.append((
+            int(message_payload.get("message_id", 0)),
+            filename,
+            mime_type,
+            int(message_payload.get("views", 0) or 0),
+        ))
+    await channels_service.record_channel_files(channel_db_id, rows)
+
+
+def _record_publications(chat_id: int, entries: List[Tuple[str, dict[str, object]]]) -> None:
+    entries = [(name, payload) for name, payload in entries if payload]
+    if not entries:
         return
     try:
-        import asyncio
-        asyncio.run(_record_publication_async(chat_id, filename, message_payload, source_document_id))
+        db_loop.run(_record_publications_async(chat_id, entries))
     except Exception as exc:  # pragma: no cover - best effort
         print("Failed to record publication metadata:", exc)
 
 
-def _filter_pages(pages: List[Tuple[str, bytes]], page_indices: List[int] | None) -> List[Tuple[str, bytes]]:
-    if not page_indices:
-        return pages
-    ordered: List[Tuple[str, bytes]] = []
-    seen: set[int] = set()
-    total = len(pages)
-    for idx in page_indices:
-        if idx in seen:
-            continue
-        if idx < 1 or idx > total:
-            continue
-        ordered.append(pages[idx - 1])
-        seen.add(idx)
-    return ordered
+def _record_publication(chat_id: int, filename: str, message_payload: dict[str, object] | None, source_document_id: int | None = None) -> None:
+    _record_publications(chat_id, [(filename, message_payload)])
 
 
 def _pop_storage_blob(key: str) -> bytes:
@@ -215,14 +244,323 @@ def _pop_storage_blob(key: str) -> bytes:
     return data
 
 
-def _resolve_payload(b64_data: Optional[str], storage_key: Optional[str], kind: str) -> bytes:
+def _load_storage_blob(key: str) -> bytes:
+    if not key:
+        raise RuntimeError("Storage key is empty.")
+    try:
+        data = _storage.get(key)
+    except Exception as exc:
+        raise RuntimeError(f"Не удалось получить файл из хранилища ({key}): {exc}") from exc
+    if data is None:
+        raise RuntimeError(f"Файл по ключу {key} не найден или срок его хранения истёк.")
+    return data
+
+
+def _delete_storage_blob(key: str) -> None:
+    try:
+        _storage.delete(key)
+    except Exception:
+        pass
+
+
+def _resolve_payload(
+    b64_data: Optional[str],
+    storage_key: Optional[str],
+    kind: str,
+    *,
+    keep: bool = False,
+) -> bytes:
     if storage_key:
-        return _pop_storage_blob(storage_key)
+        # Blobs owned by a render manifest stay in storage until their TTL expires.
+        return _load_storage_blob(storage_key) if keep else _pop_storage_blob(storage_key)
     if b64_data:
         return _decode_b64(b64_data)
     raise RuntimeError(f"Не передан файл для {kind}.")
 
 
+def _render_manifest_pages(manifest: dict, page_indices: List[int], filename: str) -> dict[int, Tuple[str, bytes]]:
+    try:
+        pdf_bytes = _load_storage_blob(manifest["render_key"])
+    except RuntimeError:
+        return {}
+    base_name = _sanitize_basename(filename, "page")
+    rendered: dict[int, Tuple[str, bytes]] = {}
+    for idx in sorted(set(page_indices)):
+        try:
+            pages = convert_pdf_to_png(pdf_bytes, base_name=f"{base_name}-{idx:03d}", first_page=idx, last_page=idx)
+        except ValueError:
+            continue
+        if pages:
+            rendered[idx] = pages[0]
+    return rendered
+
+
+def _collect_pages(
+    *,
+    b64_data: Optional[str],
+    storage_key: Optional[str],
+    manifest_key: Optional[str],
+    kind: str,
+    filename: str,
+    mime_type: str | None,
+    page_indices: List[int] | None,
+    default_all: bool,
+    stored_pages: List[dict] | None = None,
+) -> List[Tuple[str, bytes]]:
+    """Return the selected pages, rendering only those missing from storage.
+
+    ``page_indices`` are page ids (see ``manifest.page_id``) in publish
+    order.  Pages the caller still has in storage come as ``stored_pages``
+    (``{"page_id", "page_key", "filename", "keep"}``), the rest are taken
+    from the manifest, and only what is left is rendered.
+    """
+    wanted: List[int] = []
+    for idx in page_indices or []:
+        if idx not in wanted:
+            wanted.append(idx)
+
+    found: dict[int, Tuple[str, bytes]] = {}
+    for entry in stored_pages or []:
+        idx = int(entry.get("page_id") or 0)
+        if idx not in wanted or idx in found:
+            continue
+        try:
+            found[idx] = (entry.get("filename") or f"page-{idx:03d}.png", _load_storage_blob(entry["page_key"]))
+        except RuntimeError:
+            continue
+        if not entry.get("keep"):
+            _delete_storage_blob(entry["page_key"])
+    missing = [idx for idx in wanted if idx not in found]
+    manifest = None
+    if manifest_key and missing:
+        manifest = load_manifest(_storage, manifest_key)
+        if manifest:
+            kept, missing = load_manifest_pages(_storage, manifest, missing)
+            found.update(kept)
+    if manifest and missing and manifest.get("render_key"):
+        # Lazily previewed document: rasterise only the pages nobody has seen yet.
+        found.update(_render_manifest_pages(manifest, missing, filename))
+        missing = [idx for idx in missing if idx not in found]
+    if wanted and not missing:
+        return [found[idx] for idx in wanted if idx in found]
+
+    source = _resolve_payload(b64_data, storage_key, kind, keep=bool(manifest_key))
+    pages = render_to_png(source, filename=filename, mime_type=mime_type)
+    if not pages:
+        raise RuntimeError(f"{kind} has no pages.")
+    if not wanted:
+        return pages if default_all else [pages[0]]
+
+    selected: List[Tuple[str, bytes]] = []
+    for idx in wanted:
+        if idx in found:
+            selected.append(found[idx])
+        elif 1 <= idx <= len(pages):
+            selected.append(pages[idx - 1])
+    if not selected:
+        return pages if default_all else [pages[0]]
+    return selected
+
+
+def _enqueue_pages(chat_id: int, pages: List[Tuple[str, bytes]], watermark_text: str | None) -> int:
+    """Hand the rendered pages over to the publish queue and free the render slot.
+
+    Returns the number of pages queued.  Whether they reach the channel is
+    only known later: ``record_publications`` records what was delivered.
+
+    Sending is never done inline: backoff and rate-limit waits would otherwise
+    hold a render worker in ``time.sleep``.
+
+    Pages are chained so each one is sent only after the previous one, which
+    keeps channel order; every link passes the accumulated Telegram results
+    on, and the final callback records the whole job at once.  In album mode
+    a link sends up to ``PUBLISH_ALBUM_SIZE`` pages with one sendMediaGroup.
+    """
+    entries = []
+    for name, png_bytes in pages:
+        key = f"{FANOUT_PAGE_PREFIX}:{uuid.uuid4().hex}"
+        _storage.set(key, png_bytes, ex=FANOUT_PAGE_TTL)
+        entries.append({"page_key": key, "filename": name})
+    _chain_pages(chat_id, entries, watermark_text)
+    return len(entries)
+
+
+def _chain_pages(chat_id: int, entries: List[dict], watermark_text: str | None) -> None:
+    size = PUBLISH_ALBUM_SIZE if PUBLISH_ALBUM else 1
+    groups = [entries[idx:idx + size] for idx in range(0, len(entries), size)]
+    links = [_publish_link(chat_id, group, watermark_text, first=not position) for position, group in enumerate(groups)]
+    links.append(record_publications.s(chat_id=chat_id).set(queue=PUBLISH_QUEUE))
+    chain(*links).apply_async()
+
+
+@shared_task(bind=True)
+def publish_stored_pages(
+    self,
+    chat_id: int,
+    pages: List[dict],
+    watermark_text: str | None = None,
+) -> int:
+    """Publish pages already in storage (e.g. kept from the preview) as one ordered chain.
+
+    This is the bot's main publish path, so it honours ``PUBLISH_ALBUM`` the
+    same way re-rendered jobs do: 2-10 pages go out as sendMediaGroup albums.
+
+    ``pages`` are ``{"page_key", "filename", "keep"}`` entries in channel
+    order; ``keep`` leaves blobs owned by a render manifest in storage.  The
+    same blob may be published more than once, so idempotency keys are
+    derived from this task's id rather than from the page key.  Returns the
+    number of pages queued.
+    """
+    entries = [
+        {
+            "page_key": entry["page_key"],
+            "filename": entry.get("filename") or "smeta.png",
+            "keep": bool(entry.get("keep")),
+            "idempotency_key": entry.get("idempotency_key") or f"{self.request.id}:{entry['page_key']}",
+        }
+        for entry in pages
+        if entry.get("page_key")
+    ]
+    if entries:
+        _chain_pages(chat_id, entries, watermark_text)
+    return len(entries)
+
+
+def _publish_link(chat_id: int, group: List[dict], watermark_text: str | None, *, first: bool, published=None):
+    """Chain link for one page (publish_page) or several pages (publish_album)."""
+    head = (published if published is not None else [],) if first else ()
+    if len(group) == 1:
+        sig = publish_page.s(*head, chat_id=chat_id, watermark_text=watermark_text, **group[0])
+    else:
+        sig = publish_album.s(*head, chat_id=chat_id, pages=group, watermark_text=watermark_text)
+    return sig.set(queue=PUBLISH_QUEUE)
+
+
+@shared_task(bind=True, max_retries=None)
+def publish_page(
+    self,
+    published: List[Tuple[str, dict]],
+    *,
+    chat_id: int,
+    page_key: str,
+    filename: str,
+    watermark_text: str | None = None,
+    keep: bool = False,
+    idempotency_key: str | None = None,
+    started_at: float | None = None,
+    failures: int = 0,
+) -> List[Tuple[str, dict]]:
+    """Watermark and send one page of a fanned-out job; never breaks the chain.
+
+    Transient failures are rescheduled with a countdown instead of sleeping,
+    so the publish slot is free during backoff; rate-limit and flood waits do
+    not count as failures, a request Telegram rejects for good (malformed
+    file, see ``PERMANENT_400_MARKERS``) gives up at once.  The page key
+    doubles as the idempotency key unless one is given, so a retried or
+    redelivered page is posted only once.  ``keep`` leaves the blob in
+    storage afterwards.
+    """
+    started_at = started_at or time.time()
+    attempt = failures + 1
+    idempotency_key = idempotency_key or page_key
+    size = 0
+    try:
+        previous = delivered(idempotency_key)
+        if previous is not None:
+            # Redelivered after the page went out (e.g. worker lost before ack).
+            return [*published, (filename, previous.get("result"))]
+        png_bytes = _load_storage_blob(page_key)
+        name, payload = _prepare_page(filename, png_bytes, watermark_text)
+        size = len(payload)
+        try:
+            response = send_document_once(chat_id, payload, name, attempt=attempt, idempotency_key=idempotency_key)
+        except RetryLater as exc:
+            failures = reschedule(self, exc, failures, started_at=started_at)
+            response = None
+        if isinstance(response, dict) and response.get("ok"):
+            record_publish("success", time.time() - started_at, failures, size)
+            if not keep:
+                _delete_storage_blob(page_key)
+            return [*published, (name, response.get("result"))]
+        print(f"publish_page: failed to send {filename} to {chat_id}")
+    except Retry:
+        raise
+    except Exception as exc:
+        print("Error in publish_page:", exc)
+        traceback.print_exc()
+    record_publish("failure", time.time() - started_at, failures, size)
+    if not keep:
+        _delete_storage_blob(page_key)
+    return list(published)
+
+
+@shared_task(bind=True, max_retries=None)
+def publish_album(
+    self,
+    published: List[Tuple[str, dict]],
+    *,
+    chat_id: int,
+    pages: List[dict],
+    watermark_text: str | None = None,
+    started_at: float | None = None,
+    failures: int = 0,
+) -> List[Tuple[str, dict]]:
+    """Send a group of pages as one document album, keeping chain order.
+
+    Transient errors are retried with a countdown like ``publish_page``.  If
+    Telegram rejects the album or retries run out, the task replaces itself
+    with per-page ``publish_page`` links, so nothing is lost.
+    """
+    started_at = started_at or time.time()
+    attempt = failures + 1
+    disposable = [entry["page_key"] for entry in pages if not entry.get("keep")]
+    album_key = f"album:{pages[0].get('idempotency_key') or pages[0]['page_key']}"
+    size = 0
+    try:
+        previous = delivered(album_key)
+        if previous is None:
+            documents = [
+                _prepare_page(entry["filename"], _load_storage_blob(entry["page_key"]), watermark_text)
+                for entry in pages
+            ]
+            size = sum(len(payload) for _, payload in documents)
+            try:
+                answer = send_media_group_once(chat_id, documents, attempt=attempt, idempotency_key=album_key)
+            except RetryLater as exc:
+                # Budget spent or the album itself rejected: fall back to single pages.
+                failures = reschedule(self, exc, failures, started_at=started_at)
+                answer = None
+        else:
+            documents = [(entry["filename"], b"") for entry in pages]
+            answer = previous
+        messages = answer.get("result") if isinstance(answer, dict) and answer.get("ok") else None
+        if isinstance(messages, list) and len(messages) == len(documents):
+            record_publish("success", time.time() - started_at, failures, size)
+            for key in disposable:
+                _delete_storage_blob(key)
+            return [*published, *((name, message) for (name, _), message in zip(documents, messages))]
+        print(f"publish_album: album of {len(pages)} pages failed for {chat_id}, sending pages one by one")
+    except Retry:
+        raise
+    except Exception as exc:
+        print("Error in publish_album:", exc)
+        traceback.print_exc()
+    record_publish("failure", time.time() - started_at, failures, size)
+    links = [
+        _publish_link(chat_id, [entry], watermark_text, first=not position, published=published)
+        for position, entry in enumerate(pages)
+    ]
+    raise self.replace(chain(*links))
+
+
+@shared_task
+def record_publications(published: List[Tuple[str, dict]], *, chat_id: int) -> int:
+    """Chain callback: record every page the job published in one batch."""
+    entries = [(name, payload) for name, payload in published or [] if payload]
+    _record_publications(chat_id, entries)
+    return len(entries)
+
+
 @shared_task
 def render_pdf_to_png_300dpi(pdf_bytes: bytes, watermark_text: str | None = None) -> bytes:
     """Render the first PDF page to PNG (300 DPI)."""
@@ -247,73 +585,89 @@ def process_and_publish_pdf(
     watermark_text: str | None = None,
     filename: str = "smeta.pdf",
     page_indices: List[int] | None = None,
-) -> bool:
-    """Decode a PDF, render selected pages to PNG and post them to Telegram."""
+    manifest_key: Optional[str] = None,
+    stored_pages: List[dict] | None = None,
+) -> int:
+    """Queue selected PDF pages for publishing, rendering only pages not kept from the preview.
+
+    Returns the number of pages queued (0 on error); delivery is recorded by
+    ``record_publications`` at the end of the publish chain.
+    """
     try:
-        pdf_bytes = _resolve_payload(pdf_b64, pdf_key, "PDF")
-        pages = render_to_png(pdf_bytes, filename=filename or "document.pdf", mime_type="application/pdf")
-        if not pages:
-            raise RuntimeError("PDF has no pages.")
-
-        selected = _filter_pages(pages, page_indices) or [pages[0]]
-
-        ok = True
-        for name, png_bytes in selected:
-            payload = _apply_watermark(png_bytes, watermark_text)
-            message_payload = _send_png(chat_id, name, payload)
-            if not message_payload:
-                ok = False
-            else:
-                _record_publication(chat_id, name, message_payload)
-        return ok
+        selected = _collect_pages(
+            b64_data=pdf_b64,
+            storage_key=pdf_key,
+            manifest_key=manifest_key,
+            kind="PDF",
+            filename=filename or "document.pdf",
+            mime_type="application/pdf",
+            page_indices=page_indices,
+            stored_pages=stored_pages,
+            default_all=False,
+        )
+        return _enqueue_pages(chat_id, selected, watermark_text)
     except Exception as exc:
         print("Error in process_and_publish_pdf:", exc)
         traceback.print_exc()
-        return False
+        return 0
 
 
-@shared_task
+@shared_task(bind=True, max_retries=None)
 def process_and_publish_png(
+    self,
     chat_id: int,
     png_b64: Optional[str] = None,
     png_key: Optional[str] = None,
     watermark_text: str | None = None,
     filename: str = "smeta.png",
     apply_watermark: bool = True,
+    keep_blob: bool = False,
+    started_at: float | None = None,
+    failures: int = 0,
 ) -> bool:
-    """Send an existing PNG file to Telegram, optionally applying a watermark."""
+    """Send an existing PNG file to Telegram, optionally applying a watermark.
+
+    Retries like ``publish_page``: the task is rescheduled with a countdown
+    and the stored PNG is only released once the page is sent or given up.
+    """
+    started_at = started_at or time.time()
+    idempotency_key = f"png:{self.request.id}"
+    size = 0
     try:
-        png_bytes = _resolve_payload(png_b64, png_key, "PNG")
-        payload = png_bytes
-
-        if apply_watermark and watermark_text and str(watermark_text).strip():
-            with Image.open(io.BytesIO(png_bytes)).convert("RGB") as img:
-                stamped = apply_tiled_watermark(
-                    img,
-                    text=watermark_text,
-                    settings=WATERMARK_SETTINGS,
-                )
-                out = io.BytesIO()
-                stamped.save(out, format="PNG", optimize=True, dpi=(300, 300))
-                payload = out.getvalue()
-        else:
-            try:
-                with Image.open(io.BytesIO(png_bytes)) as img:
-                    out = io.BytesIO()
-                    img.save(out, format="PNG", optimize=True, dpi=(300, 300))
-                    payload = out.getvalue()
-            except Exception:
-                payload = png_bytes
-
-        message_payload = _send_png(chat_id, filename, payload)
-        if message_payload:
-            _record_publication(chat_id, filename, message_payload)
+        if delivered(idempotency_key) is not None:
+            # Redelivered after the page went out (e.g. worker lost before ack).
             return True
-        return False
+        png_bytes = _resolve_payload(png_b64, png_key, "PNG", keep=True)
+        try:
+            filename, payload = _prepare_page(filename, png_bytes, watermark_text if apply_watermark else None)
+        except Exception:
+            if apply_watermark and watermark_text:
+                raise
+            payload = png_bytes
+        size = len(payload)
+        try:
+            response = send_document_once(
+                chat_id, payload, filename, attempt=failures + 1, idempotency_key=idempotency_key
+            )
+        except RetryLater as exc:
+            failures = reschedule(self, exc, failures, started_at=started_at)
+            response = None
+        if isinstance(response, dict) and response.get("ok"):
+            record_publish("success", time.time() - started_at, failures, size)
+            if png_key and not keep_blob:
+                _delete_storage_blob(png_key)
+            _record_publication(chat_id, filename, response.get("result"))
+            return True
+        print(f"process_and_publish_png: failed to send {filename} to {chat_id}")
+    except Retry:
+        raise
     except Exception as exc:
         print("Error in process_and_publish_png:", exc)
         traceback.print_exc()
-        return False
+    record_publish("failure", time.time() - started_at, failures, size)
+    if png_key and not keep_blob:
+        _delete_storage_blob(png_key)
+    return False
 
 
 @shared_task
@@ -324,29 +678,30 @@ def process_and_publish_doc(
     watermark_text: str | None = None,
     filename: str = "document.docx",
     page_indices: List[int] | None = None,
-) -> bool:
-    """Convert DOC/DOCX to PNG pages and post them to Telegram."""
+    manifest_key: Optional[str] = None,
+    stored_pages: List[dict] | None = None,
+) -> int:
+    """Convert DOC/DOCX to PNG pages (unless kept from the preview) and queue them for publishing.
+
+    Returns the number of pages queued (0 on error), like ``process_and_publish_pdf``.
+    """
     try:
-        doc_bytes = _resolve_payload(doc_b64, doc_key, "DOC")
-        pages = render_to_png(doc_bytes, filename=filename, mime_type=None)
-        if not pages:
-            raise RuntimeError("Document has no pages.")
-
-        selected = _filter_pages(pages, page_indices) or pages
-
-        ok = True
-        for name, png_bytes in selected:
-            payload = _apply_watermark(png_bytes, watermark_text)
-            message_payload = _send_png(chat_id, name, payload)
-            if not message_payload:
-                ok = False
-            else:
-                _record_publication(chat_id, name, message_payload)
-        return ok
+        selected = _collect_pages(
+            b64_data=doc_b64,
+            storage_key=doc_key,
+            manifest_key=manifest_key,
+            kind="Document",
+            filename=filename,
+            mime_type=None,
+            page_indices=page_indices,
+            stored_pages=stored_pages,
+            default_all=True,
+        )
+        return _enqueue_pages(chat_id, selected, watermark_text)
     except Exception as exc:
         print("Error in process_and_publish_doc:", exc)
         traceback.print_exc()
-        return False
+        return 0
 
 
 @shared_task
@@ -357,26 +712,27 @@ def process_and_publish_excel(
     watermark_text: str | None = None,
     filename: str = "document.xlsx",
     page_indices: List[int] | None = None,
-) -> bool:
-    """Convert spreadsheet documents to PNG pages and post them to Telegram."""
+    manifest_key: Optional[str] = None,
+    stored_pages: List[dict] | None = None,
+) -> int:
+    """Convert spreadsheets to PNG pages (unless kept from the preview) and queue them for publishing.
+
+    Returns the number of pages queued (0 on error), like ``process_and_publish_pdf``.
+    """
     try:
-        excel_bytes = _resolve_payload(excel_b64, excel_key, "Excel")
-        pages = render_to_png(excel_bytes, filename=filename, mime_type=None)
-        if not pages:
-            raise RuntimeError("Spreadsheet has no pages to export.")
-
-        selected = _filter_pages(pages, page_indices) or pages
-
-        ok = True
-        for name, png_bytes in selected:
-            payload = _apply_watermark(png_bytes, watermark_text)
-            message_payload = _send_png(chat_id, name, payload)
-            if not message_payload:
-                ok = False
-            else:
-                _record_publication(chat_id, name, message_payload)
-        return ok
+        selected = _collect_pages(
+            b64_data=excel_b64,
+            storage_key=excel_key,
+            manifest_key=manifest_key,
+            kind="Spreadsheet",
+            filename=filename,
+            mime_type=None,
+            page_indices=page_indices,
+            stored_pages=stored_pages,
+            default_all=True,
+        )
+        return _enqueue_pages(chat_id, selected, watermark_text)
     except Exception as exc:
         print("Error in process_and_publish_excel:", exc)
         traceback.print_exc()
-        return False
+        return 0
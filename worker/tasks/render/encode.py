@@ -0,0 +1,130 @@
+"""Encoding stage for pages sent to Telegram.
+
+Re-encoding a 300 DPI A4 page with ``optimize=True`` costs more CPU than
+rendering it, so the trade-off between bytes and latency is configurable per
+worker (and therefore per queue, since every queue has its own worker
+service):
+
+* ``PAGE_ENCODE_FORMAT`` – ``png`` (default) or lossless ``webp``;
+* ``PNG_COMPRESS_LEVEL`` – zlib level 0-9 (default 6);
+* ``PNG_OPTIMIZE`` – extra optimisation pass, slow (default off);
+* ``PNG_PALETTE_COLORS`` – quantise mostly-text pages to a palette of that
+  many colours (default 0 = off).  Pages with more than
+  ``PNG_PALETTE_MAX_SOURCE_COLORS`` distinct colours (photos, scans) are
+  left in RGB.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Tuple
+
+from PIL import Image
+
+from worker.metrics import record_encode
+
+
+@dataclass(frozen=True)
+class EncodeSettings:
+    """Configuration of the page encoding stage."""
+
+    format: str = "png"
+    compress_level: int = 6
+    optimize: bool = False
+    palette_colors: int = 0
+    palette_max_source_colors: int = 4096
+    webp_method: int = 4
+    dpi: int = 300
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "").strip() or default)
+    except ValueError:
+        return default
+
+
+def _bool_env(name: str, default: bool) -> bool:
+    raw = os.getenv(name, "").strip().lower()
+    if not raw:
+        return default
+    return raw not in {"0", "false", "no"}
+
+
+def load_encode_settings() -> EncodeSettings:
+    """Read encoding settings from environment or fall back to defaults."""
+    defaults = EncodeSettings()
+    fmt = (os.getenv("PAGE_ENCODE_FORMAT", defaults.format).strip().lower() or defaults.format)
+    if fmt not in {"png", "webp"}:
+        fmt = defaults.format
+    return EncodeSettings(
+        format=fmt,
+        compress_level=max(0, min(9, _int_env("PNG_COMPRESS_LEVEL", defaults.compress_level))),
+        optimize=_bool_env("PNG_OPTIMIZE", defaults.optimize),
+        palette_colors=max(0, min(256, _int_env("PNG_PALETTE_COLORS", defaults.palette_colors))),
+        palette_max_source_colors=_int_env("PNG_PALETTE_MAX_SOURCE_COLORS", defaults.palette_max_source_colors),
+        webp_method=max(0, min(6, _int_env("WEBP_METHOD", defaults.webp_method))),
+        dpi=_int_env("PAGE_ENCODE_DPI", defaults.dpi),
+    )
+
+
+ENCODE_SETTINGS = load_encode_settings()
+
+
+def _maybe_palette(img: Image.Image, cfg: EncodeSettings) -> Image.Image:
+    if cfg.palette_colors <= 0:
+        return img
+    # getcolors returns None when the page has more colours than the limit.
+    if img.getcolors(maxcolors=cfg.palette_max_source_colors) is None:
+        return img
+    return img.quantize(colors=cfg.palette_colors, dither=Image.Dither.NONE)
+
+
+def needs_reencode(settings: EncodeSettings | None = None) -> bool:
+    """True when an untouched PNG from the renderer must still be re-encoded."""
+    cfg = settings or ENCODE_SETTINGS
+    return cfg.format != "png" or cfg.palette_colors > 0
+
+
+def encode_page(img: Image.Image, *, settings: EncodeSettings | None = None) -> Tuple[bytes, str]:
+    """Encode a rendered page; returns ``(payload, suffix)`` (``.png`` or ``.webp``)."""
+    cfg = settings or ENCODE_SETTINGS
+    started = time.perf_counter()
+    out = io.BytesIO()
+    if cfg.format == "webp":
+        img.save(out, format="WEBP", lossless=True, method=cfg.webp_method)
+        suffix, label = ".webp", "webp"
+    else:
+        prepared = _maybe_palette(img, cfg)
+        prepared.save(
+            out,
+            format="PNG",
+            compress_level=cfg.compress_level,
+            optimize=cfg.optimize,
+            dpi=(cfg.dpi, cfg.dpi),
+        )
+        suffix, label = ".png", "png_palette" if prepared.mode == "P" else "png"
+    payload = out.getvalue()
+    record_encode(label, time.perf_counter() - started, len(payload))
+    return payload, suffix
+
+
+def encoded_filename(filename: str, suffix: str) -> str:
+    path = Path(filename or "smeta.png")
+    if path.suffix.lower() == suffix:
+        return path.name
+    return path.with_suffix(suffix).name
+
+
+__all__ = [
+    "ENCODE_SETTINGS",
+    "EncodeSettings",
+    "encode_page",
+    "encoded_filename",
+    "load_encode_settings",
+    "needs_reencode",
+]
@@ -1,9 +1,25 @@
 from __future__ import annotations
 
+import logging
+import os
+import tempfile
 from typing import List, Optional, Tuple
 
 import fitz
 
+try:  # Celery's fork of multiprocessing; allows pools inside daemonic prefork children.
+    import billiard as _mp  # type: ignore
+except Exception:  # pragma: no cover - billiard ships with celery
+    import multiprocessing as _mp  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Upper bound of processes a single document may use; 1 keeps rendering sequential.
+RENDER_PARALLELISM = int(os.getenv("RENDER_PARALLELISM", "1"))
+# Documents shorter than this are never split across processes.
+RENDER_PARALLEL_MIN_PAGES = int(os.getenv("RENDER_PARALLEL_MIN_PAGES", "4"))
+_SHM_DIR = "/dev/shm"
+
 
 def _resolve_page_bounds(total_pages: int, first_page: Optional[int], last_page: Optional[int]) -> Tuple[int, int]:
     """Clamp requested page range to the document boundaries."""
@@ -17,6 +33,61 @@ def _resolve_page_bounds(total_pages: int, first_page: Optional[int], last_page:
     return start, end
 
 
+def _job_parallelism(pages: int, requested: Optional[int]) -> int:
+    """Processes for one job: the per-job limit shared fairly with Celery's own concurrency."""
+    limit = RENDER_PARALLELISM if requested is None else requested
+    if limit <= 1 or pages < RENDER_PARALLEL_MIN_PAGES:
+        return 1
+    cpus = os.cpu_count() or 1
+    celery_slots = max(1, int(os.getenv("CELERY_CONCURRENCY", "1") or 1))
+    return max(1, min(limit, pages, cpus // celery_slots or 1))
+
+
+def _render_pages(doc, start: int, end: int, dpi: int, color: bool) -> List[bytes]:
+    zoom = max(dpi, 72) / 72.0
+    matrix = fitz.Matrix(zoom, zoom)
+    colorspace = getattr(fitz, "csGRAY", None) if not color else None
+    rendered: List[bytes] = []
+    for page_index in range(start - 1, end):
+        page = doc.load_page(page_index)
+        if colorspace is not None:
+            pix = page.get_pixmap(matrix=matrix, colorspace=colorspace, alpha=False)
+        else:
+            pix = page.get_pixmap(matrix=matrix, alpha=False)
+        rendered.append(pix.tobytes("png"))
+    return rendered
+
+
+def _render_chunk(args: Tuple[str, int, int, int, bool]) -> List[bytes]:
+    path, start, end, dpi, color = args
+    with fitz.open(path) as doc:
+        return _render_pages(doc, start, end, dpi, color)
+
+
+def _render_parallel(pdf_bytes: bytes, start: int, end: int, dpi: int, color: bool, processes: int) -> List[bytes]:
+    """Split ``start..end`` into contiguous chunks rendered by a process pool.
+
+    The PDF is written once to a tmpfs-backed temp file; every child opens it
+    by path, so all of them share the same page-cache copy instead of
+    receiving the bytes through a pipe.
+    """
+    pages = end - start + 1
+    chunk = -(-pages // processes)
+    bounds = [(s, min(s + chunk - 1, end)) for s in range(start, end + 1, chunk)]
+    tmp_dir = _SHM_DIR if os.path.isdir(_SHM_DIR) else None
+    with tempfile.NamedTemporaryFile(suffix=".pdf", dir=tmp_dir) as handle:
+        handle.write(pdf_bytes)
+        handle.flush()
+        jobs = [(handle.name, s, e, dpi, color) for s, e in bounds]
+        pool = _mp.Pool(processes=len(jobs))
+        try:
+            chunks = pool.map(_render_chunk, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    return [payload for part in chunks for payload in part]
+
+
 def convert(
     pdf_bytes: bytes,
     base_name: str,
@@ -25,11 +96,13 @@ def convert(
     color: bool = True,
     first_page: Optional[int] = None,
     last_page: Optional[int] = None,
+    parallelism: Optional[int] = None,
 ) -> List[Tuple[str, bytes]]:
-    """Render a PDF document to PNG images using PyMuPDF."""
-    zoom = max(dpi, 72) / 72.0
-    matrix = fitz.Matrix(zoom, zoom)
+    """Render a PDF document to PNG images using PyMuPDF.
 
+    ``parallelism`` caps the processes used for this document (defaults to
+    ``RENDER_PARALLELISM``); page order and file names do not depend on it.
+    """
     with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
         total_pages = doc.page_count
         if total_pages == 0:
@@ -37,19 +110,19 @@ def convert(
 
         start, end = _resolve_page_bounds(total_pages, first_page, last_page)
         total_requested = end - start + 1
+        processes = _job_parallelism(total_requested, parallelism)
+
+        payloads: Optional[List[bytes]] = None
+        if processes > 1:
+            try:
+                payloads = _render_parallel(pdf_bytes, start, end, dpi, color, processes)
+            except Exception:
+                logger.warning("pdf_to_png: parallel render failed, falling back to sequential", exc_info=True)
+        if payloads is None:
+            payloads = _render_pages(doc, start, end, dpi, color)
 
-        colorspace = None
-        if not color:
-            colorspace = getattr(fitz, "csGRAY", None)
-
-        result: List[Tuple[str, bytes]] = []
-        for idx, page_index in enumerate(range(start - 1, end), start=1):
-            page = doc.load_page(page_index)
-            if colorspace is not None:
-                pix = page.get_pixmap(matrix=matrix, colorspace=colorspace, alpha=False)
-            else:
-                pix = page.get_pixmap(matrix=matrix, alpha=False)
-            filename = f"{base_name}-{idx:03d}.png" if total_requested > 1 else f"{base_name}.png"
-            result.append((filename, pix.tobytes("png")))
-
-        return result
+    result: List[Tuple[str, bytes]] = []
+    for idx, payload in enumerate(payloads, start=1):
+        filename = f"{base_name}-{idx:03d}.png" if total_requested > 1 else f"{base_name}.png"
+        result.append((filename, payload))
+    return result
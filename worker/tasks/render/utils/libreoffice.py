@@ -1,20 +1,10 @@
 from __future__ import annotations
 
 import os
-import shutil
-import subprocess
 from pathlib import Path
 from typing import Optional
 
-_LIBREOFFICE_CANDIDATES = ("libreoffice", "soffice")
-
-
-def _find_libreoffice() -> str:
-    for candidate in _LIBREOFFICE_CANDIDATES:
-        path = shutil.which(candidate)
-        if path:
-            return path
-    raise RuntimeError("LibreOffice не найден в PATH. Установите пакет libreoffice.")
+from common.libreoffice import LibreOfficeError, convert_file, get_pool, shutdown_pool
 
 
 def convert_to_pdf(
@@ -25,57 +15,30 @@ def convert_to_pdf(
     timeout: int = 240,
 ) -> Path:
     """Convert a document supported by LibreOffice to PDF."""
-    binary = _find_libreoffice()
-    working_dir.mkdir(parents=True, exist_ok=True)
-
-    profile_dir = working_dir / "lo_profile"
-    profile_dir.mkdir(exist_ok=True)
-
-    env = os.environ.copy()
-    env.setdefault("HOME", str(profile_dir))
-    env.setdefault("TMPDIR", str(working_dir))
-    env.setdefault("SAL_USE_VCLPLUGIN", "headless")
-
-    convert_arg = "pdf" if not filter_name else f"pdf:{filter_name}"
+    try:
+        return convert_file(
+            source_path,
+            working_dir,
+            convert_to="pdf",
+            filter_name=filter_name,
+            timeout=timeout,
+        )
+    except LibreOfficeError as exc:
+        raise RuntimeError(str(exc)) from exc
 
-    cmd = [
-        binary,
-        "--headless",
-        "--nologo",
-        "--nodefault",
-        "--nofirststartwizard",
-        "--norestore",
-        "--nolockcheck",
-        "--convert-to",
-        convert_arg,
-        str(source_path),
-        "--outdir",
-        str(working_dir),
-    ]
 
-    proc = subprocess.run(
-        cmd,
-        cwd=working_dir,
-        env=env,
-        capture_output=True,
-        text=True,
-        timeout=timeout,
-    )
-    if proc.returncode != 0:
-        raise RuntimeError(
-            "LibreOffice завершился с ошибкой при конвертации в PDF.\n"
-            f"Команда: {' '.join(cmd)}\n"
-            f"STDOUT:\n{proc.stdout}\n"
-            f"STDERR:\n{proc.stderr}"
-        )
+def setup_pool_signal_handlers() -> None:
+    """Start the LibreOffice pool in each worker process and stop it on shutdown."""
+    from celery import signals  # Imported lazily to avoid circular deps.
 
-    expected = source_path.with_suffix(".pdf")
-    if expected.exists():
-        return expected
+    prestart = os.getenv("LIBREOFFICE_POOL_PRESTART", "0").lower() in {"1", "true", "yes"}
 
-    pdf_candidates = sorted(working_dir.glob("*.pdf"))
-    if not pdf_candidates:
-        raise RuntimeError("LibreOffice не создал PDF-файл.")
+    @signals.worker_process_init.connect  # type: ignore[arg-type]
+    def _on_worker_process_init(**_: object) -> None:
+        pool = get_pool()
+        if prestart and pool is not None:
+            pool.start()
 
-    # выбираем первый созданный PDF, если совпадение по имени не найдено
-    return pdf_candidates[0]
+    @signals.worker_process_shutdown.connect  # type: ignore[arg-type]
+    def _on_worker_process_shutdown(**_: object) -> None:
+        shutdown_pool()
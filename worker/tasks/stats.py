@@ -1,108 +1,78 @@
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from celery import shared_task
 from datetime import datetime, timedelta
+from bot.services import analytics as analytics_service
 from bot.services import db as db_service
+from tasks import db_loop
+from worker.metrics import record_stats_job
+
+# Stay below the task soft time limit (CELERY_TASK_SOFT_TIME_LIMIT).
+STATS_JOB_TIMEOUT = float(os.getenv("STATS_JOB_TIMEOUT", "170"))
+CHANNEL_STATS_BATCH = int(os.getenv("CHANNEL_STATS_BATCH", "500"))
+USERBOT_URL = os.getenv("USERBOT_URL", "http://userbot:8001")
+# Сколько подрядчиков опрашивается одновременно и сколько последних сообщений канала.
+VIEWS_REFRESH_CONCURRENCY = int(os.getenv("VIEWS_REFRESH_CONCURRENCY", "4"))
+VIEWS_REFRESH_MESSAGES = int(os.getenv("VIEWS_REFRESH_MESSAGES", "100"))
+VIEWS_REFRESH_TIMEOUT = float(os.getenv("VIEWS_REFRESH_TIMEOUT", "60"))
 
 @shared_task
 def update_views_daily() -> dict:
-    """Агрегирует просмотры по публикациям за текущий день."""
+    """Агрегирует просмотры по публикациям за текущий день (один INSERT ... SELECT)."""
+    started = time.monotonic()
     try:
-        # Получаем все публикации с просмотрами > 0
-        rows = db_service.fetch(
-            """
-            SELECT id, views, posted_at 
-            FROM core.publications 
-            WHERE views > 0 AND deleted = false
-            ORDER BY id
-            """
-        )
-        
-        today = datetime.now().date()
-        inserted = 0
-        
-        for row in rows:
-            pub_id = row["id"]
-            views = row["views"]
-            
-            # Вставляем или обновляем запись за сегодня
-            db_service.execute(
-                """
-                INSERT INTO analytics.views_daily (publication_id, collected_at, views)
-                VALUES ($1, $2, $3)
-                ON CONFLICT (publication_id, collected_at) DO UPDATE
-                    SET views = EXCLUDED.views
-                """,
-                pub_id, today, views
-            )
-            inserted += 1
-        
-        return {"status": "ok", "rows_processed": len(rows), "rows_inserted": inserted}
+        rows = db_loop.run(analytics_service.snapshot_views_daily(datetime.now().date()), timeout=STATS_JOB_TIMEOUT)
     except Exception as exc:
+        record_stats_job("views_daily", "error", time.monotonic() - started, 0)
         print(f"Error in update_views_daily: {exc}")
         return {"status": "error", "error": str(exc)}
+    record_stats_job("views_daily", "ok", time.monotonic() - started, rows)
+    return {"status": "ok", "rows_upserted": rows}
 
 @shared_task
-def update_channel_stats() -> dict:
-    """Обновляет агрегированную статистику по каналам."""
+def update_channel_stats(full: bool = False) -> dict:
+    """Сверяет analytics.channel_stats.
+
+    Счётчики ведут триггеры (дельты при изменении публикаций и клиентов), так
+    что по умолчанию пересчитываются только каналы с флагом dirty, пачками по
+    CHANNEL_STATS_BATCH.  ``full=True`` — полный пересчёт всех каналов.
+    """
+    started = time.monotonic()
+    job = "channel_stats_full" if full else "channel_stats"
     try:
-        # Получаем все каналы
-        channels = db_service.fetch(
-            "SELECT id FROM core.channels ORDER BY id"
-        )
-        
-        updated = 0
-        
-        for ch_row in channels:
-            channel_id = ch_row["id"]
-            
-            # Считаем файлы и просмотры
-            files_row = db_service.fetchrow(
-                """
-                SELECT 
-                    COUNT(*) as files_count,
-                    COALESCE(SUM(views), 0) as views_total
-                FROM core.publications 
-                WHERE channel_id = $1 AND deleted = false
-                """,
-                channel_id
-            )
-            
-            # Считаем клиентов
-            clients_row = db_service.fetchrow(
-                """
-                SELECT 
-                    COUNT(*) as clients_total,
-                    COUNT(*) FILTER (WHERE blocked = true) as blocked_total
-                FROM core.clients 
-                WHERE channel_id = $1
-                """,
-                channel_id
-            )
-            
-            # Вставляем или обновляем статистику
-            db_service.execute(
-                """
-                INSERT INTO analytics.channel_stats 
-                    (channel_id, files_count, views_total, clients_total, blocked_total, last_updated)
-                VALUES ($1, $2, $3, $4, $5, now())
-                ON CONFLICT (channel_id) DO UPDATE
-                    SET files_count = EXCLUDED.files_count,
-                        views_total = EXCLUDED.views_total,
-                        clients_total = EXCLUDED.clients_total,
-                        blocked_total = EXCLUDED.blocked_total,
-                        last_updated = EXCLUDED.last_updated
-                """,
-                channel_id,
-                files_row["files_count"] if files_row else 0,
-                files_row["views_total"] if files_row else 0,
-                clients_row["clients_total"] if clients_row else 0,
-                clients_row["blocked_total"] if clients_row else 0,
-            )
-            updated += 1
-        
-        return {"status": "ok", "channels_updated": updated}
+        if full:
+            rows = db_loop.run(analytics_service.rebuild_channel_stats(), timeout=STATS_JOB_TIMEOUT)
+        else:
+            rows = 0
+            while time.monotonic() - started < STATS_JOB_TIMEOUT:
+                batch = db_loop.run(analytics_service.reconcile_channel_stats(CHANNEL_STATS_BATCH), timeout=STATS_JOB_TIMEOUT)
+                rows += batch
+                if batch < CHANNEL_STATS_BATCH:
+                    break
     except Exception as exc:
+        record_stats_job(job, "error", time.monotonic() - started, 0)
         print(f"Error in update_channel_stats: {exc}")
         return {"status": "error", "error": str(exc)}
+    record_stats_job(job, "ok", time.monotonic() - started, rows)
+    return {"status": "ok", "channels_updated": rows}
+
+@shared_task
+def refresh_profile_overview() -> dict:
+    """REFRESH MATERIALIZED VIEW CONCURRENTLY analytics.profile_overview."""
+    started = time.monotonic()
+    try:
+        refreshed = db_loop.run(analytics_service.refresh_profile_overview(), timeout=STATS_JOB_TIMEOUT)
+    except Exception as exc:
+        record_stats_job("profile_overview", "error", time.monotonic() - started, 0)
+        print(f"Error in refresh_profile_overview: {exc}")
+        return {"status": "error", "error": str(exc)}
+    if not refreshed:
+        return {"status": "skipped", "reason": "refresh already running"}
+    record_stats_job("profile_overview", "ok", time.monotonic() - started, 0)
+    return {"status": "ok"}
 
 @shared_task
 def apply_queued_gifts() -> dict:
@@ -195,134 +165,135 @@ def apply_queued_gifts() -> dict:
         print(f"Error in apply_queued_gifts: {exc}")
         return {"status": "error", "error": str(exc)}
 
+def _fetch_contractor_views(contractor_id: int, channels: list[dict]) -> tuple[dict[int, dict[int, int]], dict[int, str]]:
+    """Один запрос к userbot на все каналы подрядчика.
+
+    Возвращает tg_chat_id -> {message_id: views} и tg_chat_id -> ошибка.
+    """
+    import requests
+
+    response = requests.post(
+        f"{USERBOT_URL}/rooms/get_views_bulk",
+        json={
+            "contractor_id": str(contractor_id),
+            "channels": [
+                {"channel_id": ch["tg_chat_id"], "message_ids": list(ch["message_ids"])}
+                for ch in channels
+            ],
+        },
+        timeout=VIEWS_REFRESH_TIMEOUT,
+    )
+    if response.status_code == 429:
+        # Подрядчик упёрся в FloodWait — userbot не ждёт, а подсказывает, когда повторить.
+        raise RuntimeError(f"Userbot flood wait, retry after {response.headers.get('Retry-After', '?')}s")
+    if response.status_code != 200:
+        raise RuntimeError(f"Userbot API error: {response.status_code}")
+    data = response.json()
+    if not data.get("ok"):
+        raise RuntimeError(data.get("error") or "Unknown error")
+    # Ключи JSON-объектов приходят строками.
+    views = {
+        int(chat_id): {int(message_id): int(count) for message_id, count in (per_chat or {}).items()}
+        for chat_id, per_chat in (data.get("views") or {}).items()
+    }
+    errors = {int(chat_id): str(error) for chat_id, error in (data.get("errors") or {}).items()}
+    return views, errors
+
+
+def _refresh_views(targets: list[dict]) -> dict:
+    """Собирает просмотры по подрядчикам параллельно и пишет их одним UPDATE."""
+    by_contractor: dict[int, list[dict]] = defaultdict(list)
+    for target in targets:
+        by_contractor[target["contractor_id"]].append(target)
+
+    channel_ids: list[int] = []
+    message_ids: list[int] = []
+    views: list[int] = []
+    refreshed: set[int] = set()
+    errors: list[str] = []
+
+    workers = max(1, min(VIEWS_REFRESH_CONCURRENCY, len(by_contractor)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="views-refresh") as pool:
+        futures = {
+            pool.submit(_fetch_contractor_views, contractor_id, channels): (contractor_id, channels)
+            for contractor_id, channels in by_contractor.items()
+        }
+        for future in as_completed(futures):
+            contractor_id, channels = futures[future]
+            try:
+                fetched, failed = future.result()
+            except Exception as exc:
+                errors.append(f"Contractor {contractor_id}: {exc}")
+                continue
+            for channel in channels:
+                per_chat = fetched.get(channel["tg_chat_id"])
+                # Канал с ошибкой не считается обновлённым, даже если часть счётчиков пришла.
+                if per_chat is None or channel["tg_chat_id"] in failed:
+                    reason = failed.get(channel["tg_chat_id"], "no views returned")
+                    errors.append(f"Channel {channel['channel_id']}: {reason}")
+                    continue
+                refreshed.add(channel["channel_id"])
+                for message_id, count in per_chat.items():
+                    channel_ids.append(channel["channel_id"])
+                    message_ids.append(message_id)
+                    views.append(count)
+
+    updated = db_loop.run(
+        analytics_service.apply_publication_views(channel_ids, message_ids, views),
+        timeout=STATS_JOB_TIMEOUT,
+    )
+    return {
+        "channels_processed": len(targets),
+        "channels_updated": len(refreshed),
+        "messages_received": len(message_ids),
+        "messages_updated": updated,
+        "errors": errors,
+    }
+
+
 @shared_task
 def refresh_views_periodic() -> dict:
-    """Периодически обновляет просмотры для всех активных каналов."""
+    """Периодически обновляет просмотры для всех активных каналов.
+
+    Каналы группируются по подрядчику: один запрос к userbot на подрядчика
+    (одна Telethon-сессия на все его каналы), подрядчики опрашиваются
+    параллельно (не более VIEWS_REFRESH_CONCURRENCY), результат пишется
+    одним UPDATE ... FROM unnest.
+    """
+    started = time.monotonic()
     try:
-        # Получаем все каналы с публикациями
-        channels = db_service.fetch(
-            """
-            SELECT DISTINCT c.id, c.tg_chat_id, c.contractor_id
-            FROM core.channels c
-            JOIN core.publications p ON p.channel_id = c.id
-            WHERE p.deleted = false
-            ORDER BY c.id
-            """
+        targets = db_loop.run(
+            analytics_service.views_refresh_targets(VIEWS_REFRESH_MESSAGES),
+            timeout=STATS_JOB_TIMEOUT,
         )
-        
-        updated_channels = 0
-        total_updated_messages = 0
-        errors = []
-        
-        for channel in channels:
-            try:
-                result = refresh_views_for_room(channel["id"])
-                if result["status"] == "ok":
-                    updated_channels += 1
-                    total_updated_messages += result.get("updated", 0)
-                else:
-                    errors.append(f"Channel {channel['id']}: {result.get('error', 'Unknown error')}")
-            except Exception as e:
-                errors.append(f"Channel {channel['id']}: {str(e)}")
-        
-        return {
-            "status": "ok",
-            "channels_processed": len(channels),
-            "channels_updated": updated_channels,
-            "messages_updated": total_updated_messages,
-            "errors": errors
-        }
-        
+        result = _refresh_views(targets)
     except Exception as exc:
+        record_stats_job("views_refresh", "error", time.monotonic() - started, 0)
         print(f"Error in refresh_views_periodic: {exc}")
         return {"status": "error", "error": str(exc)}
+    record_stats_job("views_refresh", "ok", time.monotonic() - started, result["messages_updated"])
+    return {"status": "ok", **result}
 
 
 @shared_task
 def refresh_views_for_room(room_id: int) -> dict:
     """Обновляет просмотры для канала через userbot API."""
-    import requests
-    import os
-    
-    userbot_url = os.getenv("USERBOT_URL", "http://userbot:8000")
-    
     try:
-        # Получаем информацию о канале
-        channel_info = db_service.fetchrow(
-            "SELECT tg_chat_id, contractor_id FROM core.channels WHERE id = $1",
-            room_id
+        targets = db_loop.run(
+            analytics_service.views_refresh_targets(VIEWS_REFRESH_MESSAGES, room_id),
+            timeout=STATS_JOB_TIMEOUT,
         )
-        
-        if not channel_info:
-            return {"room_id": room_id, "status": "error", "error": "Channel not found"}
-        
-        tg_chat_id = channel_info["tg_chat_id"]
-        contractor_id = channel_info["contractor_id"]
-        
-        # Получаем список сообщений канала
-        publications = db_service.fetch(
-            """
-            SELECT message_id FROM core.publications 
-            WHERE channel_id = $1 AND deleted = false
-            ORDER BY posted_at DESC
-            LIMIT 100
-            """,
-            room_id
-        )
-        
-        if not publications:
+        if not targets:
             return {"room_id": room_id, "status": "ok", "updated": 0}
-        
-        message_ids = [pub["message_id"] for pub in publications]
-        
-        # Вызываем userbot API
-        response = requests.post(
-            f"{userbot_url}/rooms/get_views",
-            json={
-                "contractor_id": str(contractor_id),
-                "channel_id": tg_chat_id,
-                "message_ids": message_ids
-            },
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            return {
-                "room_id": room_id, 
-                "status": "error", 
-                "error": f"Userbot API error: {response.status_code}"
-            }
-        
-        data = response.json()
-        if not data.get("ok"):
-            return {
-                "room_id": room_id, 
-                "status": "error", 
-                "error": data.get("error", "Unknown error")
-            }
-        
-        views_data = data.get("views", {})
-        updated_count = 0
-        
-        # Обновляем просмотры в БД
-        for message_id, views in views_data.items():
-            db_service.execute(
-                """
-                UPDATE core.publications 
-                SET views = $3 
-                WHERE channel_id = $1 AND message_id = $2
-                """,
-                room_id, message_id, views
-            )
-            updated_count += 1
-        
-        return {
-            "room_id": room_id, 
-            "status": "ok", 
-            "updated": updated_count,
-            "total_messages": len(message_ids)
-        }
-        
+        result = _refresh_views(targets)
     except Exception as exc:
         print(f"Error in refresh_views_for_room: {exc}")
         return {"room_id": room_id, "status": "error", "error": str(exc)}
+    if result["errors"]:
+        return {"room_id": room_id, "status": "error", "error": "; ".join(result["errors"])}
+    return {
+        "room_id": room_id,
+        "status": "ok",
+        "updated": result["messages_updated"],
+        "total_messages": len(targets[0]["message_ids"]),
+    }
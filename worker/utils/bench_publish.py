@@ -0,0 +1,75 @@
+"""Benchmark per-page publish latency: fresh connections vs the pooled session.
+
+Usage (from the repository root)::
+
+    python -m worker.utils.bench_publish --pages 50 --latency-ms 20
+    python -m worker.utils.bench_publish --certfile cert.pem --keyfile key.pem
+
+A local stub Bot API (``worker.utils.stub_bot_api``) is started in-process;
+with a certificate the stub speaks HTTPS, so the saved TLS handshakes are
+part of the comparison.  The report shows ms/page and how many TCP
+connections the stub accepted for each mode.
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import time
+from typing import Callable
+
+import requests
+
+from worker.tasks import bot_api
+from worker.utils.stub_bot_api import serve
+
+
+def _payload(size: int) -> bytes:
+    return b"\x89PNG\r\n\x1a\n" + b"\0" * max(0, size - 8)
+
+
+def _run(label: str, server, pages: int, send: Callable[[int], requests.Response]) -> None:
+    before = server.stats["connections"]
+    started = time.perf_counter()
+    for idx in range(pages):
+        send(idx).raise_for_status()
+    elapsed = time.perf_counter() - started
+    opened = server.stats["connections"] - before
+    print(f"{label:<18} {elapsed * 1000 / pages:8.2f} ms/page  connections={opened}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--size", type=int, default=512 * 1024, help="bytes per page (default 512 KiB)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="server-side delay per request")
+    parser.add_argument("--certfile")
+    parser.add_argument("--keyfile")
+    args = parser.parse_args()
+
+    body = _payload(args.size)
+
+    def files(idx: int) -> dict:
+        return {"document": (f"page-{idx:03d}.png", io.BytesIO(body), "image/png")}
+
+    with serve(latency=args.latency_ms / 1000.0, certfile=args.certfile, keyfile=args.keyfile) as server:
+        bot_api.TELEGRAM_API_BASE = server.base_url
+        verify = not args.certfile  # self-signed certificates in local runs
+        data = {"chat_id": -100, "caption": "", "protect_content": True}
+
+        _run(
+            "fresh connection",
+            server,
+            args.pages,
+            lambda idx: requests.post(bot_api.api_url("sendDocument"), data=data, files=files(idx), timeout=60, verify=verify),
+        )
+        session = bot_api.get_session()
+        if hasattr(session, "verify"):
+            session.verify = verify
+        _run("pooled session", server, args.pages, lambda idx: bot_api.post("sendDocument", data=data, files=files(idx)))
+        bot_api.close_session()
+        print(f"stub stats: {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
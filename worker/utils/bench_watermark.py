@@ -0,0 +1,96 @@
+"""Benchmark the shared watermark engine against the per-tile compositing loop.
+
+Usage (from the repository root)::
+
+    python -m worker.utils.bench_watermark --pages 20 --size 2480x3508
+
+Pages are synthetic A4@300dpi RGB images; every run reports wall time per
+page for the legacy RGBA loop, the engine with a cold overlay and the engine
+with a cached overlay, plus the largest per-channel pixel difference.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Callable, List, Tuple
+
+from PIL import Image, ImageChops, ImageDraw
+
+from common.watermark import WATERMARK_SETTINGS, WatermarkSettings
+from common.watermark_engine import _OVERLAY_CACHE, apply_watermark, load_font, overlay_cache_stats
+
+
+def legacy_apply(img: Image.Image, text: str, cfg: WatermarkSettings = WATERMARK_SETTINGS) -> Image.Image:
+    """The previous implementation: alpha_composite every tile into an RGBA overlay."""
+    W, H = img.size
+    overlay = Image.new("RGBA", (W, H), (0, 0, 0, 0))
+    font = load_font(max(cfg.min_font_size, int(max(W, H) * cfg.font_scale)), cfg)
+    tile_w = max(64, int(W * cfg.tile_scale_x))
+    tile_h = max(64, int(H * cfg.tile_scale_y))
+    tile = Image.new("RGBA", (tile_w, tile_h), (0, 0, 0, 0))
+    drawer = ImageDraw.Draw(tile)
+    bbox = drawer.textbbox((0, 0), text, font=font)
+    tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    if cfg.text_offset < 0:
+        pos = ((tile_w - tw) // 2, (tile_h - th) // 2)
+    else:
+        pos = (cfg.text_offset, cfg.text_offset)
+    drawer.text(pos, text, font=font, fill=(*cfg.color, max(16, min(255, cfg.opacity))))
+    tile = tile.rotate(cfg.angle, expand=True)
+    base_step = max(1, cfg.step)
+    step_x = max(base_step, tile.width // 2)
+    step_y = max(base_step, tile.height // 2)
+    for y in range(-tile.height, H + tile.height, step_y):
+        for x in range(-tile.width, W + tile.width, step_x):
+            overlay.alpha_composite(tile, dest=(x, y))
+    return Image.alpha_composite(img.convert("RGBA"), overlay).convert("RGB")
+
+
+def _make_pages(count: int, size: Tuple[int, int]) -> List[Image.Image]:
+    pages = []
+    for idx in range(count):
+        page = Image.new("RGB", size, (255, 255, 255))
+        draw = ImageDraw.Draw(page)
+        for row in range(0, size[1], 60):
+            draw.line((100, row, size[0] - 100, row), fill=(0, 0, 0), width=2)
+        draw.text((120, 120), f"page {idx + 1}", fill=(0, 0, 0))
+        pages.append(page)
+    return pages
+
+
+def _time(label: str, pages: List[Image.Image], fn: Callable[[Image.Image], Image.Image]) -> List[Image.Image]:
+    results = []
+    started = time.perf_counter()
+    for page in pages:
+        results.append(fn(page.copy()))
+    elapsed = time.perf_counter() - started
+    print(f"{label:<22} {elapsed * 1000 / len(pages):8.1f} ms/page  ({elapsed:.2f}s total)")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--size", default="2480x3508", help="page size WxH (default: A4 at 300 dpi)")
+    parser.add_argument("--text", default="SmetaBot • конфиденциально")
+    args = parser.parse_args()
+
+    width, height = (int(part) for part in args.size.lower().split("x"))
+    pages = _make_pages(args.pages, (width, height))
+
+    legacy = _time("legacy loop", pages, lambda img: legacy_apply(img, args.text))
+    _OVERLAY_CACHE.clear()
+    _time("engine (cold overlay)", pages[:1], lambda img: apply_watermark(img, args.text))
+    engine = _time("engine (cached)", pages, lambda img: apply_watermark(img, args.text))
+
+    diff = max(
+        max(high for _, high in ImageChops.difference(a, b).getextrema())
+        for a, b in zip(legacy, engine)
+    )
+    print(f"max channel difference vs legacy: {diff}")
+    print(f"overlay cache: {overlay_cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Minimal local stand-in for the Telegram Bot API.
+
+Accepts ``sendDocument`` / ``sendMediaGroup`` / ``getMe`` for any token and
+answers with Telegram-shaped JSON, so publish tasks can be exercised and
+benchmarked without touching api.telegram.org::
+
+    python -m worker.utils.stub_bot_api --port 8081 --latency-ms 40
+    TELEGRAM_API_BASE=http://127.0.0.1:8081 celery -A celery_app worker -Q publish
+
+``--flood-every N`` answers every N-th request with ``429`` and
+``retry_after``; ``--certfile``/``--keyfile`` serve HTTPS so the TLS handshake
+cost shows up in benchmarks.  Received calls are counted in ``stats``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional
+
+
+class StubBotApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, *, latency: float = 0.0, flood_every: int = 0, retry_after: int = 1) -> None:
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.message_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.stats: Dict[str, int] = {"requests": 0, "connections": 0, "flood": 0}
+
+    def count(self, name: str) -> int:
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+            return self.stats[name]
+
+    @property
+    def base_url(self) -> str:
+        scheme = "https" if isinstance(self.socket, ssl.SSLSocket) else "http"
+        host, port = self.server_address[:2]
+        return f"{scheme}://{host}:{port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    server: StubBotApiServer
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.count("connections")
+
+    def log_message(self, format: str, *args) -> None:  # noqa: A002 - stdlib signature
+        pass
+
+    def _reply(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _form(self) -> Dict[str, object]:
+        ctype = self.headers.get("Content-Type", "")
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        body = self.rfile.read(length)
+        if not ctype.startswith("multipart/form-data"):
+            return {}
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {ctype}\r\n\r\n".encode("latin-1") + body
+        )
+        fields: Dict[str, object] = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True) or b""
+            if part.get_filename():
+                fields[name] = {"file_name": part.get_filename(), "file_size": len(payload)}
+            else:
+                fields[name] = payload.decode("utf-8", "replace")
+        return fields
+
+    def _document(self, name: object, size: int = 0) -> dict:
+        message_id = next(self.server.message_ids)
+        return {
+            "file_id": f"stub-{message_id}",
+            "file_unique_id": f"u{message_id}",
+            "file_name": name,
+            "mime_type": "image/png",
+            "file_size": size,
+        }
+
+    def do_POST(self) -> None:  # noqa: N802 - stdlib naming
+        method = self.path.rsplit("/", 1)[-1]
+        fields = self._form()
+        requests_seen = self.server.count("requests")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.flood_every and requests_seen % self.server.flood_every == 0:
+            self.server.count("flood")
+            self._reply(429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.server.retry_after}",
+                "parameters": {"retry_after": self.server.retry_after},
+            })
+            return
+        chat_id = int(str(fields.get("chat_id", 0)) or 0)
+        if method == "sendDocument":
+            upload = fields.get("document") or {}
+            message = self._message(chat_id, document=self._document(upload.get("file_name"), upload.get("file_size", 0)))
+            self._reply(200, {"ok": True, "result": message})
+        elif method == "sendMediaGroup":
+            media = json.loads(str(fields.get("media") or "[]"))
+            result = []
+            for entry in media:
+                upload = fields.get(str(entry.get("media", "")).replace("attach://", "")) or {}
+                result.append(self._message(chat_id, document=self._document(upload.get("file_name"), upload.get("file_size", 0))))
+            self._reply(200, {"ok": True, "result": result})
+        elif method == "getMe":
+            self._reply(200, {"ok": True, "result": {"id": 1, "is_bot": True, "username": "stub_bot"}})
+        else:
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+
+    do_GET = do_POST
+
+    def _message(self, chat_id: int, **extra: object) -> dict:
+        return {
+            "message_id": next(self.server.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "channel"},
+            **extra,
+        }
+
+
+@contextmanager
+def serve(
+    *,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    latency: float = 0.0,
+    flood_every: int = 0,
+    retry_after: int = 1,
+    certfile: Optional[str] = None,
+    keyfile: Optional[str] = None,
+) -> Iterator[StubBotApiServer]:
+    """Run the stub in a background thread for the duration of the block."""
+    server = StubBotApiServer((host, port), latency=latency, flood_every=flood_every, retry_after=retry_after)
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--flood-every", type=int, default=0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--certfile")
+    parser.add_argument("--keyfile")
+    args = parser.parse_args()
+
+    with serve(
+        host=args.host,
+        port=args.port,
+        latency=args.latency_ms / 1000.0,
+        flood_every=args.flood_every,
+        retry_after=args.retry_after,
+        certfile=args.certfile,
+        keyfile=args.keyfile,
+    ) as server:
+        print(f"stub Bot API listening on {server.base_url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        print(f"stats: {server.stats}")
+
+
+if __name__ == "__main__":
+    main()